@@ -0,0 +1,431 @@
+#
+#   asyncwebapi.py
+#
+#   Non-blocking counterparts of the webapi Connection, Session and StatsReader classes.
+#
+#   Python 2 has no asyncio, so this module provides a small event loop of its own: a single
+#   scheduler thread owns every timer (poll intervals, timeouts), while the blocking HTTP
+#   round trips are handed to a bounded pool of worker threads sharing the Connection's
+#   pooled transport. Waiting sessions and stats streams therefore cost a timer entry, not a
+#   sleeping thread, and one loop can drive hundreds of them.
+#
+#   Operations return Future objects. They can be chained from coroutines: generator functions
+#   run with EventLoop.spawn() that yield Futures and receive their results, e.g.
+#
+#       def nightly(asyncConnection):
+#           session = yield asyncConnection.joinSession(26)
+#           testRun = yield session.runTest()
+#           raise Return(testRun.testId)
+#
+#       testId = loop.spawn(nightly(asyncConnection)).result()
+#
+
+import heapq
+import itertools
+import sys
+import threading
+import time
+import traceback
+import types
+import Queue
+import httplib
+
+from ixia.webapi import *
+
+
+class Return(Exception):
+    """Raised inside a coroutine to return a value (python 2 generators cannot 'return value')."""
+    def __init__(self, value=None):
+        super(Return, self).__init__()
+        self.value = value
+
+
+class EventLoop(object):
+    """A scheduler thread for timers and coroutines plus a bounded pool of workers for blocking calls.
+
+    @param maxWorkers: the max number of blocking HTTP calls in flight at once. This should not
+                       exceed the pool size of the transport used by the connections it drives.
+    """
+    kDefaultMaxWorkers = HttpTransport.kDefaultPoolMaxSize
+
+    _default = None
+    _defaultLock = threading.Lock()
+
+    def __init__(self, maxWorkers=kDefaultMaxWorkers):
+        Validators.checkInt(maxWorkers, "maxWorkers")
+        self._timers = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._work = Queue.Queue()
+        self.isClosed = False
+        self._thread = self._startThread(self._run, "ixia-event-loop")
+        self._workers = [self._startThread(self._runWorker, "ixia-event-worker-%d" % index) for index in range(maxWorkers)]
+
+    @classmethod
+    def getDefault(cls):
+        """Returns the event loop shared by objects that were not given an explicit loop."""
+        cls._defaultLock.acquire()
+        try:
+            if cls._default is None or cls._default.isClosed:
+                cls._default = cls()
+            return cls._default
+        finally:
+            cls._defaultLock.release()
+
+    @staticmethod
+    def _startThread(target, name):
+        thread = threading.Thread(target=target, name=name)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def callLater(self, delay, callback, *args):
+        """Runs callback(*args) on the loop thread after delay seconds. Callbacks must not block."""
+        self._condition.acquire()
+        try:
+            heapq.heappush(self._timers, (time.time() + delay, next(self._sequence), callback, args))
+            self._condition.notify()
+        finally:
+            self._condition.release()
+
+    def callSoon(self, callback, *args):
+        """Runs callback(*args) on the loop thread as soon as possible."""
+        self.callLater(0, callback, *args)
+
+    def sleep(self, delay):
+        """Returns a Future that completes after delay seconds."""
+        future = Future()
+        self.callLater(delay, future.setResult, None)
+        return future
+
+    def runInWorker(self, function, *args, **kwArgs):
+        """Runs a blocking function on a worker thread and returns a Future with its result."""
+        future = Future()
+        self._work.put((future, function, args, kwArgs))
+        return future
+
+    def spawn(self, generator):
+        """Runs a coroutine (a generator yielding Futures) on the loop and returns a Future with its Return value."""
+        future = Future()
+        self.callSoon(self._step, generator, future, None, None)
+        return future
+
+    def gather(self, futures):
+        """Returns a Future that completes with the list of results once all the futures complete.
+
+        The first exception raised by any of the futures is propagated.
+        """
+        result = Future()
+        futures = list(futures)
+        pending = [len(futures)]
+        lock = threading.Lock()
+        if not futures:
+            result.setResult([])
+            return result
+        def onDone(future):
+            if future._excInfo:
+                result._setExcInfo(future._excInfo)
+                return
+            lock.acquire()
+            try:
+                pending[0] -= 1
+                finished = pending[0] == 0
+            finally:
+                lock.release()
+            if finished:
+                result.setResult([each._result for each in futures])
+        for future in futures:
+            future.addDoneCallback(onDone)
+        return result
+
+    def close(self):
+        """Stops the loop and its workers. Pending operations are abandoned."""
+        self.isClosed = True
+        self._condition.acquire()
+        try:
+            self._condition.notify()
+        finally:
+            self._condition.release()
+        for worker in self._workers:
+            self._work.put(None)
+
+    def _step(self, generator, future, value, excInfo):
+        try:
+            if excInfo:
+                yielded = generator.throw(*excInfo)
+            else:
+                yielded = generator.send(value)
+        except Return, result:
+            future.setResult(result.value)
+            return
+        except StopIteration:
+            future.setResult(None)
+            return
+        except Exception:
+            future._setExcInfo(sys.exc_info())
+            return
+        if isinstance(yielded, types.GeneratorType):
+            yielded = self.spawn(yielded)
+        elif isinstance(yielded, list):
+            yielded = self.gather(yielded)
+        if not isinstance(yielded, Future):
+            future.setException(WebException("Coroutines may only yield Futures, lists of Futures or generators. Got %s" % type(yielded)))
+            return
+        yielded.addDoneCallback(lambda done: self.callSoon(self._resume, generator, future, done))
+
+    def _resume(self, generator, future, done):
+        self._step(generator, future, done._result, done._excInfo)
+
+    def _run(self):
+        while not self.isClosed:
+            self._condition.acquire()
+            try:
+                now = time.time()
+                while not self.isClosed and (not self._timers or self._timers[0][0] > now):
+                    self._condition.wait(self._timers and self._timers[0][0] - now or None)
+                    now = time.time()
+                due = []
+                while self._timers and self._timers[0][0] <= now:
+                    due.append(heapq.heappop(self._timers))
+            finally:
+                self._condition.release()
+            for when, sequence, callback, args in due:
+                try:
+                    callback(*args)
+                except Exception:
+                    traceback.print_exc()
+
+    def _runWorker(self):
+        while True:
+            item = self._work.get()
+            if item is None:
+                return
+            future, function, args, kwArgs = item
+            try:
+                result = function(*args, **kwArgs)
+            except Exception:
+                future._setExcInfo(sys.exc_info())
+            else:
+                future.setResult(result)
+
+
+def waitForPropertyAsync(loop, obj, propertyName, targetValues, validValues=[], invalidValues=[], timeout=None, trace=False, waitStrategy=None):
+    """Non-blocking version of waitForProperty(). Returns a Future that completes when the property reaches a target value.
+
+    Parameters are the same as for waitForProperty(), plus:
+    @param loop: the EventLoop that schedules the polls
+    """
+    return loop.spawn(_waitForProperty(loop, obj, propertyName, targetValues, validValues, invalidValues, timeout, trace, waitStrategy))
+
+def _waitForProperty(loop, obj, propertyName, targetValues, validValues, invalidValues, timeout, trace, waitStrategy):
+    waitStrategy = waitStrategy or kDefaultWaitStrategy
+    deadline = timeout and time.time() + timeout
+    interval = None
+    lastValue = None
+    while True:
+        yield loop.runInWorker(waitStrategy.refresh, obj)
+        value = getattr(obj, propertyName)
+        if trace:
+            print "property %s = %s" % (propertyName, value)
+        if value in targetValues:
+            return
+        if (validValues and value not in validValues) or value in invalidValues:
+            raise WebException("waitForProperty(): %s has invalid %s == %s" % (obj.__class__, propertyName, value))
+        interval = waitStrategy.nextInterval(interval, interval is not None and value != lastValue)
+        lastValue = value
+        if deadline:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise WebApiTimeout("waitForProperty(): %s timed out waiting for %s in %s" % (obj.__class__, propertyName, targetValues))
+            interval = min(interval, remaining)
+        yield loop.sleep(interval)
+
+def _pollAsyncOperation(loop, convention, reply):
+    # the connection's AsyncOperationPoller does the polling, so waiting costs neither a loop timer nor a worker
+    status = yield convention.pollAsyncOperation(reply)
+    raise Return(status)
+
+
+class AsyncConnection(object):
+    """Non-blocking wrapper of a Connection. Methods return Futures.
+
+    Synchronous Connection methods and properties not overridden here are available unchanged.
+    @param connection: the (already connected) Connection to wrap
+    @param loop: (optional) the EventLoop to use. Defaults to the shared loop.
+    """
+    def __init__(self, connection, loop=None):
+        Validators.checkNotNone(connection, "connection")
+        self.connection = connection
+        self.loop = loop or EventLoop.getDefault()
+
+    @classmethod
+    def connect(cls, siteUrl, siteVersion, userkey=None, username=None, password=None, loop=None, **kwArgs):
+        """Returns a Future with an AsyncConnection. Arguments are the same as for webApi.connect()."""
+        loop = loop or EventLoop.getDefault()
+        return loop.spawn(cls._connect(loop, siteUrl, siteVersion, userkey, username, password, **kwArgs))
+
+    @classmethod
+    def _connect(cls, loop, *args, **kwArgs):
+        connection = yield loop.runInWorker(webApi.connect, *args, **kwArgs)
+        raise Return(cls(connection, loop))
+
+    def __getattr__(self, attribute):
+        return getattr(self.connection, attribute)
+
+    def createSession(self, sessionType):
+        """Returns a Future with a new AsyncSession."""
+        return self.loop.spawn(self._wrapSession(self.connection.createSession, sessionType))
+
+    def joinSession(self, sessionId):
+        """Returns a Future with an AsyncSession joined to an existing session."""
+        return self.loop.spawn(self._wrapSession(self.connection.joinSession, sessionId))
+
+    def _wrapSession(self, factory, *args):
+        session = yield self.loop.runInWorker(factory, *args)
+        raise Return(AsyncSession(session, self.loop))
+
+    def getStatsCsvZipToFile(self, testOrResultId, statFile):
+        """Returns a Future that completes once the zipped CSV stats are written to statFile.
+
+        Parameters are the same as for Connection.getStatsCsvZipToFile().
+        """
+        Validators.checkInt(testOrResultId, "testOrResultId")
+        Validators.checkFile(statFile, "statFile")
+        return self.loop.spawn(self._getStatsCsvZipToFile(testOrResultId, statFile))
+
+    def _getStatsCsvZipToFile(self, testOrResultId, statFile):
+        connection = self.connection
+        reply = yield self.loop.runInWorker(connection.httpPostRaw, "results/%s/zip" % testOrResultId, stream=True)
+        if reply.status_code != httplib.ACCEPTED:
+            raise WebException("Unable to retrieve csv for test/result %s" % testOrResultId)
+        status = yield _pollAsyncOperation(self.loop, connection, reply)
+        yield self.loop.runInWorker(connection._httpStreamBinaryResultToFile, status.resultUrl, statFile)
+
+
+class AsyncSession(object):
+    """Non-blocking wrapper of a Session. Methods return Futures.
+
+    Synchronous Session methods and properties not overridden here are available unchanged.
+    @param session: the Session to wrap
+    @param loop: (optional) the EventLoop to use. Defaults to the shared loop.
+    """
+    def __init__(self, session, loop=None):
+        Validators.checkNotNone(session, "session")
+        self.session = session
+        self.loop = loop or EventLoop.getDefault()
+
+    def __getattr__(self, attribute):
+        return getattr(self.session, attribute)
+
+    def startSession(self):
+        """Returns a Future that completes when the session is active."""
+        return self.loop.spawn(self._changeSessionState(self.session.kOperationStartSession,
+                                                        [SessionState.kActive], [SessionState.kInitial, SessionState.kStarting]))
+
+    def stopSession(self):
+        """Returns a Future that completes when the session is stopped."""
+        return self.loop.spawn(self._changeSessionState(self.session.kOperationStopSession,
+                                                        [SessionState.kStopped], [SessionState.kActive, SessionState.kStopping]))
+
+    def _changeSessionState(self, operation, targetValues, validValues):
+        yield self.loop.runInWorker(self.session.httpPost, operation)
+        yield _waitForProperty(self.loop, self.session, "state", targetValues, validValues, [], None, False, self.session.waitStrategy)
+
+    def startTest(self, trace=False):
+        """Returns a Future with the testRun of the started test. See Session.startTest()."""
+        return self.loop.runInWorker(self.session.startTest, trace=trace)
+
+    def waitTestStopped(self, testId=None, timeout=None, trace=False, waitStrategy=None):
+        """Returns a Future that completes when the test stops. See Session.waitTestStopped()."""
+        return self.loop.spawn(self._waitTestStopped(testId, timeout, trace, waitStrategy))
+
+    def _waitTestStopped(self, testId, timeout, trace, waitStrategy=None):
+        if testId is not None:
+            testRun = yield self.loop.runInWorker(self.session.getTestRun, testId)
+        else:
+            testRun = self.session.getCurrentTestRun()
+            if not testRun:
+                raise ValueError("Either testId must be specified, or a current test must have been created using startTest().")
+        yield _waitForProperty(self.loop, testRun, "testState", [TestState.kStopped], [], [], timeout, trace,
+                               waitStrategy or self.session.waitStrategy)
+        yield self.loop.runInWorker(self.session.checkNotifications)
+        self.session.currentTestRun = None
+
+    def runTest(self, trace=False, waitStrategy=None):
+        """Returns a Future with the testRun once the test has run to completion. See Session.runTest()."""
+        return self.loop.spawn(self._runTest(trace, waitStrategy))
+
+    def _runTest(self, trace, waitStrategy):
+        result = yield self.startTest(trace=trace)
+        yield self._waitTestStopped(None, None, trace, waitStrategy)
+        raise Return(result)
+
+    def stopTest(self, testId=None, graceful=False, trace=False):
+        """Returns a Future that completes once the running test is stopped."""
+        return self.loop.spawn(self._stopTest(testId, graceful, trace))
+
+    def _stopTest(self, testId, graceful, trace):
+        testRun = self.session.getCurrentTestRun()
+        yield self.loop.runInWorker(self.session.httpPost, self.session.kOperationStopTestFormat % testRun.testId, WebObject(gracefulStop=graceful))
+        yield self._waitTestStopped(testId, None, trace)
+
+    def registerStatsRequest(self, statsRequest, capacity=None, overflowPolicy=None):
+        """Returns a Future with an AsyncStatsReader for the registered request. See Session.registerStatsRequest()."""
+        if not isinstance(statsRequest, StatsRequest):
+            raise ValueError("The '%s' parameter is not a StatsRequest object. Was %s." % ("statsRequest", statsRequest))
+        return self.loop.spawn(self._registerStatsRequest(statsRequest, capacity, overflowPolicy))
+
+    def _registerStatsRequest(self, statsRequest, capacity, overflowPolicy):
+        yield self.loop.runInWorker(self.session.httpPostRaw, "stats/registration?append=true", WebListProxy([statsRequest]))
+        raise Return(AsyncStatsReader(self, statsRequest, capacity, overflowPolicy))
+
+
+class AsyncStatsReader(object):
+    """Non-blocking counterpart of StatsReader. Get one from AsyncSession.registerStatsRequest().
+
+    Only one getNextSnapshot() call should be outstanding at a time per reader.
+    """
+    kDefaultTimeout = StatsReader.kDefaultTimeout
+    kPollInterval = 0.5
+
+    def __init__(self, asyncSession, statsRequest, capacity=None, overflowPolicy=None):
+        self.session = asyncSession.session
+        self.loop = asyncSession.loop
+        self.statsRequest = statsRequest
+        self._lastTimestamp = 0
+        # the queue is only filled from the loop, so puts never block; see StatsReader
+        self.snapshots = SnapshotQueue(capacity or SnapshotQueue.kDefaultCapacity, overflowPolicy or OverflowPolicy.kBlock)
+        self.isClosed = False
+
+    def getNextSnapshot(self, timeout=kDefaultTimeout):
+        """Returns a Future with the next Snapshot (or None if the reader was closed while waiting).
+
+        @raises StatsTimeoutException (through the Future) if no data arrives within timeout seconds.
+        """
+        return self.loop.spawn(self._getNextSnapshot(timeout))
+
+    def _getNextSnapshot(self, timeout):
+        deadline = time.time() + timeout
+        while not self.isClosed:
+            snapshot = self.snapshots.get()
+            if snapshot is not None:
+                raise Return(snapshot)
+            rawData = yield self.loop.runInWorker(self.session._getRealtimeData, self.statsRequest, self._lastTimestamp)
+            for snapshotData in rawData or []:
+                if snapshotData["timestamp"] <= self._lastTimestamp:
+                    continue
+                if not self.snapshots.put(Snapshot(snapshotData, self.statsRequest), block=False):
+                    break
+                self._lastTimestamp = snapshotData["timestamp"]
+            if len(self.snapshots):
+                continue
+            if time.time() >= deadline:
+                raise StatsTimeoutException("AsyncStatsReader.getNextSnapshot(): Timeout while trying to get values for queryId:" + self.statsRequest.id)
+            yield self.loop.sleep(self.kPollInterval)
+        raise Return(None)
+
+    def close(self):
+        """Returns a Future that completes when the request is unregistered from the server."""
+        self.isClosed = True
+        self.snapshots.close()
+        return self.loop.runInWorker(self.session._unregisterStatsRequest, self.statsRequest)
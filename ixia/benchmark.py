@@ -0,0 +1,336 @@
+#
+#   benchmark.py
+#
+#   Measurements of the client-side overhead of the webapi library.
+#
+#   runBenchmarks() times the main operations end to end against a local MockServer, and can be run
+#   from the command line to compare a build with a saved baseline:
+#
+#       python -m ixia.benchmark --save baseline.json
+#       python -m ixia.benchmark --baseline baseline.json
+#
+
+import copy
+import gc
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from ixia.webapi import *
+from ixia.webapi import _SlotWebObjectProxy
+from ixia.mockserver import MockServer
+from ixia.requestmetrics import LatencyHistogram
+
+
+def _deepSizeOf(value, seen):
+    # approximate number of bytes held by value and everything it references (shared objects counted once)
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    result = sys.getsizeof(value)
+    if isinstance(value, _SlotWebObjectProxy):
+        for fieldName, item in value._fieldItems_():
+            result += _deepSizeOf(item, seen)
+        if value._extras_:
+            result += sys.getsizeof(value.__dict__)
+    elif isinstance(value, WebObjectBase):
+        result += _deepSizeOf(value.__dict__, seen)
+        if isinstance(value, list):
+            for item in value:
+                result += _deepSizeOf(item, seen)
+    elif isinstance(value, dict):
+        for key, item in value.iteritems():
+            result += _deepSizeOf(key, seen) + _deepSizeOf(item, seen)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            result += _deepSizeOf(item, seen)
+    return result
+
+
+def compareWebObjectRepresentations(jsonValue, repeat=5):
+    """Builds web objects from jsonValue in each WebObjectRepresentation and reports the cost.
+
+    @param jsonValue: a parsed json reply (e.g. reply.json() of getAvailableStats or getUsers)
+    @param repeat: the number of builds to time. The best time is reported.
+    @return a dictionary mapping each representation to a dictionary with buildSeconds and bytes
+    """
+    Validators.checkInt(repeat, "repeat")
+    previous = WebObjectRepresentation.get()
+    result = {}
+    try:
+        for representation in [WebObjectRepresentation.kProxy, WebObjectRepresentation.kSlots]:
+            WebObjectRepresentation.set(representation)
+            best = None
+            for attempt in range(repeat):
+                # building may rename properties in place, so each build gets a fresh copy
+                value = copy.deepcopy(jsonValue)
+                gc.disable()
+                try:
+                    startTime = time.time()
+                    webObject = WebObject(value)
+                    elapsed = time.time() - startTime
+                finally:
+                    gc.enable()
+                if best is None or elapsed < best:
+                    best = elapsed
+            result[representation] = {"buildSeconds": best, "bytes": _deepSizeOf(webObject, set())}
+    finally:
+        WebObjectRepresentation.set(previous)
+    return result
+
+
+def formatRepresentationReport(report):
+    """Formats the result of compareWebObjectRepresentations() as a table."""
+    lines = ["%-10s %14s %14s" % ("mode", "build (ms)", "memory (KB)")]
+    for representation in sorted(report):
+        numbers = report[representation]
+        lines.append("%-10s %14.2f %14.1f" % (representation, numbers["buildSeconds"] * 1000, numbers["bytes"] / 1024.0))
+    return "\n".join(lines)
+
+
+class _LegacyJsonEncoder(json.JSONEncoder):
+    # the encoder used before JsonBackend: copies every proxy's properties
+    def default(self, obj):
+        if isinstance(obj, dict) or isinstance(obj, list):
+            return super(_LegacyJsonEncoder, self).default(obj)
+        return obj._jsonProperties_
+
+
+def compareJsonEncodings(webObject, repeat=5):
+    """Times the serialization of a web object with the legacy encoder and with the current JsonBackend.
+
+    @param webObject: the web object to serialize, e.g. a StatsRequest or a large configuration proxy
+    @param repeat: the number of serializations to time. The best time is reported.
+    @return a dictionary mapping "legacy" and the backend name to the best time in seconds
+    """
+    Validators.checkInt(repeat, "repeat")
+    encoders = {"legacy": lambda: json.dumps(webObject, cls=_LegacyJsonEncoder),
+                JsonBackend.name: lambda: str(webObject),
+                "legacy _json_": lambda: json.loads(json.dumps(webObject, cls=_LegacyJsonEncoder)),
+                "_json_": lambda: webObject._json_}
+    result = {}
+    for name, encoder in encoders.iteritems():
+        timings = []
+        for attempt in range(repeat):
+            startTime = time.time()
+            encoder()
+            timings.append(time.time() - startTime)
+        result[name] = min(timings)
+    return result
+
+
+def compareBootstrap(siteUrl, apiVersion, repeat=3, **connectArgs):
+    """Times connecting to a server with the full handshake and with a warm CapabilityCache.
+
+    @param siteUrl, apiVersion: as for webApi.connect()
+    @param repeat: the number of connections to time for each. The best time is reported.
+    @param connectArgs: the credentials (userkey or username and password) and other arguments of webApi.connect()
+    @return a dictionary mapping "handshake" and "cached" to the best Connection.bootstrapSeconds
+    """
+    Validators.checkInt(repeat, "repeat")
+    cacheDirectory = tempfile.mkdtemp()
+    try:
+        cache = CapabilityCache(os.path.join(cacheDirectory, "capabilities.json"))
+        result = {}
+        for name, extraArgs in [("handshake", {}), ("cached", {"capabilityCache": cache})]:
+            timings = []
+            # the first cached connection fills the cache, so it does not count
+            for attempt in range(repeat + (1 if extraArgs else 0)):
+                connectArgs.update(extraArgs)
+                connection = webApi.connect(siteUrl, apiVersion, **connectArgs)
+                connection.close()
+                if connection.bootstrapCached or not extraArgs:
+                    timings.append(connection.bootstrapSeconds)
+            result[name] = min(timings) if timings else None
+        return result
+    finally:
+        shutil.rmtree(cacheDirectory, True)
+
+
+class BenchmarkResult(object):
+    """The measurements of one benchmark of runBenchmarks().
+
+    @ivar name: the name of the benchmark
+    @ivar operations: the number of operations timed
+    @ivar seconds: the total time of the operations
+    @ivar bytes: the number of bytes transferred, for the download benchmarks
+    @ivar latency: a LatencyHistogram of the operation durations
+    """
+    def __init__(self, name):
+        self.name = name
+        self.operations = 0
+        self.seconds = 0.0
+        self.bytes = 0
+        self.latency = LatencyHistogram()
+
+    def record(self, seconds, bytes=0):
+        self.operations += 1
+        self.seconds += seconds
+        self.bytes += bytes
+        self.latency.record(seconds)
+
+    @property
+    def throughput(self):
+        """The number of operations per second."""
+        return self.operations / self.seconds if self.seconds else None
+
+    @property
+    def megabytesPerSecond(self):
+        return self.bytes / self.seconds / (1024 * 1024) if self.seconds and self.bytes else None
+
+    def asDict(self):
+        return {"operations": self.operations, "seconds": self.seconds, "bytes": self.bytes, "throughput": self.throughput,
+                "megabytesPerSecond": self.megabytesPerSecond, "p50": self.latency.percentile(50),
+                "p99": self.latency.percentile(99), "max": self.latency.max}
+
+
+def _timed(result, operation, repeat, size=None):
+    # times repeat calls of operation(), after an untimed one that warms up both sides (pooled connections,
+    # payloads built by the server). size is a function returning the number of bytes operation() transferred.
+    operation()
+    for attempt in range(repeat):
+        startTime = time.time()
+        operation()
+        result.record(time.time() - startTime, size() if size else 0)
+
+
+def _benchmarkBootstrap(server, repeat):
+    result = BenchmarkResult("bootstrap")
+    def connect():
+        webApi.connect(server.url, MockServer.kApiVersion, None, MockServer.kUsername, MockServer.kPassword).close()
+    _timed(result, connect, repeat)
+    return result
+
+
+def _benchmarkRunTest(connection, repeat):
+    result = BenchmarkResult("runTest")
+    session = connection.createSession(MockServer.kSessionType)
+    session.startSession()
+    try:
+        _timed(result, session.runTest, repeat)
+    finally:
+        session.stopSession()
+    return result
+
+
+def _benchmarkStatsPolling(connection, repeat, statsRows):
+    result = BenchmarkResult("statsPolling%s" % statsRows)
+    session = connection.createSession(MockServer.kSessionType)
+    session.startSession()
+    try:
+        stats = [Stat("mix:Flow")] + [Stat("mix:%s" % name) for name in ["Throughput", "Bytes Sent", "Bytes Received", "Response Time"]]
+        with session.registerStatsRequest(StatsRequest(stats)) as reader:
+            _timed(result, reader.getNextSnapshot, repeat)
+    finally:
+        session.stopSession()
+    return result
+
+
+def _benchmarkZipDownload(connection, repeat):
+    result = BenchmarkResult("zipDownload")
+    session = connection.createSession(MockServer.kSessionType)
+    session.startSession()
+    directory = tempfile.mkdtemp()
+    try:
+        testId = session.runTest().testId
+        path = os.path.join(directory, "stats.zip")
+        def download():
+            with open(path, "wb") as statsFile:
+                connection.getStatsCsvZipToFile(testId, statsFile)
+        _timed(result, download, repeat, lambda: os.path.getsize(path))
+    finally:
+        shutil.rmtree(directory, True)
+        session.stopSession()
+    return result
+
+
+kBenchmarks = ["bootstrap", "runTest", "statsPolling", "zipDownload"]
+
+
+def runBenchmarks(server=None, repeat=20, statsRows=10000, zipRows=200000, names=None):
+    """Runs the end-to-end benchmarks against a MockServer and returns a list of BenchmarkResults.
+
+    The benchmarks are the connection handshake, runTest, polling snapshots of statsRows rows, and
+    downloading a CSV stats zip of zipRows rows. With the default server (no latency, tests that stop at once)
+    the numbers are the client-side overhead of the library, so their changes show its regressions.
+
+    @param server: (optional) a started MockServer, e.g. with scripted latencies. Defaults to a local one without latency.
+    @param repeat: the number of operations timed by each benchmark
+    @param names: (optional) the names of the benchmarks to run (see kBenchmarks). Defaults to all.
+    """
+    Validators.checkInt(repeat, "repeat")
+    for name in names or []:
+        if name not in kBenchmarks:
+            raise ValueError("Unknown benchmark '%s'. Known benchmarks: %s." % (name, kBenchmarks))
+    ownServer = server is None
+    if ownServer:
+        server = MockServer(testDuration=0, asyncDuration=0, statsRows=statsRows, zipRows=zipRows).start()
+    try:
+        connection = webApi.connect(server.url, MockServer.kApiVersion, None, MockServer.kUsername, MockServer.kPassword)
+        benchmarks = {"bootstrap": lambda: _benchmarkBootstrap(server, repeat),
+                      "runTest": lambda: _benchmarkRunTest(connection, repeat),
+                      "statsPolling": lambda: _benchmarkStatsPolling(connection, repeat, server.statsRows),
+                      "zipDownload": lambda: _benchmarkZipDownload(connection, repeat)}
+        try:
+            return [benchmarks[name]() for name in kBenchmarks if names is None or name in names]
+        finally:
+            connection.close()
+    finally:
+        if ownServer:
+            server.stop()
+
+
+def formatBenchmarkReport(results):
+    """Formats the result of runBenchmarks() as a table."""
+    lines = ["%-20s %8s %10s %10s %10s %10s %10s" % ("benchmark", "ops", "ops/s", "p50 (ms)", "p99 (ms)", "max (ms)", "MB/s")]
+    for result in results:
+        latency = result.latency
+        lines.append("%-20s %8d %10.1f %10.2f %10.2f %10.2f %10s" % (result.name, result.operations, result.throughput or 0,
+                     latency.percentile(50) * 1000, latency.percentile(99) * 1000, latency.max * 1000,
+                     "%.1f" % result.megabytesPerSecond if result.megabytesPerSecond else "-"))
+    return "\n".join(lines)
+
+
+def compareBenchmarkResults(results, baseline, tolerance=0.2):
+    """Compares BenchmarkResults with a baseline and returns the regressions.
+
+    @param results: the list returned by runBenchmarks()
+    @param baseline: a dictionary mapping benchmark names to BenchmarkResult.asDict(), e.g. a file saved with benchmarkResultsToJson()
+    @param tolerance: the fraction of throughput that can be lost before a benchmark counts as a regression
+    @return a list of (name, baselineThroughput, throughput) for the benchmarks that got slower
+    """
+    regressions = []
+    for result in results:
+        previous = baseline.get(result.name)
+        if previous and previous.get("throughput") and result.throughput < previous["throughput"] * (1 - tolerance):
+            regressions.append((result.name, previous["throughput"], result.throughput))
+    return regressions
+
+
+def benchmarkResultsToJson(results):
+    """Returns the results of runBenchmarks() as json, to be used as a baseline by compareBenchmarkResults()."""
+    return json.dumps(dict((result.name, result.asDict()) for result in results), indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    import optparse
+    parser = optparse.OptionParser(usage="python -m ixia.benchmark [options]")
+    parser.add_option("--repeat", type="int", default=20, help="the number of operations timed by each benchmark")
+    parser.add_option("--save", help="save the results as json to this file")
+    parser.add_option("--baseline", help="compare the results with a json file saved with --save")
+    parser.add_option("--tolerance", type="float", default=0.2, help="the fraction of throughput that can be lost (default 0.2)")
+    options, args = parser.parse_args()
+    results = runBenchmarks(repeat=options.repeat, names=args or None)
+    print formatBenchmarkReport(results)
+    if options.save:
+        with open(options.save, "w") as resultFile:
+            resultFile.write(benchmarkResultsToJson(results))
+    if options.baseline:
+        with open(options.baseline) as baselineFile:
+            regressions = compareBenchmarkResults(results, json.load(baselineFile), options.tolerance)
+        for name, previous, current in regressions:
+            print "REGRESSION %s: %.1f ops/s -> %.1f ops/s" % (name, previous, current)
+        sys.exit(1 if regressions else 0)
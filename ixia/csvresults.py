@@ -0,0 +1,298 @@
+#
+#   csvresults.py
+#
+#   Streaming ingestion of the CSV stats zip of a test run.
+#
+#   The zip returned by Connection.getStatsCsvZipStream() is read member by member as it arrives
+#   from the server: each CSV file is inflated and parsed incrementally, so neither the archive nor
+#   a whole CSV file is ever held on disk or in memory.
+#
+
+import csv
+import fnmatch
+import struct
+import zlib
+
+from ixia.webapi import *
+
+
+kLocalFileHeaderSignature = "PK\x03\x04"
+kCentralDirectorySignature = "PK\x01\x02"
+kEndOfCentralDirectorySignature = "PK\x05\x06"
+kDataDescriptorSignature = "PK\x07\x08"
+
+kStored = 0
+kDeflated = 8
+
+# fields of the local file header, after the signature
+_kLocalFileHeader = struct.Struct("<HHHHHLLLHH")
+_kHasDataDescriptor = 0x08
+_kZip64ExtraId = 0x0001
+_kZip64Marker = 0xFFFFFFFF
+kDefaultChunkSize = 65536
+
+# The columns of the stats CSV files that hold names rather than numbers.
+kDefaultTextColumns = frozenset(["mix", "application", "user", "Source IP", "Destination IP"])
+
+
+class CsvZipException(WebException):
+    """The CSV stats zip could not be read."""
+    pass
+
+
+class _ChunkReader(object):
+    # reads bytes from an iterator of chunks of any size, buffering at most one chunk
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = ""
+
+    def readSome(self, maxSize=None):
+        # returns up to maxSize bytes (at least one), or "" at the end of the stream
+        if not self._buffer:
+            self._buffer = next(self._chunks, "")
+        if maxSize is None or len(self._buffer) <= maxSize:
+            result, self._buffer = self._buffer, ""
+        else:
+            result, self._buffer = self._buffer[:maxSize], self._buffer[maxSize:]
+        return result
+
+    def read(self, size):
+        parts = []
+        while size > 0:
+            data = self.readSome(size)
+            if not data:
+                raise CsvZipException("Unexpected end of the zip stream")
+            parts.append(data)
+            size -= len(data)
+        return "".join(parts)
+
+    def unread(self, data):
+        self._buffer = data + self._buffer
+
+
+def _zip64Sizes(extra):
+    # returns (uncompressedSize, compressedSize) from the zip64 extra field, or None
+    offset = 0
+    while offset + 4 <= len(extra):
+        fieldId, fieldSize = struct.unpack("<HH", extra[offset:offset + 4])
+        if fieldId == _kZip64ExtraId and fieldSize >= 16:
+            return struct.unpack("<QQ", extra[offset + 4:offset + 20])
+        offset += 4 + fieldSize
+    return None
+
+
+def _memberData(reader, method, flags, compressedSize, expectedCrc, isZip64):
+    # yields the uncompressed data of the member at the current position of reader
+    if method not in (kStored, kDeflated):
+        raise CsvZipException("Unsupported zip compression method %s" % method)
+    crc = 0
+    if flags & _kHasDataDescriptor:
+        # the sizes are only known at the end of the data, so the end is found by inflating
+        if method != kDeflated:
+            raise CsvZipException("Stored zip members with a data descriptor cannot be streamed")
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        while not decompressor.unused_data:
+            data = reader.readSome()
+            if not data:
+                raise CsvZipException("Unexpected end of the zip stream")
+            data = decompressor.decompress(data)
+            if data:
+                crc = zlib.crc32(data, crc)
+                yield data
+        data = decompressor.flush()
+        if data:
+            crc = zlib.crc32(data, crc)
+            yield data
+        reader.unread(decompressor.unused_data)
+        descriptor = reader.read(4)
+        if descriptor == kDataDescriptorSignature:
+            descriptor = reader.read(4)
+        expectedCrc = struct.unpack("<L", descriptor)[0]
+        reader.read(16 if isZip64 else 8)
+    else:
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS) if method == kDeflated else None
+        remaining = compressedSize
+        while remaining > 0:
+            data = reader.readSome(remaining)
+            if not data:
+                raise CsvZipException("Unexpected end of the zip stream")
+            remaining -= len(data)
+            if decompressor:
+                data = decompressor.decompress(data)
+            if data:
+                crc = zlib.crc32(data, crc)
+                yield data
+        if decompressor:
+            data = decompressor.flush()
+            if data:
+                crc = zlib.crc32(data, crc)
+                yield data
+    if (crc & 0xFFFFFFFF) != expectedCrc:
+        raise CsvZipException("CRC mismatch in the zip stream")
+
+
+def iterZipMembers(chunks):
+    """Reads a zip archive sequentially from an iterator of byte chunks.
+
+    Yields (name, data) for each member, where data is an iterator over the uncompressed chunks of the member.
+    The data of a member must be read before advancing to the next member; whatever is left unread is skipped.
+
+    @param chunks: an iterator of byte strings, e.g. Connection.getStatsCsvZipStream()
+    """
+    reader = _ChunkReader(chunks)
+    while True:
+        signature = reader.readSome(4)
+        if signature and len(signature) < 4:
+            signature += reader.read(4 - len(signature))
+        if signature in (kCentralDirectorySignature, kEndOfCentralDirectorySignature, ""):
+            return
+        if signature != kLocalFileHeaderSignature:
+            raise CsvZipException("Invalid zip stream: unexpected signature %r" % signature)
+        (version, flags, method, modTime, modDate, crc, compressedSize, uncompressedSize,
+         nameLength, extraLength) = _kLocalFileHeader.unpack(reader.read(_kLocalFileHeader.size))
+        name = reader.read(nameLength)
+        extra = reader.read(extraLength)
+        zip64Sizes = _zip64Sizes(extra)
+        if zip64Sizes and compressedSize == _kZip64Marker:
+            compressedSize = zip64Sizes[1]
+        data = _memberData(reader, method, flags, compressedSize, crc, zip64Sizes is not None)
+        yield name, data
+        for chunk in data:
+            pass
+
+
+def _iterLines(chunks):
+    # splits chunks into lines, keeping the line endings so that the csv module can join quoted newlines
+    tail = ""
+    for chunk in chunks:
+        lines = (tail + chunk).split("\n")
+        tail = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    if tail:
+        yield tail
+
+
+def _parseNumber(cell):
+    if cell == Snapshot.kNotAvailable or not cell:
+        return None
+    try:
+        return int(cell)
+    except ValueError:
+        try:
+            return float(cell)
+        except ValueError:
+            return cell
+
+
+def _parseFloat(cell):
+    # for the columns the schema says are floating point
+    if cell == Snapshot.kNotAvailable or not cell:
+        return None
+    try:
+        return float(cell)
+    except ValueError:
+        return cell
+
+
+def _parseText(cell):
+    if cell == Snapshot.kNotAvailable:
+        return None
+    return cell
+
+
+class CsvResultMember(object):
+    """One CSV file of the stats zip. Iterating over it yields its rows as lists of values.
+
+    Cells with "N/A" are None, numeric cells are ints or floats and the text columns are strings.
+    The rows must be read before advancing to the next member.
+
+    @ivar name: the name of the file in the zip, e.g. ixchariot_mix_application_user.csv
+    @ivar columns: the names of the selected columns, in the order of the values in each row
+    @ivar statColumns: the StatColumns of the header of the file, shared by the files with the same header
+    """
+    def __init__(self, name, data, columns=None, textColumns=None, schema=None):
+        self.name = name
+        self._reader = csv.reader(_iterLines(data))
+        self.statColumns = StatColumns.of(next(self._reader, []))
+        if columns is None:
+            columns = self.statColumns.definitions
+        missing = [column for column in columns if column not in self.statColumns]
+        if missing:
+            raise ValueError("The columns %s are not in %s" % (missing, name))
+        if textColumns is None:
+            textColumns = kDefaultTextColumns
+        self.columns = list(columns)
+        self._indexes = [self.statColumns.indexOf(column) for column in self.columns]
+        self._parsers = [self._parserOf(column, textColumns, schema) for column in self.columns]
+
+    @staticmethod
+    def _parserOf(column, textColumns, schema):
+        if column in textColumns:
+            return _parseText
+        typeCodes = set(columns.typeCodeOf(column) for columns in schema.groups.itervalues() if column in columns) if schema else ()
+        if typeCodes == {StatColumns.kTextTypeCode}:
+            return _parseText
+        if typeCodes == {Snapshot.kFloatTypeCode}:
+            return _parseFloat
+        return _parseNumber
+
+    def __iter__(self):
+        indexes = self._indexes
+        parsers = self._parsers
+        for cells in self._reader:
+            if not cells:
+                continue
+            yield [parse(cells[index]) if index < len(cells) else None for index, parse in zip(indexes, parsers)]
+
+    def iterDicts(self):
+        """Yields the rows as dictionaries mapping column names to values."""
+        for row in self:
+            yield dict(zip(self.columns, row))
+
+
+def iterCsvZip(chunks, members=None, columns=None, textColumns=None, schema=None):
+    """Parses a CSV stats zip as it is read and yields a CsvResultMember for each selected CSV file.
+
+    @param chunks: an iterator of byte strings with the zip data, e.g. Connection.getStatsCsvZipStream()
+    @param members: (optional) a list of member names or wildcard patterns (e.g. "ixchariot_mix*.csv"). Defaults to all the CSV files.
+    @param columns: (optional) the names of the columns to return. Defaults to all.
+                    Members without all of these columns are skipped.
+    @param textColumns: (optional) the columns that are returned as strings. Defaults to kDefaultTextColumns.
+    @param schema: (optional) the StatsSchema of the test (see Connection.getStatsSchema()). The stats it types as
+                   text are returned as strings too, and floating point stats are parsed as floats at once.
+    """
+    if members is not None:
+        Validators.checkList(members, "members")
+    if columns is not None:
+        Validators.checkList(columns, "columns")
+    return _iterCsvZip(chunks, members, columns, textColumns, schema)
+
+
+def _iterCsvZip(chunks, members, columns, textColumns, schema):
+    patterns = members or ["*.csv"]
+    for name, data in iterZipMembers(chunks):
+        if not any(fnmatch.fnmatch(name, pattern) for pattern in patterns):
+            continue
+        try:
+            member = CsvResultMember(name, data, columns, textColumns, schema)
+        except ValueError:
+            if members is not None and name in members:
+                raise
+            continue
+        yield member
+
+
+def iterStatsCsvZip(connection, testOrResultId, members=None, columns=None, textColumns=None, useSchema=False):
+    """Retrieves the CSV stats zip of a test and yields a CsvResultMember for each selected CSV file as it arrives.
+
+    Nothing is written to disk and memory use does not grow with the size of the results.
+
+    @param connection: the Connection to the web server
+    @param testOrResultId: the test Id. Typically obtained by using the testId member of the WebObject returned by runTest.
+    @param useSchema: (optional) if True, type the columns with the (cached) schema of the test. See iterCsvZip().
+    Other parameters are the same as for iterCsvZip().
+    """
+    Validators.checkNotNone(connection, "connection")
+    schema = connection.getStatsSchema(testOrResultId) if useSchema else None
+    return iterCsvZip(connection.getStatsCsvZipStream(testOrResultId, kDefaultChunkSize), members, columns, textColumns, schema)
@@ -0,0 +1,421 @@
+#
+#   mockserver.py
+#
+#   An in-process mock of the Ixia web app server, for measuring the client-side cost of the
+#   webapi library without a chassis (see benchmark.runBenchmarks).
+#
+#   The server implements the endpoints the library uses: the connection handshake (versions,
+#   auth/session, scriptapi/versions, auth/ping), sessions and their operations, test runs,
+#   stats registration, polling and schemas, configurations, and the 202 + status url flow of result zips,
+#   CSV exports, diagnostics and configuration loads. Latencies and payload sizes are scripted:
+#
+#       server = MockServer(latency=0.002, latencies={"sessions/{id}/stats/data/cache": 0.01}, statsRows=10000).start()
+#       connection = webApi.connect(server.url, "v1", "", MockServer.kUsername, MockServer.kPassword)
+#       ...
+#       server.stop()
+#
+
+import BaseHTTPServer
+import SocketServer
+import collections
+import fnmatch
+import json
+import socket
+import sys
+import threading
+import time
+import zipfile
+from cStringIO import StringIO
+from urlparse import parse_qs, urlsplit
+
+from ixia.webapi import *
+
+
+class MockServer(object):
+    """A threaded HTTP server answering like an Ixia web app server, with scripted latencies and payload sizes.
+
+    @param latency: the number of seconds every request waits before being answered
+    @param latencies: (optional) a dictionary mapping url templates (as RequestInfo.templateOf() makes them, relative
+                      to /api/v1, wildcards allowed) to the latency of their requests, e.g. {"sessions/{id}/testruns*": 0.05}
+    @param testDuration: the number of seconds a test runs
+    @param asyncDuration: the number of seconds asynchronous operations (202 replies) take to complete
+    @param statsRows: the number of rows of each stats snapshot
+    @param statsInterval: the number of seconds between two stats snapshots. 0 makes a new snapshot for every poll.
+    @param zipRows: the number of rows of the CSV file in the result zips
+    @param configurationCount: the number of configurations of each session type
+    @param exportSize: the size, in bytes, of exported configurations and diagnostics
+    """
+    kApiVersion = "v1"
+    kUsername = "admin"
+    kPassword = "admin"
+    kApiKey = "mock-api-key"
+    kSessionType = "ixchariot"
+    kDefaultStatsRows = 100
+    kDefaultZipRows = 10000
+    kDefaultConfigurationCount = 100
+    kDefaultExportSize = 1024 * 1024
+    kZipMember = "ixchariot_mix_application.csv"
+    # the stat groups served by results/{id}/schema: group -> [(stat name, type)]. The first stat of each group is its key.
+    kStatsSchema = collections.OrderedDict([
+        ("mix", [("Flow", "string"), ("Throughput", "double"), ("Bytes Sent", "long"), ("Bytes Received", "long"), ("Response Time", "double")]),
+        ("application", [("Application", "string"), ("Throughput", "double"), ("Transactions", "long")])])
+
+    def __init__(self, latency=0, latencies=None, testDuration=0.2, asyncDuration=0.1, statsRows=kDefaultStatsRows,
+                 statsInterval=0, zipRows=kDefaultZipRows, configurationCount=kDefaultConfigurationCount, exportSize=kDefaultExportSize):
+        Validators.checkInt(statsRows, "statsRows")
+        Validators.checkInt(zipRows, "zipRows")
+        Validators.checkInt(configurationCount, "configurationCount")
+        Validators.checkInt(exportSize, "exportSize")
+        self.latency = latency
+        self.latencies = dict(latencies or {})
+        self.testDuration = testDuration
+        self.asyncDuration = asyncDuration
+        self.statsRows = statsRows
+        self.statsInterval = statsInterval
+        self.zipRows = zipRows
+        self.configurationCount = configurationCount
+        self.exportSize = exportSize
+        self.requestCounts = {}
+        self.sessions = {}
+        self.testRuns = {}
+        self.operations = {}
+        self.downloads = {}
+        self.statsRequests = {}
+        self._lock = threading.Lock()
+        self._nextId = 1
+        self._statsPayloads = {}
+        self._zip = None
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        """The site url to connect to, e.g. http://127.0.0.1:53412"""
+        return "http://%s:%s" % self._server.server_address[:2]
+
+    def start(self):
+        """Starts answering requests on a free local port and returns self."""
+        self._server = _MockHttpServer(("127.0.0.1", 0), _MockRequestHandler)
+        self._server.mock = self
+        self._thread = threading.Thread(target=self._server.serve_forever, name="MockServer")
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops the server."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+
+    def resetCounts(self):
+        """Clears requestCounts."""
+        with self._lock:
+            self.requestCounts = {}
+
+    def latencyOf(self, template):
+        for pattern, latency in self.latencies.iteritems():
+            if fnmatch.fnmatch(template, pattern):
+                return latency
+        return self.latency
+
+    def newId(self):
+        with self._lock:
+            result = self._nextId
+            self._nextId += 1
+            return result
+
+    def count(self, method, template):
+        with self._lock:
+            key = "%s %s" % (method, template)
+            self.requestCounts[key] = self.requestCounts.get(key, 0) + 1
+
+    def startOperation(self, resultData=None):
+        # starts an asynchronous operation and returns its id. resultData (a string) is served at its resultUrl.
+        operationId = self.newId()
+        self.operations[operationId] = time.time()
+        if resultData is not None:
+            self.downloads[operationId] = resultData
+        return operationId
+
+    def statsPayload(self, columnCount, limit=0):
+        # the json of the rows of a snapshot with columnCount stats (and at most limit rows), built once
+        rowCount = min(limit, self.statsRows) if limit else self.statsRows
+        payload = self._statsPayloads.get((columnCount, rowCount))
+        if payload is None:
+            rows = [[row * 10 + column if column else "flow %s" % row for column in range(columnCount)] for row in range(rowCount)]
+            payload = self._statsPayloads[(columnCount, rowCount)] = json.dumps(rows)
+        return payload
+
+    def zipData(self):
+        # a CSV stats zip of zipRows rows, built once
+        if self._zip is None:
+            csvData = StringIO()
+            csvData.write("timestamp,mix,application,Throughput,Bytes Sent,Response Time\n")
+            for row in range(self.zipRows):
+                csvData.write("%s,mix %s,app %s,%s,%s,%s\n" % (row * 1000, row % 4, row % 16, row * 1.5, row * 1024, row % 97))
+            data = StringIO()
+            with zipfile.ZipFile(data, "w", zipfile.ZIP_DEFLATED) as archive:
+                archive.writestr(self.kZipMember, csvData.getvalue())
+            self._zip = data.getvalue()
+        return self._zip
+
+    def exportData(self):
+        return ("mock export data " * (self.exportSize // 17 + 1))[:self.exportSize]
+
+
+class _MockHttpServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def handle_error(self, request, clientAddress):
+        # clients closing their connections early (e.g. streamed downloads that are abandoned) are not errors
+        if not isinstance(sys.exc_info()[1], socket.error):
+            BaseHTTPServer.HTTPServer.handle_error(self, request, clientAddress)
+
+
+class _MockRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # replies are written in one piece, so small replies are not delayed by Nagle's algorithm
+    wbufsize = 64 * 1024
+    kApiBase = "/api/" + MockServer.kApiVersion
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch(HttpConvention.kMethodGet)
+
+    def do_POST(self):
+        self._dispatch(HttpConvention.kMethodPost)
+
+    def do_PUT(self):
+        self._dispatch(HttpConvention.kMethodPut)
+
+    def do_DELETE(self):
+        self._dispatch(HttpConvention.kMethodDelete)
+
+    def _dispatch(self, method):
+        mock = self.server.mock
+        parts = urlsplit(self.path)
+        self.query = parse_qs(parts.query)
+        length = int(self.headers.get("Content-Length") or 0)
+        self.body = self.rfile.read(length) if length else ""
+        path = parts.path.rstrip("/")
+        # /api/versions is the only endpoint outside of /api/v1
+        template = RequestInfo.templateOf(path, self.kApiBase if path != "/api/versions" else "/api")
+        mock.count(method, template)
+        latency = mock.latencyOf(template)
+        if latency:
+            time.sleep(latency)
+        segments = template.split("/")
+        ids = [int(segment) for segment in path.split("/") if segment.isdigit()]
+        handler = getattr(self, "_%s_%s" % (method.lower(), segments[0]), None)
+        if handler is None:
+            return self._send({"error": "Not found: %s %s" % (method, path)}, httplib.NOT_FOUND)
+        handler(mock, segments, ids)
+
+    def _send(self, value, status=httplib.OK, headers=None, raw=None, contentType="application/json"):
+        body = raw if raw is not None else (json.dumps(value) if value is not None else "")
+        self.send_response(status)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(body)))
+        for name, headerValue in (headers or {}).iteritems():
+            self.send_header(name, headerValue)
+        self.end_headers()
+        if self.command != HttpConvention.kMethodHead:
+            self.wfile.write(body)
+
+    def _url(self, path):
+        return "http://%s:%s%s/%s" % (self.server.server_address[0], self.server.server_address[1], self.kApiBase, path)
+
+    def _accepted(self, mock, resultData=None):
+        operationId = mock.startOperation(resultData)
+        return self._send({"url": self._url("status/%s" % operationId), "progress": 0, "state": "IN_PROGRESS"}, httplib.ACCEPTED)
+
+    # the handlers are named _<method>_<first segment of the url template>
+
+    def _get_versions(self, mock, segments, ids):
+        self._send([{"version": MockServer.kApiVersion}])
+
+    def _get_scriptapi(self, mock, segments, ids):
+        self._send([{"version": version} for version in kSupportedScriptApiVersions])
+
+    def _get_auth(self, mock, segments, ids):
+        if segments[1] == "ping":
+            return self._send({"status": "ok"})
+        if segments[1:] == ["session", "key"]:
+            return self._send({"apiKey": MockServer.kApiKey})
+        if segments[1:] == ["session"]:
+            return self._send({"userAccountUrl": self._url("auth/users/1")})
+        self._send({"error": "Not found"}, httplib.NOT_FOUND)
+
+    def _post_auth(self, mock, segments, ids):
+        credentials = json.loads(self.body or "{}")
+        if credentials.get("username") != MockServer.kUsername or credentials.get("password") != MockServer.kPassword:
+            return self._send({"error": "Unauthorized"}, httplib.UNAUTHORIZED)
+        self._send({})
+
+    def _delete_auth(self, mock, segments, ids):
+        self._send(None)
+
+    def _get_notifications(self, mock, segments, ids):
+        self._send([])
+
+    def _session(self, mock, sessionId):
+        session = dict(mock.sessions[sessionId])
+        session["links"] = [{"rel": "self", "method": "GET", "href": self._url("sessions/%s" % sessionId)}]
+        return session
+
+    def _get_sessions(self, mock, segments, ids):
+        if len(segments) == 1:
+            return self._send([self._session(mock, sessionId) for sessionId in sorted(mock.sessions)])
+        if ids[0] not in mock.sessions:
+            return self._send({"error": "No such session"}, httplib.NOT_FOUND)
+        if len(segments) == 2:
+            return self._send(self._session(mock, ids[0]))
+        if segments[2] == "testruns":
+            testRun = mock.testRuns[ids[1]]
+            elapsed = time.time() - testRun["started"] if testRun["started"] else None
+            if elapsed is None:
+                state = TestState.kNotStarted
+            elif testRun["stopped"] or elapsed >= mock.testDuration:
+                state = TestState.kStopped
+            else:
+                state = TestState.kRunning
+            return self._send({"testId": ids[1], "testState": state,
+                               "links": [{"rel": "self", "method": "GET", "href": self._url("sessions/%s/testruns/%s" % tuple(ids))}]})
+        self._send({"error": "Not found"}, httplib.NOT_FOUND)
+
+    def _post_sessions(self, mock, segments, ids):
+        if len(segments) == 1:
+            sessionId = mock.newId()
+            data = json.loads(self.body or "{}")
+            mock.sessions[sessionId] = {"id": sessionId, "applicationType": data.get("applicationType", MockServer.kSessionType),
+                                        "state": SessionState.kInitial, "testConfigName": None}
+            return self._send(self._session(mock, sessionId), httplib.CREATED, {"Location": self._url("sessions/%s" % sessionId)})
+        session = mock.sessions[ids[0]]
+        operation = segments[2:]
+        if operation == ["operations", "start"]:
+            session["state"] = SessionState.kActive
+            return self._send(None)
+        if operation == ["operations", "stop"]:
+            session["state"] = SessionState.kStopped
+            return self._send(None)
+        if operation == ["testruns"]:
+            testId = mock.newId()
+            mock.testRuns[testId] = {"started": None, "stopped": False}
+            location = self._url("sessions/%s/testruns/%s" % (ids[0], testId))
+            return self._send({"testId": testId, "testState": TestState.kNotStarted, "links": [{"rel": "self", "href": location}]},
+                              httplib.CREATED, {"Location": location})
+        if operation[0] == "testruns" and operation[2:] == ["operations", "start"]:
+            mock.testRuns[ids[1]]["started"] = time.time()
+            return self._send(None)
+        if operation[0] == "testruns" and operation[2:] == ["operations", "stop"]:
+            mock.testRuns[ids[1]]["stopped"] = True
+            return self._send(None)
+        if operation[0] == "config" and operation[2:] in (["operations", "load"], ["operations", "save"]):
+            session["testConfigName"] = json.loads(self.body or "{}").get("name")
+            return self._accepted(mock)
+        if operation[:1] == ["stats"]:
+            return self._postStats(mock, session, operation[1:])
+        self._send({"error": "Not found"}, httplib.NOT_FOUND)
+
+    def _postStats(self, mock, session, operation):
+        statsRequests = json.loads(self.body or "[]")
+        if operation == ["registration"]:
+            for statsRequest in statsRequests:
+                mock.statsRequests[statsRequest["id"]] = {"columns": len(statsRequest["groups"][0]["stats"]),
+                                                          "limit": statsRequest.get("limit") or 0, "registered": time.time()}
+            return self._send(None)
+        if operation == ["deregistration"]:
+            for statsRequest in statsRequests:
+                mock.statsRequests.pop(statsRequest["id"], None)
+            return self._send(None)
+        if operation == ["data", "cache"]:
+            startTimestamp = long(self.query.get("startTimestamp", ["0"])[0])
+            snapshots = []
+            for statsRequest in statsRequests:
+                registration = mock.statsRequests.get(statsRequest["id"])
+                if registration is None:
+                    continue
+                # the timestamp of the latest snapshot, in ms. Every poll gets a new snapshot when statsInterval is 0.
+                if mock.statsInterval:
+                    timestamp = int((time.time() - registration["registered"]) / mock.statsInterval) * int(mock.statsInterval * 1000) + 1
+                else:
+                    timestamp = max(startTimestamp + 1, int(time.time() * 1000))
+                data = '[{"timestamp": %d, "values": %s}]' % (timestamp, mock.statsPayload(registration["columns"], registration["limit"])) \
+                       if timestamp > startTimestamp else "[]"
+                snapshots.append('%s: %s' % (json.dumps(statsRequest["id"]), data))
+            return self._send(None, raw='{"map": {%s}}' % ", ".join(snapshots))
+        self._send({"error": "Not found"}, httplib.NOT_FOUND)
+
+    def _get_status(self, mock, segments, ids):
+        startTime = mock.operations[ids[0]]
+        progress = 100 if not mock.asyncDuration else min(100, int(100 * (time.time() - startTime) / mock.asyncDuration))
+        status = {"url": self._url("status/%s" % ids[0]), "progress": progress, "state": "SUCCESS" if progress >= 100 else "IN_PROGRESS"}
+        if ids[0] in mock.downloads:
+            status["resultUrl"] = self._url("download/%s" % ids[0])
+        self._send(status)
+
+    def _get_download(self, mock, segments, ids):
+        self._sendBinary(mock.downloads[ids[0]], '"%s"' % ids[0])
+
+    def _sendBinary(self, data, etag):
+        # supports the single byte ranges used by StreamingDownload and SegmentedDownload
+        start, end = 0, len(data)
+        headers = {"ETag": etag}
+        byteRange = self.headers.get("Range")
+        status = httplib.OK
+        if byteRange and byteRange.startswith("bytes=") and self.headers.get("If-Range", etag) == etag:
+            first, last = byteRange[len("bytes="):].split("-")
+            start, end = int(first), min(int(last) + 1 if last else len(data), len(data))
+            headers["Content-Range"] = "bytes %s-%s/%s" % (start, end - 1, len(data))
+            status = httplib.PARTIAL_CONTENT
+        self._send(None, status, headers, raw=data[start:end], contentType="application/octet-stream")
+
+    def _get_results(self, mock, segments, ids):
+        if segments[2:] == ["schema"]:
+            return self._send({"groups": [{"name": group, "stats": [{"name": name, "type": statType} for name, statType in stats]}
+                                          for group, stats in MockServer.kStatsSchema.iteritems()]})
+        self._send({"error": "Not found"}, httplib.NOT_FOUND)
+
+    def _post_results(self, mock, segments, ids):
+        if segments[2] == "zip":
+            return self._accepted(mock, mock.zipData())
+        if segments[2] == "csv":
+            return self._accepted(mock, mock.zipData())
+        self._send({"error": "Not found"}, httplib.NOT_FOUND)
+
+    def _post_diagnostics(self, mock, segments, ids):
+        self._accepted(mock, mock.exportData())
+
+    def _get_configurations(self, mock, segments, ids):
+        if len(segments) == 2:
+            configurations = [{"id": configId, "name": "config %s" % configId, "description": ""}
+                              for configId in range(1, mock.configurationCount + 1)]
+            etag = '"%s"' % mock.configurationCount
+            if self.headers.get("If-None-Match") == etag:
+                return self._send(None, httplib.NOT_MODIFIED, {"ETag": etag})
+            return self._send(configurations, headers={"ETag": etag})
+        if segments[3:] == ["export"]:
+            return self._sendBinary(mock.exportData(), '"export-%s"' % ids[0])
+        self._send({"error": "Not found"}, httplib.NOT_FOUND)
+
+    def _post_configurations(self, mock, segments, ids):
+        self._send({"id": mock.newId()})
+
+    def _delete_configurations(self, mock, segments, ids):
+        self._send(None)
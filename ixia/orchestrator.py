@@ -0,0 +1,447 @@
+#
+#   orchestrator.py
+#
+#   Runs batches of tests concurrently across one or more web servers.
+#
+#   Each server gets a fixed number of lanes (its concurrency limit). A lane is a thread that owns
+#   one session on its server and runs the queued jobs one after the other in that session, loading
+#   each job's configuration first. When a test stops, the lane hands the result download to a
+#   bounded pool of download threads and immediately starts its next test, so the chassis never
+#   waits for a zip to be built and transferred.
+#
+#       orchestrator = Orchestrator([connection1, connection2], maxTestsPerServer=2, resultDirectory="/results")
+#       results = orchestrator.run([TestJob(configName=name) for name in nightlyConfigs])
+#       orchestrator.close()
+#
+#   runSessionJobs() runs jobs the same way in a session of the caller, on the caller's thread
+#   (see Session.runTestLoop()).
+#
+
+import collections
+import os
+import re
+import threading
+import time
+import Queue
+
+from ixia.webapi import *
+
+
+class TestJob(object):
+    """A test to run.
+
+    @param configName: (optional) the configuration to load before running. Defaults to the configuration the session has.
+    @param sessionId: (optional) run in this existing session instead of a session of the orchestrator. The server
+                      of the session must then be set, unless the orchestrator has a single connection.
+    @param sessionType: the type of the sessions created for the job. Default is "ixchariot".
+    @param server: (optional) the Connection (or its index in the orchestrator's connections) to run on. Default is any.
+    @param name: (optional) a name for the job, used for the result file (with the characters not valid in file
+                 names replaced). Defaults to configName.
+    """
+    kDefaultSessionType = "ixchariot"
+
+    def __init__(self, configName=None, sessionId=None, sessionType=kDefaultSessionType, server=None, name=None):
+        if configName is not None:
+            Validators.checkConfigName(configName)
+        if sessionId is not None:
+            Validators.checkInt(sessionId, "sessionId")
+        Validators.checkSessionType(sessionType)
+        self.configName = configName
+        self.sessionId = sessionId
+        self.sessionType = sessionType
+        self.server = server
+        self.name = name or configName
+
+    def __repr__(self):
+        return "TestJob(%s)" % ", ".join("%s=%r" % item for item in sorted(self.__dict__.items()) if item[1] is not None)
+
+
+class TestJobResult(object):
+    """The outcome of a TestJob.
+
+    @ivar job: the TestJob
+    @ivar server: the url of the server the test ran on
+    @ivar sessionId: the id of the session the test ran in
+    @ivar testId: the id of the test run, or None if the test could not be started
+    @ivar download: the value returned by the orchestrator's downloader (e.g. the path of the zip file)
+    @ivar error: the exception that made the job fail, or None
+    @ivar queuedSeconds, testSeconds, downloadSeconds: where the time went
+    """
+    def __init__(self, job):
+        self.job = job
+        self.server = None
+        self.sessionId = None
+        self.testId = None
+        self.download = None
+        self.error = None
+        self.queuedSeconds = None
+        self.testSeconds = None
+        self.downloadSeconds = None
+
+    @property
+    def succeeded(self):
+        return self.error is None
+
+    def __repr__(self):
+        return "TestJobResult(%r, testId=%s, error=%r)" % (self.job.name, self.testId, self.error)
+
+
+class _QueuedJob(object):
+    def __init__(self, job, connection):
+        self.job = job
+        self.connection = connection
+        self.result = TestJobResult(job)
+        self.future = Future()
+        self.queuedTime = time.time()
+
+    def finish(self, error=None):
+        if error is not None:
+            self.result.error = error
+        self.future.setResult(self.result)
+
+
+class _DownloadPool(object):
+    # runs the downloads of finished tests on maxDownloads threads. put() blocks while maxPending downloads are
+    # queued or in progress, and downloads on the caller's thread when there are no download threads.
+    def __init__(self, downloader, maxDownloads, maxPending, name):
+        self.downloader = downloader
+        self._queue = Queue.Queue()
+        self._slots = threading.BoundedSemaphore(max(maxPending, 1))
+        self._threads = [threading.Thread(target=self._run, name="%s-download-%s" % (name, index))
+                         for index in range(maxDownloads)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def put(self, connection, queuedJob):
+        if not self._threads:
+            self._download(connection, queuedJob)
+            return
+        self._slots.acquire()
+        self._queue.put((connection, queuedJob))
+
+    def close(self):
+        # waits for the queued downloads
+        for thread in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            try:
+                self._download(*item)
+            finally:
+                self._slots.release()
+
+    def _download(self, connection, queuedJob):
+        startTime = time.time()
+        try:
+            queuedJob.result.download = self.downloader(connection, queuedJob.job, queuedJob.result.testId)
+        except Exception as e:
+            queuedJob.result.error = e
+        queuedJob.result.downloadSeconds = time.time() - startTime
+        queuedJob.finish()
+
+
+def _zipSaver(resultDirectory):
+    # the default downloader: saves <resultDirectory>/<job name>-<testId>.zip
+    if not os.path.isdir(resultDirectory):
+        os.makedirs(resultDirectory)
+    def saveZip(connection, job, testId):
+        fileName = "%s-%s.zip" % (_fileNameOf(job.name), testId) if job.name else "%s.zip" % testId
+        path = os.path.join(resultDirectory, fileName)
+        with open(path, "wb") as statsFile:
+            connection.getStatsCsvZipToFile(testId, statsFile)
+        return path
+    return saveZip
+
+
+def _fileNameOf(name):
+    # keeps the names of jobs (e.g. "../x" or "a/b") from pointing outside of the result directory
+    return re.sub(r"[^\w.-]+", "_", name).lstrip(".") or "_"
+
+
+def _runTest(session, queuedJob, waitStrategy):
+    job = queuedJob.job
+    queuedJob.result.sessionId = session.sessionId
+    if job.configName is not None:
+        session.loadConfiguration(job.configName)
+    testRun = session.startTest()
+    queuedJob.result.testId = testRun.testId
+    session.waitTestStopped(waitStrategy=waitStrategy)
+
+
+def runSessionJobs(session, jobs, resultDirectory=None, downloader=None, maxPendingDownloads=2, stopOnError=False,
+                   waitStrategy=None):
+    """Runs TestJobs one after the other in an existing Session, on the calling thread.
+
+    As soon as a test stops, its results are downloaded on another thread and the next test is started.
+    The sessionId and server of the jobs are ignored. Blocks until all the tests have run and all the downloads are done.
+
+    @param session: the Session to run the tests in
+    @param jobs: the list of TestJobs
+    @param resultDirectory, downloader: see Orchestrator
+    @param maxPendingDownloads: the max number of downloads in progress. When reached, the next test waits for one
+                                to finish. With 0 each download is done before the next test starts.
+    @param stopOnError: fail the jobs that did not start yet when a test fails. By default the other jobs are run.
+    @param waitStrategy: (optional) the WaitStrategy used to wait for tests to stop. Defaults to the session's.
+    @return the TestJobResults of the jobs, in the same order
+    """
+    Validators.checkNotNone(session, "session")
+    Validators.checkList(jobs, "jobs")
+    Validators.checkInt(maxPendingDownloads, "maxPendingDownloads")
+    if maxPendingDownloads < 0:
+        raise ValueError("The 'maxPendingDownloads' parameter cannot be negative. Was %s." % maxPendingDownloads)
+    if downloader is None and resultDirectory is not None:
+        downloader = _zipSaver(resultDirectory)
+    connection = session.parentConvention
+    queuedJobs = [_QueuedJob(job, connection) for job in jobs]
+    downloads = _DownloadPool(downloader, maxPendingDownloads, maxPendingDownloads, "Session-%s" % session.sessionId) if downloader else None
+    try:
+        for index, queuedJob in enumerate(queuedJobs):
+            result = queuedJob.result
+            result.server = connection.url
+            result.queuedSeconds = time.time() - queuedJob.queuedTime
+            startTime = time.time()
+            try:
+                _runTest(session, queuedJob, waitStrategy)
+                error = None
+            except Exception as e:
+                error = e
+            result.testSeconds = time.time() - startTime
+            if error is not None:
+                queuedJob.finish(error)
+                if stopOnError:
+                    for cancelled in queuedJobs[index + 1:]:
+                        cancelled.finish(WebException("A previous test failed: %s" % error))
+                    break
+            elif downloads is None:
+                queuedJob.finish()
+            else:
+                downloads.put(connection, queuedJob)
+    finally:
+        if downloads is not None:
+            downloads.close()
+    return [queuedJob.result for queuedJob in queuedJobs]
+
+
+class _Lane(threading.Thread):
+    # runs the jobs of one server slot in a session owned by the lane
+    def __init__(self, orchestrator, connection, index):
+        super(_Lane, self).__init__(name="Orchestrator-%s-%s" % (connection.url, index))
+        self.daemon = True
+        self.orchestrator = orchestrator
+        self.connection = connection
+        self.sessions = {}
+
+    def run(self):
+        while True:
+            queuedJob = self.orchestrator._nextJob(self.connection)
+            if queuedJob is None:
+                break
+            self.orchestrator._runJob(self, queuedJob)
+        for session in self.sessions.values():
+            self.orchestrator._releaseSession(session)
+
+    def getSession(self, sessionType):
+        session = self.sessions.get(sessionType)
+        if session is None:
+            session = self.sessions[sessionType] = self.connection.createSession(sessionType)
+            session.startSession()
+        return session
+
+    def discardSession(self, sessionType):
+        # drops a session that failed, so that the next job gets a fresh one
+        session = self.sessions.pop(sessionType, None)
+        if session is not None:
+            self.orchestrator._releaseSession(session)
+
+
+class Orchestrator(object):
+    """Runs TestJobs concurrently across one or more servers.
+
+    @param connections: a Connection or a list of Connections, one per server
+    @param maxTestsPerServer: the number of tests run at the same time on each server, or a list with one limit per connection
+    @param maxDownloads: the number of result downloads run at the same time
+    @param maxPendingDownloads: the number of finished tests that can wait for a download. When reached,
+                                lanes wait before starting their next test.
+    @param resultDirectory: (optional) the directory to save the CSV stats zip of each test to
+    @param downloader: (optional) a function(connection, job, testId) called to get the results of each test,
+                       e.g. lambda connection, job, testId: resultStore.addStatsCsvZip(connection, testId).
+                       Defaults to saving <resultDirectory>/<job name>-<testId>.zip if resultDirectory is set.
+    @param waitStrategy: (optional) the WaitStrategy used to wait for tests to stop
+    @param stopOnError: fail the jobs that did not start yet when a test fails. By default the other jobs are run.
+    """
+    kDefaultMaxDownloads = 2
+    kDefaultMaxPendingDownloads = 8
+
+    def __init__(self, connections, maxTestsPerServer=1, maxDownloads=kDefaultMaxDownloads,
+                 maxPendingDownloads=kDefaultMaxPendingDownloads, resultDirectory=None, downloader=None, waitStrategy=None,
+                 stopOnError=False):
+        if not isinstance(connections, (list, tuple)):
+            connections = [connections]
+        Validators.checkList(list(connections), "connections")
+        if not connections:
+            raise ValueError("At least one connection is required.")
+        if not isinstance(maxTestsPerServer, (list, tuple)):
+            maxTestsPerServer = [maxTestsPerServer] * len(connections)
+        if len(maxTestsPerServer) != len(connections):
+            raise ValueError("maxTestsPerServer must have one limit per connection.")
+        for limit in maxTestsPerServer:
+            Validators.checkInt(limit, "maxTestsPerServer")
+        Validators.checkInt(maxDownloads, "maxDownloads")
+        if maxDownloads < 1 and (downloader is not None or resultDirectory is not None):
+            raise ValueError("The 'maxDownloads' parameter must be at least 1 to download the results. Was %s." % maxDownloads)
+        Validators.checkInt(maxPendingDownloads, "maxPendingDownloads")
+        if downloader is None and resultDirectory is not None:
+            downloader = _zipSaver(resultDirectory)
+        self.connections = list(connections)
+        self.resultDirectory = resultDirectory
+        self.downloader = downloader
+        self.waitStrategy = waitStrategy
+        self.stopOnError = stopOnError
+        self._pending = collections.deque()
+        self._condition = threading.Condition()
+        self._closing = False
+        self._sessionLocks = {}
+        self._downloads = _DownloadPool(downloader, maxDownloads, maxDownloads + maxPendingDownloads, "Orchestrator") if downloader else None
+        self._lanes = [_Lane(self, connection, index) for connection, limit in zip(self.connections, maxTestsPerServer)
+                       for index in range(limit)]
+        for lane in self._lanes:
+            lane.start()
+
+    def submit(self, job):
+        """Queues a TestJob and returns a Future resolved with its TestJobResult once its results are downloaded.
+
+        Failed jobs resolve with a TestJobResult whose error is set; they do not stop the other jobs.
+        """
+        Validators.checkNotNone(job, "job")
+        connection = self._connectionOf(job.server)
+        if job.sessionId is not None and connection is None:
+            # a session exists on one server only
+            if len(self.connections) > 1:
+                raise ValueError("The server of the session %s must be set, the orchestrator has several connections." % job.sessionId)
+            connection = self.connections[0]
+        queuedJob = _QueuedJob(job, connection)
+        self._condition.acquire()
+        try:
+            if self._closing:
+                raise WebException("The orchestrator is closed.")
+            self._pending.append(queuedJob)
+            self._condition.notifyAll()
+        finally:
+            self._condition.release()
+        return queuedJob.future
+
+    def run(self, jobs, timeout=None):
+        """Runs a list of TestJobs and returns their TestJobResults, in the same order."""
+        Validators.checkList(jobs, "jobs")
+        futures = [self.submit(job) for job in jobs]
+        return [future.result(timeout) for future in futures]
+
+    @property
+    def queuedJobCount(self):
+        return len(self._pending)
+
+    def close(self, cancelPending=True):
+        """Stops the lanes once their current tests and downloads are done and stops the sessions the orchestrator created.
+
+        @param cancelPending: fail the jobs that did not start yet. Otherwise they are run first.
+        """
+        self._condition.acquire()
+        try:
+            self._closing = True
+            if cancelPending:
+                self._cancelPending("The orchestrator was closed before the job started.")
+            self._condition.notifyAll()
+        finally:
+            self._condition.release()
+        for lane in self._lanes:
+            lane.join()
+        if self._downloads is not None:
+            self._downloads.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close(cancelPending=type is not None)
+
+    def _connectionOf(self, server):
+        if server is None:
+            return None
+        if isinstance(server, (int, long)):
+            return self.connections[server]
+        if server not in self.connections:
+            raise ValueError("The server %s is not one of the orchestrator's connections." % server)
+        return server
+
+    def _nextJob(self, connection):
+        # returns the oldest job that can run on connection, or None once the orchestrator is closing and nothing is left
+        self._condition.acquire()
+        try:
+            while True:
+                for queuedJob in self._pending:
+                    if queuedJob.connection in (None, connection):
+                        self._pending.remove(queuedJob)
+                        return queuedJob
+                if self._closing:
+                    return None
+                self._condition.wait()
+        finally:
+            self._condition.release()
+
+    def _runJob(self, lane, queuedJob):
+        job = queuedJob.job
+        result = queuedJob.result
+        result.server = lane.connection.url
+        result.queuedSeconds = time.time() - queuedJob.queuedTime
+        startTime = time.time()
+        try:
+            if job.sessionId is not None:
+                # sessions of other scripts are shared by the lanes, so only one test at a time runs in them
+                sessionLock = self._sessionLocks.setdefault((lane.connection, job.sessionId), threading.Lock())
+                sessionLock.acquire()
+                try:
+                    _runTest(lane.connection.joinSession(job.sessionId), queuedJob, self.waitStrategy)
+                finally:
+                    sessionLock.release()
+            else:
+                try:
+                    _runTest(lane.getSession(job.sessionType), queuedJob, self.waitStrategy)
+                except WebException:
+                    if result.testId is None:
+                        lane.discardSession(job.sessionType)
+                    raise
+        except Exception as e:
+            if self.stopOnError:
+                self._condition.acquire()
+                try:
+                    self._cancelPending("A previous test failed: %s" % e)
+                finally:
+                    self._condition.release()
+            queuedJob.finish(e)
+            return
+        finally:
+            result.testSeconds = time.time() - startTime
+        if self._downloads is None:
+            queuedJob.finish()
+        else:
+            # blocks when maxPendingDownloads tests are already waiting for their results
+            self._downloads.put(lane.connection, queuedJob)
+
+    def _cancelPending(self, message):
+        # the caller holds self._condition
+        while self._pending:
+            self._pending.popleft().finish(WebException(message))
+
+    @staticmethod
+    def _releaseSession(session):
+        try:
+            session.stopSession()
+        except Exception:
+            pass
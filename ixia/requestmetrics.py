@@ -0,0 +1,310 @@
+#
+#   requestmetrics.py
+#
+#   Per-endpoint request metrics for the webapi library.
+#
+#   RequestMetrics observes every request sent by a Connection and its sessions, user admin and
+#   stats readers (see HttpConvention.addRequestObserver), and keeps for each method and url
+#   template a count of the replies by status, the bytes transferred, the retries, the time
+#   spent in each phase of the requests and an HDR-style latency histogram.
+#
+#       metrics = RequestMetrics()
+#       metrics.attach(connection)
+#       session.runTest()
+#       print metrics.summaryTable()
+#
+
+import json
+import threading
+
+from ixia.webapi import *
+
+
+class LatencyHistogram(object):
+    """A log-linear histogram of durations, in the style of HdrHistogram.
+
+    Durations are recorded in microseconds into buckets whose width grows with the value, so that every
+    recorded value is known within a relative error of 1 / 2 ** significantBits (about 3% by default)
+    whatever its magnitude. Recording is a few integer operations and memory only grows with the number
+    of distinct buckets used.
+
+    @param significantBits: the precision of the buckets
+    """
+    kDefaultSignificantBits = 5
+    kMicroseconds = 1000000
+
+    def __init__(self, significantBits=kDefaultSignificantBits):
+        Validators.checkInt(significantBits, "significantBits")
+        self.significantBits = significantBits
+        self._subBuckets = 1 << significantBits
+        self.counts = {}
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds):
+        """Adds a duration, in seconds."""
+        value = int(seconds * self.kMicroseconds)
+        index = self._indexOf(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.sum += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        """Adds the values of another LatencyHistogram with the same precision."""
+        if other.significantBits != self.significantBits:
+            raise ValueError("Cannot merge histograms of %s and %s significant bits." % (self.significantBits, other.significantBits))
+        for index, count in other.counts.iteritems():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.sum += other.sum
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+    def percentile(self, percent):
+        """Returns the duration (in seconds) below which percent % of the values fall, or None if the histogram is empty."""
+        if not self.count:
+            return None
+        if percent < 0 or percent > 100:
+            raise ValueError("percent must be between 0 and 100. Was %s." % percent)
+        rank = max(1, int(round(percent / 100.0 * self.count)))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(max(self._upperBoundOf(index) / float(self.kMicroseconds), self.min), self.max)
+        return self.max
+
+    def buckets(self):
+        """Returns a sorted list of (upperBoundSeconds, count) for the buckets with values."""
+        return [(self._upperBoundOf(index) / float(self.kMicroseconds), self.counts[index]) for index in sorted(self.counts)]
+
+    def _indexOf(self, value):
+        # values below 2 * subBuckets have their own bucket, then each power of two is split into subBuckets
+        shift = max(value.bit_length() - self.significantBits - 1, 0)
+        return (shift << self.significantBits) + (value >> shift)
+
+    def _upperBoundOf(self, index):
+        if index < 2 * self._subBuckets:
+            return index
+        shift = (index >> self.significantBits) - 1
+        mantissa = index - (shift << self.significantBits)
+        return ((mantissa + 1) << shift) - 1
+
+
+class EndpointStats(object):
+    """The metrics of the requests sent with one method to one url template.
+
+    @ivar method: the HTTP method
+    @ivar template: the url template, e.g. sessions/{id}/ixchariot/testruns/{id}/operations/start
+    @ivar count: the number of requests
+    @ivar errors: the number of requests that failed without a reply or with an HTTP error status
+    @ivar statusCounts: a dictionary mapping each status code (None for no reply) to its number of requests
+    @ivar bytesIn, bytesOut: the bytes received and sent
+    @ivar retries: the number of retries made by the transport
+    @ivar phaseSeconds: a dictionary with the total time spent in each of RequestInfo.kPhases
+    @ivar latency: a LatencyHistogram of the request durations
+    """
+    def __init__(self, method, template, significantBits):
+        self.method = method
+        self.template = template
+        self.count = 0
+        self.errors = 0
+        self.statusCounts = {}
+        self.bytesIn = 0
+        self.bytesOut = 0
+        self.retries = 0
+        self.phaseSeconds = dict.fromkeys(RequestInfo.kPhases, 0.0)
+        self.latency = LatencyHistogram(significantBits)
+
+    def record(self, info):
+        self.count += 1
+        if info.status is None or info.status >= 400:
+            self.errors += 1
+        self.statusCounts[info.status] = self.statusCounts.get(info.status, 0) + 1
+        self.bytesIn += info.bytesIn or 0
+        self.bytesOut += info.bytesOut
+        self.retries += info.retries
+        phaseSeconds = self.phaseSeconds
+        for phase in RequestInfo.kPhases:
+            phaseSeconds[phase] += getattr(info, phase)
+        self.latency.record(info.seconds)
+
+    def asDict(self, percentiles):
+        latency = self.latency
+        return {"method": self.method,
+                "template": self.template,
+                "count": self.count,
+                "errors": self.errors,
+                "status": dict((str(status), count) for status, count in self.statusCounts.iteritems()),
+                "bytesIn": self.bytesIn,
+                "bytesOut": self.bytesOut,
+                "retries": self.retries,
+                "phaseSeconds": dict(self.phaseSeconds),
+                "latency": {"count": latency.count,
+                            "sum": latency.sum,
+                            "min": latency.min,
+                            "max": latency.max,
+                            "mean": latency.mean,
+                            "percentiles": dict(("p%g" % percent, latency.percentile(percent)) for percent in percentiles)}}
+
+
+class RequestMetrics(object):
+    """Collects EndpointStats for the requests of one or more connections.
+
+    @param significantBits: the precision of the latency histograms (see LatencyHistogram)
+    @param listener: (optional) a function(requestInfo) also called for every request, e.g. to log slow requests
+    """
+    kDefaultPercentiles = [50, 90, 99, 99.9]
+    # the bucket bounds (in seconds) of the Prometheus histograms
+    kPrometheusBuckets = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+    kDefaultPrometheusPrefix = "ixia_webapi"
+
+    def __init__(self, significantBits=LatencyHistogram.kDefaultSignificantBits, listener=None):
+        Validators.checkInt(significantBits, "significantBits")
+        self.significantBits = significantBits
+        self.listener = listener
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def attach(self, convention):
+        """Starts recording the requests of convention (typically a Connection) and its children."""
+        convention.addRequestObserver(self.record)
+
+    def detach(self, convention):
+        """Stops recording the requests of convention."""
+        convention.removeRequestObserver(self.record)
+
+    def record(self, info):
+        """Adds a RequestInfo to the metrics."""
+        key = (info.method, info.template)
+        with self._lock:
+            endpoint = self._endpoints.get(key)
+            if endpoint is None:
+                endpoint = self._endpoints[key] = EndpointStats(info.method, info.template, self.significantBits)
+            endpoint.record(info)
+        if self.listener is not None:
+            self.listener(info)
+
+    def reset(self):
+        """Forgets everything recorded so far."""
+        with self._lock:
+            self._endpoints = {}
+
+    def endpoints(self):
+        """Returns the EndpointStats, the endpoints with the most time spent first."""
+        with self._lock:
+            endpoints = list(self._endpoints.values())
+        return sorted(endpoints, key=lambda endpoint: (-endpoint.latency.sum, endpoint.template, endpoint.method))
+
+    def total(self):
+        """Returns the EndpointStats of all the requests together."""
+        total = EndpointStats("*", "*", self.significantBits)
+        for endpoint in self.endpoints():
+            total.count += endpoint.count
+            total.errors += endpoint.errors
+            for status, count in endpoint.statusCounts.iteritems():
+                total.statusCounts[status] = total.statusCounts.get(status, 0) + count
+            total.bytesIn += endpoint.bytesIn
+            total.bytesOut += endpoint.bytesOut
+            total.retries += endpoint.retries
+            for phase, seconds in endpoint.phaseSeconds.iteritems():
+                total.phaseSeconds[phase] += seconds
+            total.latency.merge(endpoint.latency)
+        return total
+
+    def asDict(self, percentiles=None):
+        """Returns the metrics as a dictionary of plain values (see toJson())."""
+        percentiles = percentiles or self.kDefaultPercentiles
+        return {"endpoints": [endpoint.asDict(percentiles) for endpoint in self.endpoints()],
+                "total": self.total().asDict(percentiles)}
+
+    def toJson(self, percentiles=None, indent=None):
+        """Returns the metrics as a json string.
+
+        @param percentiles: (optional) the latency percentiles to report. Defaults to kDefaultPercentiles.
+        """
+        return json.dumps(self.asDict(percentiles), indent=indent, sort_keys=True)
+
+    def summaryTable(self, percentiles=None):
+        """Returns a text table with one line per endpoint, the endpoints with the most time spent first."""
+        percentiles = percentiles or self.kDefaultPercentiles
+        headers = ["method", "template", "count", "errors", "total s", "mean ms"] + ["p%g ms" % percent for percent in percentiles] + \
+                  ["server s", "transfer s", "connect s", "kB in", "kB out", "retries"]
+        rows = []
+        for endpoint in self.endpoints() + [self.total()]:
+            latency = endpoint.latency
+            phases = endpoint.phaseSeconds
+            rows.append([endpoint.method, endpoint.template, str(endpoint.count), str(endpoint.errors), "%.3f" % latency.sum,
+                         self._formatMs(latency.mean)] + [self._formatMs(latency.percentile(percent)) for percent in percentiles] +
+                        ["%.3f" % phases[RequestInfo.kServer], "%.3f" % phases[RequestInfo.kTransfer],
+                         "%.3f" % (phases[RequestInfo.kDns] + phases[RequestInfo.kConnect] + phases[RequestInfo.kTls]),
+                         "%.1f" % (endpoint.bytesIn / 1024.0), "%.1f" % (endpoint.bytesOut / 1024.0), str(endpoint.retries)])
+        widths = [max(len(row[column]) for row in [headers] + rows) for column in range(len(headers))]
+        lines = []
+        for row in [headers] + rows:
+            # the text columns are left aligned, the numbers right aligned
+            lines.append("  ".join(cell.ljust(width) if column < 2 else cell.rjust(width)
+                                   for column, (cell, width) in enumerate(zip(row, widths))).rstrip())
+        return "\n".join(lines)
+
+    def toPrometheus(self, prefix=kDefaultPrometheusPrefix):
+        """Returns the metrics in the Prometheus text exposition format.
+
+        Latencies are exported as a histogram with the kPrometheusBuckets bounds, the other values as counters.
+        """
+        endpoints = self.endpoints()
+        lines = []
+        def metric(name, kind, help, samples):
+            lines.append("# HELP %s_%s %s" % (prefix, name, help))
+            lines.append("# TYPE %s_%s %s" % (prefix, name, kind))
+            for suffix, labels, value in samples:
+                lines.append("%s_%s%s{%s} %s" % (prefix, name, suffix, ",".join('%s="%s"' % (label, self._escape(labelValue))
+                                                                                  for label, labelValue in labels), self._formatValue(value)))
+        def endpointLabels(endpoint, *extra):
+            return [("method", endpoint.method), ("endpoint", endpoint.template)] + list(extra)
+        metric("requests_total", "counter", "The number of requests sent, by reply status.",
+               [("", endpointLabels(endpoint, ("status", status if status is not None else "none")), count)
+                for endpoint in endpoints for status, count in sorted(endpoint.statusCounts.items())])
+        metric("request_retries_total", "counter", "The number of retries made by the transport.",
+               [("", endpointLabels(endpoint), endpoint.retries) for endpoint in endpoints])
+        metric("request_bytes_total", "counter", "The bytes sent (out) and received (in).",
+               [("", endpointLabels(endpoint, ("direction", direction)), value) for endpoint in endpoints
+                for direction, value in [("in", endpoint.bytesIn), ("out", endpoint.bytesOut)]])
+        metric("request_phase_seconds_total", "counter", "The time spent in each phase of the requests.",
+               [("", endpointLabels(endpoint, ("phase", phase)), endpoint.phaseSeconds[phase]) for endpoint in endpoints
+                for phase in RequestInfo.kPhases])
+        samples = []
+        for endpoint in endpoints:
+            latencyBuckets = endpoint.latency.buckets()
+            for bound in self.kPrometheusBuckets:
+                samples.append(("_bucket", endpointLabels(endpoint, ("le", self._formatValue(bound))),
+                                sum(count for upperBound, count in latencyBuckets if upperBound <= bound)))
+            samples.append(("_bucket", endpointLabels(endpoint, ("le", "+Inf")), endpoint.latency.count))
+            samples.append(("_sum", endpointLabels(endpoint), endpoint.latency.sum))
+            samples.append(("_count", endpointLabels(endpoint), endpoint.latency.count))
+        metric("request_duration_seconds", "histogram", "The duration of the requests.", samples)
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _formatMs(seconds):
+        return "-" if seconds is None else "%.2f" % (seconds * 1000)
+
+    @staticmethod
+    def _formatValue(value):
+        return repr(float(value)) if isinstance(value, float) else str(value)
+
+    @staticmethod
+    def _escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -0,0 +1,510 @@
+#
+#   resultstore.py
+#
+#   A local columnar store for the CSV stats of downloaded test runs.
+#
+#   Each run is stored under its testId with one file per column: numbers as raw typed arrays, text
+#   as codes into dictionaries shared by all runs, and "N/A" cells as a packed null bitmap (columns
+#   that are entirely "N/A" take no space at all). Column files are memory mapped when read, so
+#   reopening a store and querying many runs does not reparse any CSV.
+#
+#   Layout of a store directory:
+#       catalog.json                        the runs in the order they were added, with their tables and columns
+#       dictionaries.json                   the values of each text column
+#       runs/<testId>/<table>/<n>.data      the values of the n-th column of a table
+#       runs/<testId>/<table>/<n>.nulls     the null bitmap of the n-th column (only if it has nulls)
+#
+
+import array
+import json
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+
+from ixia.webapi import *
+from ixia.webapi import numpy
+from ixia.csvresults import iterCsvZip, iterStatsCsvZip
+
+
+class ResultStoreException(WebException):
+    pass
+
+
+class StoredColumn(object):
+    """One column of a table of a stored run.
+
+    @ivar name: the name of the column
+    @ivar type: one of ResultStore.kInteger, kFloat, kText or kNull
+    @ivar rowCount: the number of rows
+    """
+    def __init__(self, name, type, rowCount, dataPath, nullsPath, dictionary):
+        self.name = name
+        self.type = type
+        self.rowCount = rowCount
+        self._dataPath = dataPath
+        self._nullsPath = nullsPath
+        self._dictionary = dictionary
+        self._data = None
+        self._nulls = None
+
+    @property
+    def values(self):
+        """The raw values: a typed array (a numpy array if numpy is installed) with the numbers, or the dictionary codes of text.
+
+        Cells that are null hold 0. The array is backed by the memory mapped column file.
+        """
+        if self._data is None:
+            typeCode = ResultStore.kTypeCodes.get(self.type)
+            if typeCode is None:
+                self._data = array.array(ResultStore.kTypeCodes[ResultStore.kInteger], [0] * self.rowCount)
+            else:
+                self._data = _mapArray(self._dataPath, typeCode)
+        return self._data
+
+    def isNull(self, rowIndex):
+        if self.type == ResultStore.kNull:
+            return True
+        nulls = self._nullBits()
+        return nulls is not None and bool((nulls[rowIndex >> 3] >> (7 - (rowIndex & 7))) & 1)
+
+    def nullMask(self):
+        """Returns a bytearray with a 1 for each null cell (the same convention as Snapshot.columnMask)."""
+        if self.type == ResultStore.kNull:
+            return bytearray([1]) * self.rowCount
+        nulls = self._nullBits()
+        if nulls is None:
+            return bytearray(self.rowCount)
+        if numpy is not None:
+            return bytearray(numpy.unpackbits(numpy.frombuffer(nulls, dtype=numpy.uint8))[:self.rowCount].tostring())
+        return bytearray((nulls[index >> 3] >> (7 - (index & 7))) & 1 for index in xrange(self.rowCount))
+
+    def tolist(self):
+        """Returns the values of the column as a list, with None for null cells and the text of text columns."""
+        if self.type == ResultStore.kNull:
+            return [None] * self.rowCount
+        values = self.values
+        mask = self.nullMask()
+        if self.type == ResultStore.kText:
+            dictionary = self._dictionary
+            return [None if missing else dictionary[code] for code, missing in zip(values, mask)]
+        return [None if missing else value for value, missing in zip(values.tolist(), mask)]
+
+    def _nullBits(self):
+        if self._nulls is None and self._nullsPath:
+            self._nulls = bytearray(_mapFile(self._nullsPath)[:])
+        return self._nulls
+
+
+def _mapFile(path):
+    with open(path, "rb") as handle:
+        if os.fstat(handle.fileno()).st_size == 0:
+            return ""
+        return mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _mapArray(path, typeCode):
+    data = _mapFile(path)
+    if numpy is not None:
+        return numpy.frombuffer(data, dtype=numpy.dtype(typeCode))
+    result = array.array(typeCode)
+    result.fromstring(data[:])
+    return result
+
+
+def _setBit(bits, index):
+    # the first row in the highest bit (the numpy.packbits order)
+    bits[index >> 3] |= 0x80 >> (index & 7)
+
+
+def _getBit(bits, index):
+    return (bits[index >> 3] >> (7 - (index & 7))) & 1
+
+
+def percentile(percent):
+    """Returns an aggregation function computing a percentile (0 to 100, linear interpolation) of a list of numbers."""
+    def function(values):
+        if not len(values):
+            return None
+        if numpy is not None:
+            return float(numpy.percentile(values, percent))
+        values = sorted(values)
+        position = (len(values) - 1) * percent / 100.0
+        lower = int(position)
+        upper = min(lower + 1, len(values) - 1)
+        return values[lower] + (values[upper] - values[lower]) * (position - lower)
+    return function
+
+
+class ResultStore(object):
+    """A directory of test run results stored column by column.
+
+    Runs are added with addStatsCsvZip() (straight from the server) or addRun() (from ixia.csvresults members),
+    and queried with column() and aggregate(), e.g. the p95 Throughput per application across the last 500 runs:
+
+        store.aggregate("ixchariot_mix_application", "Throughput", percentile(95), groupBy="application", lastRuns=500)
+
+    Tables are named after the CSV files without the extension.
+
+    @param path: the directory of the store. It is created if it doesn't exist.
+    """
+    kInteger = "integer"
+    kFloat = "float"
+    kText = "text"
+    kNull = "null"
+    kTypeCodes = {kInteger: "l", kFloat: "d", kText: "i"}
+
+    kCatalogFile = "catalog.json"
+    kDictionariesFile = "dictionaries.json"
+    kRunsDirectory = "runs"
+    # the number of rows converted to columns at a time when a run is added
+    kChunkRows = 4096
+
+    def __init__(self, path):
+        Validators.checkNonEmptyString(path, "path")
+        self.path = path
+        self.lock = threading.Lock()
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._catalog = self._readJson(self.kCatalogFile, {"runs": []})
+        self._dictionaries = self._readJson(self.kDictionariesFile, {})
+        self._dictionaryIndexes = dict((column, dict((value, code) for code, value in enumerate(values)))
+                                       for column, values in self._dictionaries.iteritems())
+        self._runs = dict((run["testId"], run) for run in self._catalog["runs"])
+
+    @property
+    def runIds(self):
+        """The testIds of the stored runs, in the order they were added."""
+        return [run["testId"] for run in self._catalog["runs"]]
+
+    def hasRun(self, testId):
+        return testId in self._runs
+
+    def tables(self, testId):
+        """Returns the names of the tables stored for a run."""
+        return sorted(self._run(testId)["tables"])
+
+    def columns(self, testId, table):
+        """Returns the names of the columns of a table of a run."""
+        return [column["name"] for column in self._table(testId, table)["columns"]]
+
+    def addStatsCsvZip(self, connection, testId, members=None, columns=None, replace=False):
+        """Downloads the CSV stats zip of a test from the server and stores it as a new run.
+
+        Parameters are the same as for ixia.csvresults.iterStatsCsvZip() and addRun().
+        """
+        return self.addRun(testId, iterStatsCsvZip(connection, testId, members, columns), replace)
+
+    def addCsvZipFile(self, testId, zipFile, members=None, columns=None, replace=False):
+        """Stores the CSV stats zip in the file-like object zipFile (e.g. written by getStatsCsvZipToFile) as a new run."""
+        Validators.checkFile(zipFile, "zipFile")
+        chunks = iter(lambda: zipFile.read(65536), "")
+        return self.addRun(testId, iterCsvZip(chunks, members, columns), replace)
+
+    def addRun(self, testId, members, replace=False):
+        """Stores a run.
+
+        @param testId: the id of the test the results belong to
+        @param members: an iterable of ixia.csvresults.CsvResultMember objects (or any objects with a name, columns
+                        and rows as lists of values)
+        @param replace: replace the run if it is already stored. Otherwise that raises a ResultStoreException.
+        @return the names of the stored tables
+        """
+        Validators.checkInt(testId, "testId")
+        self.lock.acquire()
+        try:
+            if testId in self._runs and not replace:
+                raise ResultStoreException("The run %s is already stored in %s" % (testId, self.path))
+            runsPath = os.path.join(self.path, self.kRunsDirectory)
+            runPath = os.path.join(runsPath, str(testId))
+            if not os.path.isdir(runsPath):
+                os.makedirs(runsPath)
+            # the tables are written next to the run and swapped in only once all the members are written, so a
+            # failure (e.g. a dropped download) leaves the stored run and the dictionaries as they were
+            newPath = tempfile.mkdtemp(prefix=".%s-" % testId, dir=runsPath)
+            dictionarySizes = dict((column, len(values)) for column, values in self._dictionaries.iteritems())
+            run = {"testId": testId, "tables": {}}
+            try:
+                for member in members:
+                    table = os.path.splitext(member.name)[0]
+                    run["tables"][table] = self._writeTable(os.path.join(newPath, table), member)
+            except:
+                shutil.rmtree(newPath, True)
+                self._restoreDictionaries(dictionarySizes)
+                raise
+            # the dictionaries are saved first, so that the catalog never refers to missing codes
+            self._writeJson(self.kDictionariesFile, self._dictionaries)
+            if os.path.isdir(runPath):
+                oldPath = tempfile.mkdtemp(prefix=".%s-" % testId, dir=runsPath)
+                os.rename(runPath, os.path.join(oldPath, "run"))
+                os.rename(newPath, runPath)
+                shutil.rmtree(oldPath, True)
+            else:
+                os.rename(newPath, runPath)
+            if testId in self._runs:
+                self._catalog["runs"] = [item for item in self._catalog["runs"] if item["testId"] != testId]
+            self._catalog["runs"].append(run)
+            self._runs[testId] = run
+            self._writeJson(self.kCatalogFile, self._catalog)
+            return sorted(run["tables"])
+        finally:
+            self.lock.release()
+
+    def column(self, testId, table, columnName):
+        """Returns a StoredColumn with the values of a column of a table of a run."""
+        for index, column in enumerate(self._table(testId, table)["columns"]):
+            if column["name"] == columnName:
+                basePath = os.path.join(self.path, self.kRunsDirectory, str(testId), table, str(index))
+                return StoredColumn(columnName, column["type"], self._table(testId, table)["rows"], basePath + ".data",
+                                    basePath + ".nulls" if column.get("nulls") else None, self._dictionaries.get(columnName))
+        raise ValueError("The column '%s' is not in the table %s of run %s" % (columnName, table, testId))
+
+    def aggregate(self, table, valueColumn, function, groupBy=None, runs=None, lastRuns=None):
+        """Aggregates the non-null values of a numeric column across runs.
+
+        @param table: the name of the table, e.g. ixchariot_mix_application
+        @param valueColumn: the column to aggregate, e.g. Throughput
+        @param function: a function receiving the list (or numpy array) of values of a group, e.g. percentile(95)
+        @param groupBy: (optional) a text column to group by, e.g. application
+        @param runs: (optional) the testIds of the runs to include. Defaults to all the runs that have the table.
+        @param lastRuns: (optional) only include the most recently added of these runs
+        @return a dictionary mapping each value of groupBy (or None, without groupBy) to the result of function.
+                The rows where groupBy is null are grouped under None.
+        """
+        Validators.checkNotNone(function, "function")
+        if runs is None:
+            runs = self.runIds
+        runs = [testId for testId in runs if table in self._run(testId)["tables"]]
+        if lastRuns is not None:
+            Validators.checkInt(lastRuns, "lastRuns")
+            runs = runs[-lastRuns:] if lastRuns else []
+
+        if numpy is not None:
+            return self._aggregateNumpy(table, valueColumn, function, groupBy, runs)
+        groups = {}
+        for testId in runs:
+            values = self.column(testId, table, valueColumn)
+            if values.type not in (self.kInteger, self.kFloat):
+                continue
+            if groupBy is None:
+                keys = [None] * values.rowCount
+            else:
+                keys = self.column(testId, table, groupBy).tolist()
+            for key, value, missing in zip(keys, values.values.tolist(), values.nullMask()):
+                if not missing:
+                    groups.setdefault(key, []).append(value)
+        return dict((key, function(items)) for key, items in groups.iteritems())
+
+    def _aggregateNumpy(self, table, valueColumn, function, groupBy, runs):
+        # groups by integer codes and only decodes each group once: the dictionary codes of the runs where groupBy is
+        # text (they are shared by all runs), -1 for null keys and further negative codes for the keys of other runs
+        allValues = []
+        allCodes = []
+        otherCodes = {None: -1}
+        for testId in runs:
+            values = self.column(testId, table, valueColumn)
+            if values.type not in (self.kInteger, self.kFloat):
+                continue
+            present = numpy.frombuffer(values.nullMask(), dtype=numpy.uint8) == 0
+            if groupBy is not None:
+                keys = self.column(testId, table, groupBy)
+                if keys.type == self.kText:
+                    codes = numpy.where(numpy.frombuffer(keys.nullMask(), dtype=numpy.uint8) != 0, -1,
+                                        numpy.asarray(keys.values, dtype=numpy.int64))
+                else:
+                    codes = numpy.array([otherCodes.setdefault(key, -1 - len(otherCodes)) for key in keys.tolist()],
+                                        dtype=numpy.int64)
+                allCodes.append(codes[present])
+            allValues.append(numpy.asarray(values.values, dtype=numpy.float64)[present])
+        if not allValues:
+            return {}
+        values = numpy.concatenate(allValues)
+        if groupBy is None:
+            return {None: function(values)} if len(values) else {}
+        codes = numpy.concatenate(allCodes)
+        dictionary = self._dictionaries.get(groupBy)
+        otherKeys = dict((code, key) for key, code in otherCodes.iteritems())
+        result = {}
+        for code in numpy.unique(codes).tolist():
+            result[dictionary[code] if code >= 0 else otherKeys[code]] = function(values[codes == code])
+        return result
+
+    def percentile(self, table, valueColumn, percent, groupBy=None, runs=None, lastRuns=None):
+        """Returns the percentile of a column per group across runs. See aggregate()."""
+        return self.aggregate(table, valueColumn, percentile(percent), groupBy, runs, lastRuns)
+
+    def _run(self, testId):
+        try:
+            return self._runs[testId]
+        except KeyError:
+            raise ValueError("The run %s is not stored in %s" % (testId, self.path))
+
+    def _table(self, testId, table):
+        try:
+            return self._run(testId)["tables"][table]
+        except KeyError:
+            raise ValueError("The table %s is not stored for run %s" % (table, testId))
+
+    def _writeTable(self, tablePath, member):
+        # the rows are passed to the writers of their columns a chunk at a time, so no member is held in memory
+        os.makedirs(tablePath)
+        writers = [_ColumnWriter(self, os.path.join(tablePath, str(index)), name) for index, name in enumerate(member.columns)]
+        width = len(writers)
+        rowCount = 0
+        try:
+            chunk = []
+            for row in member:
+                if len(row) < width:
+                    row = list(row) + [None] * (width - len(row))
+                chunk.append(row)
+                if len(chunk) == self.kChunkRows:
+                    rowCount += self._writeChunk(writers, chunk)
+                    chunk = []
+            rowCount += self._writeChunk(writers, chunk)
+        finally:
+            for writer in writers:
+                writer.close()
+        return {"rows": rowCount, "columns": [writer.description() for writer in writers]}
+
+    @staticmethod
+    def _writeChunk(writers, rows):
+        for index, writer in enumerate(writers):
+            writer.add([row[index] for row in rows])
+        return len(rows)
+
+    def _code(self, columnName, value):
+        if isinstance(value, str):
+            value = value.decode("utf-8")
+        elif not isinstance(value, unicode):
+            value = unicode(value)
+        index = self._dictionaryIndexes.setdefault(columnName, {})
+        code = index.get(value)
+        if code is None:
+            values = self._dictionaries.setdefault(columnName, [])
+            code = index[value] = len(values)
+            values.append(value)
+        return code
+
+    def _restoreDictionaries(self, sizes):
+        # drops the codes added since the dictionaries had these sizes (codes are only ever appended)
+        for columnName, values in self._dictionaries.items():
+            size = sizes.get(columnName, 0)
+            index = self._dictionaryIndexes[columnName]
+            for value in values[size:]:
+                del index[value]
+            del values[size:]
+            if columnName not in sizes:
+                del self._dictionaries[columnName]
+                del self._dictionaryIndexes[columnName]
+
+    def _readJson(self, fileName, default):
+        path = os.path.join(self.path, fileName)
+        if not os.path.exists(path):
+            return default
+        with open(path, "rb") as handle:
+            return json.load(handle)
+
+    def _writeJson(self, fileName, value):
+        # written to a temporary file and renamed, so a failure never leaves a partial file behind
+        path = os.path.join(self.path, fileName)
+        with open(path + ".tmp", "wb") as handle:
+            json.dump(value, handle)
+        os.rename(path + ".tmp", path)
+
+
+class _ColumnWriter(object):
+    # writes one column of a table as its rows arrive. The column has the narrowest type that fits the values seen so
+    # far (null, then integer, float and text) and the values already written are converted when it has to be widened.
+    kTypeRanks = {ResultStore.kNull: 0, ResultStore.kInteger: 1, ResultStore.kFloat: 2, ResultStore.kText: 3}
+    kIntegerTypes = frozenset([int, long, type(None)])
+    kNumberTypes = frozenset([int, long, float, type(None)])
+
+    def __init__(self, store, basePath, name):
+        self.store = store
+        self.basePath = basePath
+        self.name = name
+        self.type = ResultStore.kNull
+        self.rowCount = 0
+        self._nulls = bytearray()
+        self._hasNulls = False
+        # for float columns, the rows that were integers, so that they are coded as such if the column becomes text
+        self._integers = None
+        self._handle = None
+
+    def add(self, values):
+        """Appends the values of the next rows."""
+        if not values:
+            return
+        start = self.rowCount
+        self.rowCount += len(values)
+        size = (self.rowCount + 7) >> 3
+        self._nulls.extend(bytearray(size - len(self._nulls)))
+        if self._integers is not None:
+            self._integers.extend(bytearray(size - len(self._integers)))
+        types = set(map(type, values))
+        if type(None) in types:
+            self._hasNulls = True
+            for offset, value in enumerate(values):
+                if value is None:
+                    _setBit(self._nulls, start + offset)
+        if types <= self.kIntegerTypes:
+            valuesType = ResultStore.kInteger if len(types) > 1 or type(None) not in types else ResultStore.kNull
+        elif types <= self.kNumberTypes:
+            valuesType = ResultStore.kFloat
+        else:
+            valuesType = ResultStore.kText
+        if self.kTypeRanks[valuesType] > self.kTypeRanks[self.type]:
+            self._widen(valuesType, start)
+        if self.type == ResultStore.kNull:
+            return
+        if self.type == ResultStore.kText:
+            code = self.store._code
+            values = [0 if value is None else code(self.name, value) for value in values]
+        else:
+            if self._integers is not None and (int in types or long in types):
+                for offset, value in enumerate(values):
+                    if type(value) in (int, long):
+                        _setBit(self._integers, start + offset)
+            if type(None) in types:
+                values = [0 if value is None else value for value in values]
+        array.array(ResultStore.kTypeCodes[self.type], values).tofile(self._handle)
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+        if self._hasNulls and self.type != ResultStore.kNull:
+            with open(self.basePath + ".nulls", "wb") as handle:
+                handle.write(self._nulls)
+
+    def description(self):
+        result = {"name": self.name, "type": self.type}
+        if self._hasNulls and self.type != ResultStore.kNull:
+            result["nulls"] = True
+        return result
+
+    def _widen(self, type, count):
+        # rewrites the values of the first count rows with the new type
+        if self.type == ResultStore.kNull:
+            values = [0] * count
+        else:
+            self._handle.close()
+            values = array.array(ResultStore.kTypeCodes[self.type])
+            with open(self.basePath + ".data", "rb") as handle:
+                values.fromfile(handle, count)
+            if type == ResultStore.kText:
+                integers = self._integers
+                values = [0 if _getBit(self._nulls, index) else
+                          self.store._code(self.name, int(value) if integers is not None and _getBit(integers, index) else value)
+                          for index, value in enumerate(values)]
+        if type == ResultStore.kFloat:
+            self._integers = bytearray(len(self._nulls))
+            if self.type == ResultStore.kInteger:
+                for index in xrange(count):
+                    _setBit(self._integers, index)
+        else:
+            self._integers = None
+        self.type = type
+        self._handle = open(self.basePath + ".data", "wb")
+        array.array(ResultStore.kTypeCodes[type], values).tofile(self._handle)
@@ -0,0 +1,239 @@
+#
+#   statsdelta.py
+#
+#   Incremental deltas and rates between consecutive stats snapshots.
+#
+#   A StatsDeltaEngine matches the rows of consecutive Snapshots by their StatKey columns, computes
+#   per-key deltas and rates for every value stat column by column, and reports only the rows that
+#   changed. Consumers of thousands of flows per interval therefore get the changes directly instead
+#   of walking and diffing full snapshots themselves.
+#
+
+import array
+
+from ixia.webapi import *
+from ixia.webapi import numpy
+
+
+class StatsDeltas(object):
+    """The rows that changed between two snapshots.
+
+    Columns are aligned with keys: the i-th element of values(), deltas() and rates() belongs to keys[i].
+    Rows that are new since the previous snapshot have NaN (numeric stats) or None deltas and rates.
+
+    @ivar timestamp: the timestamp of the current snapshot
+    @ivar previousTimestamp: the timestamp of the previous snapshot, or None for the first one
+    @ivar interval: the number of seconds between the two snapshots, or None for the first one
+    @ivar keys: the key (a tuple of the StatKey values) of each changed row
+    @ivar removedKeys: the keys of the rows that are no longer returned
+    """
+    def __init__(self, timestamp, previousTimestamp, interval, keys, removedKeys, values, deltas, rates):
+        self.timestamp = timestamp
+        self.previousTimestamp = previousTimestamp
+        self.interval = interval
+        self.keys = keys
+        self.removedKeys = removedKeys
+        self._values = values
+        self._deltas = deltas
+        self._rates = rates
+
+    def __len__(self):
+        return len(self.keys)
+
+    def values(self, statName):
+        """Returns the current values of a stat for the changed rows."""
+        return self._values[statName]
+
+    def deltas(self, statName):
+        """Returns the change of a stat since the previous snapshot for the changed rows."""
+        return self._deltas[statName]
+
+    def rates(self, statName):
+        """Returns the change per second of a stat for the changed rows."""
+        return self._rates[statName]
+
+    def iterRows(self):
+        """Yields (key, {statName: (value, delta, rate)}) for each changed row."""
+        statNames = self._values.keys()
+        for index, key in enumerate(self.keys):
+            yield key, dict((statName, (self._values[statName][index], self._deltas[statName][index], self._rates[statName][index]))
+                            for statName in statNames)
+
+
+class StatsDeltaEngine(object):
+    """Computes deltas and rates between consecutive snapshots of one StatsRequest.
+
+    @param statsRequest: the StatsRequest the snapshots are returned for
+    @param keyStats: (optional) the definitions of the stats identifying a row. Defaults to the StatKey stats
+                     of the request. Without any, rows are matched by position.
+    @param valueStats: (optional) the definitions of the stats to compute. Defaults to all other stats.
+    @param timestampsPerSecond: the number of snapshot timestamp units per second
+    @param useNumpy: compute with numpy (if installed). Defaults to True.
+    """
+    kTimestampsPerSecond = 1000
+    kNaN = float("nan")
+
+    def __init__(self, statsRequest, keyStats=None, valueStats=None, timestampsPerSecond=kTimestampsPerSecond, useNumpy=True):
+        Validators.checkNotNone(statsRequest, "statsRequest")
+        definitions = statsRequest.columns
+        if keyStats is None:
+            keyStats = [stat.definition for stat in statsRequest.stats if isinstance(stat, StatKey)]
+        if valueStats is None:
+            valueStats = [definition for definition in definitions.definitions if definition not in keyStats]
+        for definition in list(keyStats) + list(valueStats):
+            if definition not in definitions:
+                raise ValueError("The stat '%s' is not part of the stats request %s." % (definition, statsRequest.id))
+        self.statsRequest = statsRequest
+        self.keyStats = list(keyStats)
+        self.valueStats = list(valueStats)
+        self.timestampsPerSecond = float(timestampsPerSecond)
+        self.useNumpy = useNumpy and numpy is not None
+        self._previous = None
+
+    def reset(self):
+        """Forgets the previous snapshot. The next update() reports every row as new."""
+        self._previous = None
+
+    def update(self, snapshot):
+        """Consumes the next snapshot and returns a StatsDeltas with the rows that changed since the previous one."""
+        keys = self._keysOf(snapshot)
+        columns = dict((statName, snapshot.column(statName)) for statName in self.valueStats)
+        masks = dict((statName, snapshot.columnMask(statName)) for statName in self.valueStats)
+        current = (snapshot.timestamp, dict((key, index) for index, key in enumerate(keys)), columns, masks)
+        previous, self._previous = self._previous, current
+
+        if previous is None:
+            rowIndexes = range(len(keys))
+            return self._result(snapshot.timestamp, None, None, keys, [], rowIndexes, [None] * len(keys), current, None)
+
+        previousTimestamp, previousKeyIndex, previousColumns, previousMasks = previous
+        interval = (snapshot.timestamp - previousTimestamp) / self.timestampsPerSecond
+        matches = [previousKeyIndex.get(key) for key in keys]
+        if self.useNumpy:
+            changed = self._changedRowsNumpy(matches, current, previous)
+        else:
+            changed = self._changedRows(matches, current, previous)
+        removedKeys = [key for key in previousKeyIndex if key not in current[1]]
+        return self._result(snapshot.timestamp, previousTimestamp, interval, [keys[index] for index in changed], removedKeys,
+                            changed, [matches[index] for index in changed], current, previous)
+
+    def asCallback(self, callback):
+        """Adapts callback(asyncReader, deltas) for use as a StatsAsyncReader callback."""
+        def onSnapshot(asyncReader, currentSnapshot, lastSnapshot):
+            callback(asyncReader, self.update(currentSnapshot))
+        return onSnapshot
+
+    def _keysOf(self, snapshot):
+        if not self.keyStats:
+            return [(index,) for index in range(snapshot.rowCount)]
+        return zip(*[snapshot.column(statName) for statName in self.keyStats])
+
+    def _changedRows(self, matches, current, previous):
+        # returns the indexes of the rows of current that are new or have a different value or mask
+        columns, masks = current[2], current[3]
+        previousColumns, previousMasks = previous[2], previous[3]
+        changed = []
+        for index, match in enumerate(matches):
+            if match is None:
+                changed.append(index)
+                continue
+            for statName in self.valueStats:
+                missing = masks[statName][index]
+                if missing != previousMasks[statName][match] or (not missing and columns[statName][index] != previousColumns[statName][match]):
+                    changed.append(index)
+                    break
+        return changed
+
+    def _changedRowsNumpy(self, matches, current, previous):
+        columns, masks = current[2], current[3]
+        previousColumns, previousMasks = previous[2], previous[3]
+        matched = numpy.array([match is not None for match in matches], dtype=bool)
+        currentIndexes = numpy.flatnonzero(matched)
+        previousIndexes = numpy.array([match for match in matches if match is not None], dtype=numpy.intp)
+        changed = ~matched
+        for statName in self.valueStats:
+            mask = numpy.frombuffer(masks[statName], dtype=numpy.uint8)[currentIndexes]
+            previousMask = numpy.frombuffer(previousMasks[statName], dtype=numpy.uint8)[previousIndexes]
+            values = self._asNumpy(columns[statName])[currentIndexes]
+            previousValues = self._asNumpy(previousColumns[statName])[previousIndexes]
+            differs = (mask != previousMask) | ((mask == 0) & (values != previousValues))
+            changed[currentIndexes[differs]] = True
+        return numpy.flatnonzero(changed).tolist()
+
+    @staticmethod
+    def _asNumpy(column):
+        if isinstance(column, array.array):
+            return numpy.frombuffer(column, dtype=numpy.int_ if column.typecode == Snapshot.kIntegerTypeCode else numpy.float64)
+        return numpy.array(column, dtype=object)
+
+    def _result(self, timestamp, previousTimestamp, interval, keys, removedKeys, rowIndexes, previousIndexes, current, previous):
+        values = {}
+        deltas = {}
+        rates = {}
+        for statName in self.valueStats:
+            column = current[2][statName]
+            mask = current[3][statName]
+            numeric = isinstance(column, array.array)
+            values[statName] = [None if mask[index] else column[index] for index in rowIndexes]
+            if numeric and self.useNumpy:
+                rowDeltas, rowRates = self._deltasNumpy(column, mask, rowIndexes, previousIndexes, previous, statName, interval)
+            elif numeric:
+                rowDeltas = array.array("d", (self._delta(column, mask, index, previous, statName, match)
+                                              for index, match in zip(rowIndexes, previousIndexes)))
+                rowRates = array.array("d", (delta / interval if interval else self.kNaN for delta in rowDeltas))
+            else:
+                rowDeltas = [None] * len(rowIndexes)
+                rowRates = [None] * len(rowIndexes)
+            deltas[statName] = rowDeltas
+            rates[statName] = rowRates
+        return StatsDeltas(timestamp, previousTimestamp, interval, keys, removedKeys, values, deltas, rates)
+
+    def _deltasNumpy(self, column, mask, rowIndexes, previousIndexes, previous, statName, interval):
+        # the deltas and rates of the rows in one pass: gather both sides, subtract, then NaN where a side is missing
+        rows = numpy.array(rowIndexes, dtype=numpy.intp)
+        matched = numpy.array([match is not None for match in previousIndexes], dtype=bool)
+        deltas = numpy.empty(len(rows))
+        deltas.fill(self.kNaN)
+        previousColumn = previous[2][statName] if previous is not None else None
+        if matched.any() and isinstance(previousColumn, array.array):
+            matches = numpy.array([match or 0 for match in previousIndexes], dtype=numpy.intp)
+            # subtracted before converting to float, so that large integer counters keep their precision
+            changes = (self._asNumpy(column)[rows] - self._asNumpy(previousColumn)[matches]).astype(numpy.float64)
+            missing = ~matched | (numpy.frombuffer(mask, dtype=numpy.uint8)[rows] != 0) | \
+                      (numpy.frombuffer(previous[3][statName], dtype=numpy.uint8)[matches] != 0)
+            deltas = numpy.where(missing, self.kNaN, changes)
+        rates = deltas / interval if interval else numpy.full(len(rows), self.kNaN)
+        return array.array("d", deltas.tostring()), array.array("d", rates.tostring())
+
+    def _delta(self, column, mask, index, previous, statName, match):
+        previousColumn = previous[2][statName] if match is not None else None
+        if not isinstance(previousColumn, array.array) or mask[index] or previous[3][statName][match]:
+            return self.kNaN
+        return float(column[index] - previousColumn[match])
+
+
+class StatsDeltaReader(object):
+    """Wraps a StatsReader and returns StatsDeltas instead of full snapshots.
+
+    @param statsReader: the StatsReader to read snapshots from (see Session.registerStatsRequest)
+    @param kwArgs: passed to the StatsDeltaEngine
+    """
+    def __init__(self, statsReader, **kwArgs):
+        self.statsReader = statsReader
+        self.engine = StatsDeltaEngine(statsReader.statsRequest, **kwArgs)
+
+    def getNextDeltas(self, timeout=StatsReader.kDefaultTimeout):
+        """Returns the StatsDeltas of the next snapshot, or None if the reader was closed."""
+        snapshot = self.statsReader.getNextSnapshot(timeout)
+        if snapshot is None:
+            return None
+        return self.engine.update(snapshot)
+
+    def close(self):
+        self.statsReader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
@@ -0,0 +1,442 @@
+#
+#   statsrollup.py
+#
+#   Multi-resolution rollups of live stats, for long running tests.
+#
+#   A StatsRollupEngine consumes the Snapshots of one StatsRequest and keeps, for every row (matched
+#   by its StatKey columns) and value stat, the raw samples of the last minutes, fixed-size aggregates
+#   per minute and per hour, and an aggregate of the whole run. Old raw samples and buckets are dropped
+#   as new ones arrive, so memory depends on the retention settings and the number of rows, not on the
+#   length of the test, while summaries of any span (or of the whole run) can still be queried.
+#   Rows that stop being reported (e.g. the flows of a finished phase) are forgotten once they have not
+#   been seen for the span of the coarsest tier, and maxKeys can cap the number of rows kept, so the
+#   number of rows is that of the recent rows, not of all the rows ever seen.
+#
+
+import array
+import collections
+import threading
+
+from ixia.webapi import *
+
+
+class StatsAggregate(object):
+    """The aggregate of the samples of one stat of one row over a span of time.
+
+    Besides the count, sum, min, max, first and last values it keeps the sums of the changes between
+    consecutive samples (all of them, and the positive ones only) and the min and max rates, so that every
+    StatAggregation can be computed from it (see value()) and aggregates of consecutive spans can be merged.
+    The change from a sample to the next one belongs to the span of the next one. The positive variants
+    count the changes below zero (e.g. counter resets) as 0.
+
+    @ivar start, end: the timestamps of the first and last samples
+    """
+    __slots__ = ("start", "end", "count", "sum", "min", "max", "first", "last", "delta", "positiveDelta", "elapsed",
+                 "minRate", "maxRate", "minPositiveRate", "maxPositiveRate")
+
+    def __init__(self):
+        self.start = self.end = None
+        self.count = 0
+        self.sum = 0
+        self.min = self.max = self.first = self.last = None
+        self.delta = self.positiveDelta = 0
+        # the number of seconds covered by the changes
+        self.elapsed = 0.0
+        self.minRate = self.maxRate = self.minPositiveRate = self.maxPositiveRate = None
+
+    def add(self, timestamp, value, delta=None, elapsed=0):
+        """Adds a sample. delta and elapsed are the change and number of seconds since the previous sample, if any."""
+        if not self.count:
+            self.start = timestamp
+            self.first = self.min = self.max = value
+        elif value < self.min:
+            self.min = value
+        elif value > self.max:
+            self.max = value
+        self.end = timestamp
+        self.last = value
+        self.count += 1
+        self.sum += value
+        if delta is not None and elapsed > 0:
+            positiveDelta = delta if delta > 0 else 0
+            rate = delta / elapsed
+            positiveRate = positiveDelta / elapsed
+            self.delta += delta
+            self.positiveDelta += positiveDelta
+            self.elapsed += elapsed
+            if self.minRate is None:
+                self.minRate = self.maxRate = rate
+                self.minPositiveRate = self.maxPositiveRate = positiveRate
+            else:
+                self.minRate = min(self.minRate, rate)
+                self.maxRate = max(self.maxRate, rate)
+                self.minPositiveRate = min(self.minPositiveRate, positiveRate)
+                self.maxPositiveRate = max(self.maxPositiveRate, positiveRate)
+
+    def merge(self, other):
+        """Adds the samples of an aggregate of a later span (or of a different row) to this one."""
+        if not other.count:
+            return self
+        if not self.count:
+            for name in self.__slots__:
+                setattr(self, name, getattr(other, name))
+            return self
+        if other.start < self.start:
+            self.start, self.first = other.start, other.first
+        if other.end >= self.end:
+            self.end, self.last = other.end, other.last
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.delta += other.delta
+        self.positiveDelta += other.positiveDelta
+        self.elapsed += other.elapsed
+        if other.minRate is not None:
+            if self.minRate is None:
+                self.minRate, self.maxRate = other.minRate, other.maxRate
+                self.minPositiveRate, self.maxPositiveRate = other.minPositiveRate, other.maxPositiveRate
+            else:
+                self.minRate = min(self.minRate, other.minRate)
+                self.maxRate = max(self.maxRate, other.maxRate)
+                self.minPositiveRate = min(self.minPositiveRate, other.minPositiveRate)
+                self.maxPositiveRate = max(self.maxPositiveRate, other.maxPositiveRate)
+        return self
+
+    def copy(self):
+        return StatsAggregate().merge(self)
+
+    @property
+    def average(self):
+        return float(self.sum) / self.count if self.count else None
+
+    @property
+    def rate(self):
+        return self.delta / self.elapsed if self.elapsed else None
+
+    @property
+    def positiveRate(self):
+        return self.positiveDelta / self.elapsed if self.elapsed else None
+
+    def value(self, aggregationType=StatAggregation.kNone):
+        """Returns the value of the aggregate for a StatAggregation, or None if there are not enough samples.
+
+        kNone is the last value. The rates are per second: kRate and kPositiveRate over the whole span,
+        kMinRate, kMaxRate and their positive variants between two consecutive samples.
+        """
+        if aggregationType not in _kAggregations:
+            raise ValueError("The specified aggregation type '%s' is not supported." % aggregationType)
+        return _kAggregations[aggregationType](self)
+
+    def asDict(self):
+        """Returns the fields of the aggregate and its average and rates, as a dictionary."""
+        result = dict((name, getattr(self, name)) for name in self.__slots__)
+        result.update(average=self.average, rate=self.rate, positiveRate=self.positiveRate)
+        return result
+
+    def __repr__(self):
+        return "StatsAggregate(%s samples, min %s, max %s, average %s, rate %s)" % (self.count, self.min, self.max, self.average, self.rate)
+
+
+_kAggregations = {StatAggregation.kNone: lambda aggregate: aggregate.last,
+                  StatAggregation.kSum: lambda aggregate: aggregate.sum if aggregate.count else None,
+                  StatAggregation.kMin: lambda aggregate: aggregate.min,
+                  StatAggregation.kMax: lambda aggregate: aggregate.max,
+                  StatAggregation.kAverage: lambda aggregate: aggregate.average,
+                  StatAggregation.kRate: lambda aggregate: aggregate.rate,
+                  StatAggregation.kMaxRate: lambda aggregate: aggregate.maxRate,
+                  StatAggregation.kMinRate: lambda aggregate: aggregate.minRate,
+                  StatAggregation.kPositiveRate: lambda aggregate: aggregate.positiveRate,
+                  StatAggregation.kPositiveMaxRate: lambda aggregate: aggregate.maxPositiveRate,
+                  StatAggregation.kPositiveMinRate: lambda aggregate: aggregate.minPositiveRate}
+
+
+class _RollupTier(object):
+    # the buckets of one resolution: bucket start -> {key: [StatsAggregate for each value stat]}, oldest first
+    def __init__(self, resolution, retention, timestampsPerSecond):
+        self.resolution = resolution
+        self.retention = retention
+        self.width = int(resolution * timestampsPerSecond)
+        self.buckets = collections.OrderedDict()
+
+    def bucketAt(self, timestamp):
+        # returns the bucket of a timestamp, creating it (and dropping the oldest ones) if needed.
+        # None for samples older than the newest bucket that fall in a bucket which does not exist.
+        start = timestamp - timestamp % self.width
+        bucket = self.buckets.get(start)
+        if bucket is None:
+            if self.buckets and start < next(reversed(self.buckets)):
+                return None
+            bucket = self.buckets[start] = {}
+            while len(self.buckets) > self.retention:
+                self.buckets.popitem(last=False)
+        return bucket
+
+
+class StatsRollupEngine(object):
+    """Keeps multi-resolution aggregates of the snapshots of one StatsRequest.
+
+    For each row key and value stat the engine keeps the raw samples of the last rawSeconds seconds, one
+    StatsAggregate per bucket of each tier (by default 120 one-minute buckets and 168 one-hour buckets), and one
+    StatsAggregate for the whole run. The oldest samples and buckets are dropped as new ones arrive.
+    A row not seen for keyRetentionSeconds is evicted with its aggregates, including its whole run totals;
+    with maxKeys, the least recently seen rows are also evicted beyond that many rows. Memory is thus bounded
+    by the rows seen in the last keyRetentionSeconds (or by maxKeys), and evictedKeyCount counts the evictions.
+    Stats that are not numeric are skipped. Feed it with update(), or from a StatsAsyncReader with asCallback();
+    the queries can be made from any thread.
+
+    @param statsRequest: the StatsRequest the snapshots are returned for
+    @param keyStats: (optional) the definitions of the stats identifying a row. Defaults to the StatKey stats
+                     of the request. Without any, rows are matched by position.
+    @param valueStats: (optional) the definitions of the stats to aggregate. Defaults to all other stats.
+    @param rawSeconds: the number of seconds raw samples are kept for
+    @param tiers: (optional) a list of (resolution in seconds, number of buckets kept), finest first
+    @param timestampsPerSecond: the number of snapshot timestamp units per second
+    @param keyRetentionSeconds: (optional) the number of seconds a row is kept after it was last seen. Defaults to
+                                the span of the coarsest tier (resolution * number of buckets), or rawSeconds without tiers.
+    @param maxKeys: the max number of rows kept, 0 for no limit
+    """
+    kDefaultRawSeconds = 600
+    kDefaultTiers = [(60, 120), (3600, 168)]
+    kTimestampsPerSecond = 1000
+
+    def __init__(self, statsRequest, keyStats=None, valueStats=None, rawSeconds=kDefaultRawSeconds, tiers=None,
+                 timestampsPerSecond=kTimestampsPerSecond, keyRetentionSeconds=None, maxKeys=0):
+        Validators.checkNotNone(statsRequest, "statsRequest")
+        columns = statsRequest.columns
+        if keyStats is None:
+            keyStats = [stat.definition for stat in statsRequest.stats if isinstance(stat, StatKey)]
+        if valueStats is None:
+            valueStats = [definition for definition in columns.definitions if definition not in keyStats]
+        for definition in list(keyStats) + list(valueStats):
+            if definition not in columns:
+                raise ValueError("The stat '%s' is not part of the stats request %s." % (definition, statsRequest.id))
+        tiers = self.kDefaultTiers if tiers is None else tiers
+        Validators.checkList(tiers, "tiers")
+        resolutions = [resolution for resolution, _ in tiers]
+        if resolutions != sorted(resolutions) or any(coarse % fine for fine, coarse in zip(resolutions, resolutions[1:])):
+            raise ValueError("The tier resolutions must increase and be multiples of each other. Were %s." % resolutions)
+        Validators.checkInt(maxKeys, "maxKeys")
+        if keyRetentionSeconds is None:
+            keyRetentionSeconds = tiers[-1][0] * tiers[-1][1] if tiers else rawSeconds
+        self.statsRequest = statsRequest
+        self.keyStats = list(keyStats)
+        self.valueStats = list(valueStats)
+        self.rawSeconds = rawSeconds
+        self.timestampsPerSecond = float(timestampsPerSecond)
+        self.aggregationTypes = dict((stat.definition, stat.aggregationType) for stat in statsRequest.stats)
+        self.tiers = [_RollupTier(resolution, retention, timestampsPerSecond) for resolution, retention in tiers]
+        self.keyRetentionSeconds = keyRetentionSeconds
+        self.maxKeys = maxKeys
+        self.snapshotCount = 0
+        self.evictedKeyCount = 0
+        self.lock = threading.Lock()
+        self._statIndexes = dict((statName, index) for index, statName in enumerate(self.valueStats))
+        # (timestamp, {key: row index}, [column or None for each value stat], [mask for each value stat]), oldest first
+        self._raw = collections.deque()
+        # key -> [(timestamp, value) of the last sample of each value stat]
+        self._previous = {}
+        # key -> [StatsAggregate of the whole run for each value stat]
+        self._totals = {}
+        # key -> timestamp of the last snapshot with the row
+        self._lastSeen = {}
+        # the rows are checked for eviction once per bucket of the finest tier
+        self._sweepWidth = self.tiers[0].width if self.tiers else max(int(keyRetentionSeconds * timestampsPerSecond), 1)
+        self._nextSweep = None
+
+    @property
+    def resolutions(self):
+        """The resolutions of the tiers, in seconds."""
+        return [tier.resolution for tier in self.tiers]
+
+    def update(self, snapshot):
+        """Adds the rows of the next snapshot to the aggregates."""
+        timestamp = snapshot.timestamp
+        keys = self._keysOf(snapshot)
+        columns = []
+        masks = []
+        for statName in self.valueStats:
+            column = snapshot.column(statName)
+            # only numeric stats are aggregated
+            columns.append(column if isinstance(column, array.array) else None)
+            masks.append(snapshot.columnMask(statName))
+        statCount = len(columns)
+        tps = self.timestampsPerSecond
+        with self.lock:
+            buckets = [bucket for bucket in (tier.bucketAt(timestamp) for tier in self.tiers) if bucket is not None]
+            lastSeen = self._lastSeen
+            for rowIndex, key in enumerate(keys):
+                if lastSeen.get(key, timestamp) <= timestamp:
+                    lastSeen[key] = timestamp
+                previous = self._previous.get(key)
+                if previous is None:
+                    previous = self._previous[key] = [None] * statCount
+                totals = self._totals.get(key)
+                if totals is None:
+                    totals = self._totals[key] = [StatsAggregate() for _ in range(statCount)]
+                rowAggregates = [totals]
+                for bucket in buckets:
+                    aggregates = bucket.get(key)
+                    if aggregates is None:
+                        aggregates = bucket[key] = [StatsAggregate() for _ in range(statCount)]
+                    rowAggregates.append(aggregates)
+                for statIndex in range(statCount):
+                    column = columns[statIndex]
+                    if column is None or masks[statIndex][rowIndex]:
+                        continue
+                    value = column[rowIndex]
+                    prior = previous[statIndex]
+                    if prior is not None and timestamp <= prior[0]:
+                        # an old snapshot, e.g. fed twice
+                        continue
+                    delta, elapsed = (value - prior[1], (timestamp - prior[0]) / tps) if prior is not None else (None, 0)
+                    for aggregates in rowAggregates:
+                        aggregates[statIndex].add(timestamp, value, delta, elapsed)
+                    previous[statIndex] = (timestamp, value)
+            self._raw.append((timestamp, dict((key, index) for index, key in enumerate(keys)), columns, masks))
+            oldest = timestamp - self.rawSeconds * tps
+            while self._raw and self._raw[0][0] < oldest:
+                self._raw.popleft()
+            if self._nextSweep is None or timestamp >= self._nextSweep or (self.maxKeys and len(lastSeen) > self.maxKeys):
+                self._evictKeys(timestamp)
+            self.snapshotCount += 1
+
+    def asCallback(self, callback=None):
+        """Returns a StatsAsyncReader callback that feeds the engine, then calls callback(asyncReader, engine) if specified."""
+        def onSnapshot(asyncReader, currentSnapshot, lastSnapshot):
+            self.update(currentSnapshot)
+            if callback is not None:
+                callback(asyncReader, self)
+        return onSnapshot
+
+    def keys(self):
+        """Returns the keys of the rows seen so far, except the evicted ones."""
+        with self.lock:
+            return self._totals.keys()
+
+    def total(self, key, statName):
+        """Returns (a copy of) the StatsAggregate of a stat of a row over the whole run, or None if there are no samples."""
+        statIndex = self._statIndexOf(statName)
+        with self.lock:
+            totals = self._totals.get(key)
+            return totals[statIndex].copy() if totals is not None and totals[statIndex].count else None
+
+    def raw(self, key, statName):
+        """Returns the (timestamp, value) samples of a stat of a row in the last rawSeconds seconds."""
+        statIndex = self._statIndexOf(statName)
+        with self.lock:
+            samples = []
+            for timestamp, keyIndex, columns, masks in self._raw:
+                rowIndex = keyIndex.get(key)
+                if rowIndex is not None and columns[statIndex] is not None and not masks[statIndex][rowIndex]:
+                    samples.append((timestamp, columns[statIndex][rowIndex]))
+            return samples
+
+    def buckets(self, resolution, key, statName):
+        """Returns the (bucket start timestamp, StatsAggregate) pairs kept for a stat of a row at a resolution, oldest first."""
+        statIndex = self._statIndexOf(statName)
+        tier = self._tierOf(resolution)
+        with self.lock:
+            return [(start, bucket[key][statIndex].copy()) for start, bucket in tier.buckets.iteritems() if key in bucket]
+
+    def aggregate(self, key, statName, start=None, end=None):
+        """Returns the StatsAggregate of a stat of a row between two timestamps, or None if there are no samples.
+
+        The span is covered with the finest buckets still kept, then coarser ones for the older part, so its
+        bounds are rounded to the buckets. Without start and end this is the aggregate of the whole run.
+        """
+        if start is None and end is None:
+            return self.total(key, statName)
+        statIndex = self._statIndexOf(statName)
+        with self.lock:
+            selected = []
+            coveredFrom = None
+            for tier in self.tiers:
+                if coveredFrom is not None and start is not None and start >= coveredFrom:
+                    # the finer buckets cover the whole span
+                    break
+                if coveredFrom is not None:
+                    # round up to this tier, so that its buckets replace the finer ones they overlap
+                    boundary = -(-coveredFrom // tier.width) * tier.width
+                    selected = [(bucketStart, aggregate) for bucketStart, aggregate in selected if bucketStart >= boundary]
+                for bucketStart, bucket in tier.buckets.iteritems():
+                    if coveredFrom is not None and bucketStart + tier.width > boundary:
+                        break
+                    if key not in bucket or (start is not None and bucketStart + tier.width <= start) or (end is not None and bucketStart > end):
+                        continue
+                    selected.append((bucketStart, bucket[key][statIndex]))
+                if tier.buckets:
+                    first = next(iter(tier.buckets))
+                    coveredFrom = first if coveredFrom is None else min(coveredFrom, first)
+            if not selected:
+                return None
+            result = StatsAggregate()
+            for _, aggregate in sorted(selected, key=lambda item: item[0]):
+                result.merge(aggregate)
+            return result if result.count else None
+
+    def summary(self, aggregationType=None):
+        """Returns {key: {statName: value}} over the whole run.
+
+        @param aggregationType: (optional) the StatAggregation to compute. Defaults to the aggregationType of each
+                                stat of the request, and to kAverage for the stats without one.
+        """
+        with self.lock:
+            result = {}
+            for key, totals in self._totals.iteritems():
+                values = result[key] = {}
+                for statName, aggregate in zip(self.valueStats, totals):
+                    if aggregate.count:
+                        values[statName] = aggregate.value(aggregationType or self._defaultAggregation(statName))
+            return result
+
+    def reset(self):
+        """Forgets all the samples and aggregates."""
+        with self.lock:
+            self._raw.clear()
+            self._previous.clear()
+            self._totals.clear()
+            self._lastSeen.clear()
+            self._nextSweep = None
+            for tier in self.tiers:
+                tier.buckets.clear()
+            self.snapshotCount = 0
+            self.evictedKeyCount = 0
+
+    def _evictKeys(self, timestamp):
+        # forgets the rows not seen for keyRetentionSeconds, and the least recently seen ones beyond maxKeys.
+        # The caller holds self.lock. The raw samples of the rows age out with the snapshots they belong to.
+        oldest = timestamp - self.keyRetentionSeconds * self.timestampsPerSecond
+        evicted = [key for key, lastSeen in self._lastSeen.iteritems() if lastSeen < oldest]
+        if self.maxKeys and len(self._lastSeen) - len(evicted) > self.maxKeys:
+            evicted = sorted(self._lastSeen, key=self._lastSeen.get)[:len(self._lastSeen) - self.maxKeys]
+        self._nextSweep = timestamp - timestamp % self._sweepWidth + self._sweepWidth
+        for key in evicted:
+            del self._lastSeen[key]
+            self._previous.pop(key, None)
+            self._totals.pop(key, None)
+            for tier in self.tiers:
+                for bucket in tier.buckets.itervalues():
+                    bucket.pop(key, None)
+            self.evictedKeyCount += 1
+
+    def _defaultAggregation(self, statName):
+        aggregationType = self.aggregationTypes.get(statName, StatAggregation.kNone)
+        return StatAggregation.kAverage if aggregationType == StatAggregation.kNone else aggregationType
+
+    def _statIndexOf(self, statName):
+        try:
+            return self._statIndexes[statName]
+        except KeyError:
+            raise ValueError("The stat '%s' is not aggregated. The aggregated stats are: %s." % (statName, ", ".join(self.valueStats)))
+
+    def _tierOf(self, resolution):
+        for tier in self.tiers:
+            if tier.resolution == resolution:
+                return tier
+        raise ValueError("No tier has a resolution of %s seconds. The resolutions are: %s." % (resolution, self.resolutions))
+
+    def _keysOf(self, snapshot):
+        if not self.keyStats:
+            return [(index,) for index in range(snapshot.rowCount)]
+        return zip(*[snapshot.column(statName) for statName in self.keyStats])
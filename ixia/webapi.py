@@ -1,16 +1,38 @@
 import cookielib
 import json
 import requests
-import string
 import time
 import httplib
 import textwrap
 import uuid
 import threading
 import copy
+import sys
+import os
+import array
+import collections
+import hashlib
+import tempfile
+import socket
+import re
+import weakref
+import atexit
+import traceback
 
 from copy import deepcopy
 from urlparse import urljoin
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+from requests.packages.urllib3.exceptions import ProtocolError, ReadTimeoutError
+from requests.packages.urllib3.connection import HTTPConnection, HTTPSConnection
+from requests.packages.urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urlparse import urlsplit
+
+# numpy is optional. It is only needed for Snapshot.column(..., asNumpy=True)
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # a list of supported scriptapi versions. 
 kSupportedScriptApiVersions = ['v1']
@@ -24,10 +46,83 @@ kJsonRenamedPropertyMap = {}
 for key, value in kJsonPropertyRenameMap.iteritems():
     kJsonRenamedPropertyMap[value] = key
 
-def waitForProperty(obj, propertyName, targetValues, validValues=[], invalidValues=[], timeout=None, trace=False):
+class WaitStrategy(object):
+    """Base class of the polling policies used by waitForProperty().
+
+    Subclasses implement nextInterval(). Strategies hold configuration only, so one instance
+    may be shared by any number of concurrent waits.
+
+    @param conditional: if True, objects are refreshed using conditional GETs (If-None-Match),
+                        so an unchanged object costs a 304 reply instead of a full transfer.
+                        Servers that don't return ETags simply get regular GETs.
+    """
+    def __init__(self, conditional=False):
+        self.conditional = conditional
+
+    def nextInterval(self, previousInterval, valueChanged):
+        """Returns the number of seconds to sleep before the next poll.
+
+        @param previousInterval: the interval returned for the previous poll, or None before the first sleep
+        @param valueChanged: True if the polled value differs from the value seen by the previous poll
+        """
+        raise NotImplementedError("WaitStrategy.nextInterval()")
+
+    def refresh(self, obj):
+        """Refreshes obj for the next poll."""
+        if self.conditional:
+            obj.httpRefresh(conditional=True)
+        else:
+            obj.httpRefresh()
+
+
+class FixedIntervalWait(WaitStrategy):
+    """Polls at a fixed interval (the historical behavior of waitForProperty).
+
+    @param interval: the number of seconds between polls
+    """
+    def __init__(self, interval=1, conditional=False):
+        super(FixedIntervalWait, self).__init__(conditional)
+        self.interval = interval
+
+    def nextInterval(self, previousInterval, valueChanged):
+        return self.interval
+
+
+class BackoffWait(WaitStrategy):
+    """Polls quickly at first, then backs off exponentially up to a max interval.
+
+    @param minInterval: the number of seconds before the second poll
+    @param maxInterval: the upper bound of the interval between polls
+    @param factor: the multiplier applied to the interval after each poll
+    @param adaptive: if True, the interval drops back to minInterval whenever the polled value changes,
+                     since a change (e.g. Starting -> Running) usually means another one is coming.
+    """
+    def __init__(self, minInterval=0.1, maxInterval=1.0, factor=1.5, adaptive=True, conditional=False):
+        super(BackoffWait, self).__init__(conditional)
+        if minInterval <= 0 or maxInterval < minInterval:
+            raise ValueError("BackoffWait requires 0 < minInterval <= maxInterval. Got %s and %s." % (minInterval, maxInterval))
+        if factor < 1:
+            raise ValueError("The 'factor' parameter must be at least 1. Was %s." % factor)
+        self.minInterval = minInterval
+        self.maxInterval = maxInterval
+        self.factor = factor
+        self.adaptive = adaptive
+
+    def nextInterval(self, previousInterval, valueChanged):
+        if previousInterval is None or (self.adaptive and valueChanged):
+            return self.minInterval
+        return min(previousInterval * self.factor, self.maxInterval)
+
+
+# The strategy used when none is specified. Its max interval matches the old fixed polling period,
+# so waits never notice a change later than they used to.
+kDefaultWaitStrategy = BackoffWait()
+
+def waitForProperty(obj, propertyName, targetValues, validValues=[], invalidValues=[], timeout=None, trace=False, waitStrategy=None):
     """Utility method to wait for a property on an object to change to an expected value.
 
-    Object must support getattr and implement the httpRefresh() method. Object is polled once per second.
+    Object must support getattr and implement the httpRefresh() method. Object is polled according to waitStrategy.
+    When a timeout is specified, the last sleep is cut short so that one final poll happens right at the deadline.
     @param obj: the object to query
     @param propertyName: the name of the property to check
     @param targetValues: a collection with the list of values for propertyName to wait for
@@ -35,10 +130,14 @@ def waitForProperty(obj, propertyName, targetValues, validValues=[], invalidValu
     @param invalidValues: a collection with a list of values for propertyName that cause an exception to be raised
     @param timeout: max number of seconds to wait
     @param trace: if True, then the property value is printed out each polling cycle.
+    @param waitStrategy: (optional) a WaitStrategy deciding the polling intervals. Defaults to kDefaultWaitStrategy.
     """
-    startTime = time.time()
+    waitStrategy = waitStrategy or kDefaultWaitStrategy
+    deadline = timeout and time.time() + timeout
+    interval = None
+    lastValue = None
     while True:
-        obj.httpRefresh()
+        waitStrategy.refresh(obj)
         value = getattr(obj, propertyName)
         if trace:
             print "property %s = %s" % (propertyName, value)
@@ -46,9 +145,14 @@ def waitForProperty(obj, propertyName, targetValues, validValues=[], invalidValu
             return
         if (validValues and value not in validValues) or value in invalidValues:
             raise WebException("waitForProperty(): %s has invalid %s == %s" % (obj.__class__, propertyName, value))
-        if timeout and time.time()-startTime > timeout:
-            raise WebApiTimeout("waitForProperty(): %s timed out waiting for %s in %s" % (obj.__class__, propertyName, targetValues))
-        time.sleep(1)
+        interval = waitStrategy.nextInterval(interval, interval is not None and value != lastValue)
+        lastValue = value
+        if deadline:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise WebApiTimeout("waitForProperty(): %s timed out waiting for %s in %s" % (obj.__class__, propertyName, targetValues))
+            interval = min(interval, remaining)
+        time.sleep(interval)
 
 def checkForPropertyValue(obj, propertyName, expectedValues, refresh=False):
     """Utility method to check if a property on an object has one of the expected values.
@@ -127,9 +231,75 @@ class _JsonEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, dict) or isinstance(obj, list):
             return super(_JsonEncoder, self).default(obj)
-        # proxy object
+        if isinstance(obj, _SlotWebObjectProxy):
+            return dict(obj._fieldItems_())
+        if isinstance(obj, WebObjectProxy):
+            # a proxy's lock and source are slots, so its __dict__ holds only json fields and needs no copy
+            return obj.__dict__
+        # other proxy objects
         return obj._jsonProperties_
 
+# encoders are stateless, so one instance serves every call (json.dumps(cls=...) would build one per call).
+# Web object trees are built from json and cannot be circular, so the circular reference check is skipped.
+_kJsonEncoder = _JsonEncoder(check_circular=False)
+
+
+_kJsonScalarTypes = frozenset([str, unicode, int, long, float, bool, type(None)])
+
+def _toJsonValue(value):
+    """Converts a tree of web objects into plain dictionaries and lists in a single pass, without a string round trip."""
+    if type(value) in _kJsonScalarTypes:
+        return value
+    if isinstance(value, (list, tuple)):
+        return [item if type(item) in _kJsonScalarTypes else _toJsonValue(item) for item in value]
+    if isinstance(value, dict):
+        items = value.iteritems()
+    elif isinstance(value, _SlotWebObjectProxy):
+        items = value._fieldItems_()
+    elif isinstance(value, WebObjectProxy):
+        items = value.__dict__.iteritems()
+    else:
+        items = value._jsonProperties_.iteritems()
+    return {key: item if type(item) in _kJsonScalarTypes else _toJsonValue(item) for key, item in items}
+
+
+class JsonBackend(object):
+    """The json implementation used to serialize web objects.
+
+    The default uses the standard json module's C encoder directly on the proxies. Any module with
+    json-compatible dumps() and loads() functions (e.g. ujson or simplejson) can be plugged in with set(),
+    in which case proxies are first converted with a single pass over the tree. useFastest() picks the
+    first installed module of kFastModules.
+    """
+    kFastModules = ["ujson", "simplejson"]
+
+    encode = staticmethod(_kJsonEncoder.encode)
+    loads = staticmethod(json.loads)
+    name = json.__name__
+
+    @classmethod
+    def set(cls, module):
+        """Uses module's dumps() and loads() for all web object serialization."""
+        Validators.checkNotNone(module, "module")
+        if module is json:
+            cls.encode = staticmethod(_kJsonEncoder.encode)
+        else:
+            cls.encode = staticmethod(lambda value: module.dumps(_toJsonValue(value)))
+        cls.loads = staticmethod(module.loads)
+        cls.name = module.__name__
+
+    @classmethod
+    def useFastest(cls):
+        """Uses the first installed module of kFastModules, if any, and returns the name of the backend in use."""
+        for moduleName in cls.kFastModules:
+            try:
+                module = __import__(moduleName)
+            except ImportError:
+                continue
+            cls.set(module)
+            break
+        return cls.name
+
 
 class WebObjectLocation(object):
     """An object represent the source of a web object.
@@ -140,6 +310,8 @@ class WebObjectLocation(object):
     """
     kLinksParam = "links"
     kEmbeddedParam = "embedded"
+    kHeaderETag = "ETag"
+    kHeaderIfNoneMatch = "If-None-Match"
     
     def __init__(self, convention, url, *urlExts):
         Validators.checkNotNone(convention, "convention")
@@ -148,6 +320,7 @@ class WebObjectLocation(object):
             url = HttpConvention.urljoin(url, urlExt)
         self.convention = convention
         self.url = url
+        self.etag = None
 
     def httpPut(self, target):
         """Put target object back to the contained location"""
@@ -157,14 +330,29 @@ class WebObjectLocation(object):
         """Patch the target object on the contained location"""
         self.convention.httpPatch(self.url, target)
 
-    def httpGet(self):
-        """Regets the object from the original location and returns it (as a WebObject)."""
-        return self.convention.httpGet(self.url)
+    def httpGet(self, conditional=False):
+        """Regets the object from the original location and returns it (as a WebObject).
+
+        @param conditional: if True and the server sent an ETag for the last get, then None is returned
+                            when the server reports that the object has not been modified since.
+        """
+        headers = {}
+        if conditional and self.etag:
+            headers[self.kHeaderIfNoneMatch] = self.etag
+        reply = self.convention.httpGetRaw(self.url, headers=headers)
+        if reply.status_code == httplib.NOT_MODIFIED:
+            return None
+        self.etag = reply.headers.get(self.kHeaderETag)
+        return self.convention.getWebObjectFromReply(reply, self.url)
 
     def httpGetProperty(self, url):
         """Gets a non-shallow property of this object"""
         return self.convention.httpGet(url, params={self.kLinksParam:True, self.kEmbeddedParam:False})
 
+    def httpGetEmbedded(self):
+        """Regets the object asking the server to embed its linked properties in the reply (if it supports that)."""
+        return self.convention.httpGet(self.url, params={self.kLinksParam:True, self.kEmbeddedParam:True})
+
     def httpDelete(self):
         """Delete the current object object from the web server"""
         self.convention.httpDelete(self.url)
@@ -187,12 +375,15 @@ class WebObjectBase(object):
 
     def __setattr__(self, propertyName, value):
         """Internal method to implement lock/unlock."""
-        if propertyName != WebObjectBase.kLockedProperty and self._locked_ and propertyName not in self.__dict__:
+        if propertyName not in WebObjectBase.kNonJsonProperties and getattr(self, WebObjectBase.kLockedProperty, False) and propertyName not in self.__dict__:
             raise KeyError("Cannot define new property when Json proxy is locked. Proxies may be unlocked and relocked using _unlock_() and _lock_() methods.")
         return super(WebObjectBase, self).__setattr__(propertyName, value)
 
     def __getattr__ (self, propertyName):
         """Internal method to automatically request data from web server for shallow web objects"""
+        if propertyName in WebObjectBase.kNonJsonProperties:
+            # not initialized yet (e.g. while being copied)
+            raise AttributeError(propertyName)
         if self._source_:
             try:
                 links = super(WebObjectBase, self).__getattribute__(WebObjectBase.kLinksProperty)
@@ -210,7 +401,7 @@ class WebObjectBase(object):
     @property
     def _json_(self):
         """Returns the json representation (in lists and dictionaries) for the WebObject."""
-        return json.loads(str(self))
+        return _toJsonValue(self)
 
     @property    
     def _pretty_(self):
@@ -218,14 +409,34 @@ class WebObjectBase(object):
 
     def __str__(self):
         """Convenience override of str() method to returns the json representation for the object."""
-        return json.dumps(self, cls=_JsonEncoder)
+        return str(JsonBackend.encode(self))
 
     @property
     def _jsonProperties_(self):
         properties = self.__dict__.copy()
         for propertyName in WebObjectBase.kNonJsonProperties:
-            del properties[propertyName]
+            properties.pop(propertyName, None)
         return properties
+
+    def _fieldItems_(self):
+        """Returns a list of (name, value) pairs for the json fields of this object."""
+        return self._jsonProperties_.items()
+
+    def _setField_(self, fieldName, value):
+        """Sets a json field, bypassing the property-creation lock."""
+        self.__dict__[fieldName] = value
+
+    def _deleteField_(self, fieldName):
+        """Removes a json field if it is present."""
+        self.__dict__.pop(fieldName, None)
+
+    def _hasField_(self, fieldName):
+        """Returns True if the json field is present (without fetching linked properties)."""
+        return fieldName in self.__dict__
+
+    def _prefetch_(self, paths=None, depth=1, embedded=False, maxConcurrency=None):
+        """Fetches linked properties ahead of use. See prefetchLinks()."""
+        return prefetchLinks(self, paths, depth, embedded, maxConcurrency)
     
     def _setNewField(self, fieldName, value):
         """Unlock the object if needed and add a new field"""
@@ -280,20 +491,26 @@ class WebObjectBase(object):
             raise WebException("WebObject.httpPatch(): cannot put back to source because source was not specified when object was created")
         self._source_.httpPatch(self)
 
-    def httpRefresh(self):
-        """Updates the state of this object from it's source url."""
+    def httpRefresh(self, conditional=False):
+        """Updates the state of this object from it's source url.
+
+        @param conditional: if True, use a conditional GET and leave the object untouched if the server reports no change.
+        """
         if not self._source_:
             raise WebException("WebObject.httpRefresh(): cannot refresh because source was not specified when object was created")
         
-        newData = self._source_.httpGet()
+        newData = self._source_.httpGet(conditional)
+        if newData is None and conditional:
+            return
         try:
             for link in self.links:
-                if link.rel in self.__dict__:
-                    del self.__dict__[link.rel]
+                self._deleteField_(link.rel)
         except AttributeError:
             pass
 
-        self.__dict__.update(newData.__dict__)
+        # keep our own source (and its ETag) and lock state, and take the fields of the new data
+        for fieldName, value in newData._fieldItems_():
+            self._setField_(fieldName, value)
 
     def httpDelete(self):
         """Delete the source of this object.
@@ -316,6 +533,9 @@ class WebObjectBase(object):
 
 class WebObjectProxy(WebObjectBase):
     """An element of a tree of json proxy objects that represents an object/dictionary."""
+    # keeping these out of the __dict__ leaves only json fields there (see _JsonEncoder)
+    __slots__ = (WebObjectBase.kLockedProperty, WebObjectBase.kSourceProperty)
+
     def __init__(self, _source_=None, **entries):
         super(WebObjectProxy, self).__init__(_source_)
         for key, value in entries.iteritems():
@@ -390,16 +610,153 @@ class WebListProxy(WebObjectBase, list):
                     item._setSource_(itemSource)
                     break
 
+class _SlotWebObjectProxy(WebObjectProxy):
+    """Base of the generated WebObjectProxy subclasses used by the kSlots representation.
+
+    Each generated class has one __slots__ entry per json field observed for a key set, so
+    instances need no per-instance __dict__. Fields that can't be slots (e.g. "$type") and
+    fields added after unlocking are stored in the (lazily created) __dict__ instead, and
+    _extras_ records that the __dict__ is in use.
+    """
+    __slots__ = ("_extras_",)
+    _slotFields_ = frozenset()
+
+    def __setattr__(self, propertyName, value):
+        """Internal method to implement lock/unlock."""
+        if propertyName not in self._slotFields_ and propertyName not in WebObjectProxy.__slots__ + _SlotWebObjectProxy.__slots__:
+            try:
+                locked = object.__getattribute__(self, WebObjectBase.kLockedProperty)
+            except AttributeError:
+                locked = False
+            if locked and propertyName not in self.__dict__:
+                raise KeyError("Cannot define new property when Json proxy is locked. Proxies may be unlocked and relocked using _unlock_() and _lock_() methods.")
+            object.__setattr__(self, "_extras_", True)
+        object.__setattr__(self, propertyName, value)
+
+    @property
+    def _jsonProperties_(self):
+        return dict(self._fieldItems_())
+
+    def _fieldItems_(self):
+        result = []
+        for fieldName in self._slotFields_:
+            try:
+                result.append((fieldName, object.__getattribute__(self, fieldName)))
+            except AttributeError:
+                # deleted by httpRefresh() and not yet refetched
+                pass
+        if self._extras_:
+            result.extend(self.__dict__.iteritems())
+        return result
+
+    def _setField_(self, fieldName, value):
+        if fieldName not in self._slotFields_:
+            object.__setattr__(self, "_extras_", True)
+        object.__setattr__(self, fieldName, value)
+
+    def _deleteField_(self, fieldName):
+        if fieldName in self._slotFields_:
+            try:
+                object.__delattr__(self, fieldName)
+            except AttributeError:
+                pass
+        elif self._extras_:
+            self.__dict__.pop(fieldName, None)
+
+    def _hasField_(self, fieldName):
+        if fieldName in self._slotFields_:
+            try:
+                object.__getattribute__(self, fieldName)
+                return True
+            except AttributeError:
+                return False
+        return self._extras_ and fieldName in self.__dict__
+
+
+class WebObjectRepresentation(object):
+    """Constants for the ways json objects in replies can be represented.
+
+    kProxy builds a WebObjectProxy with its own __dict__ for every json object.
+    kSlots builds instances of a generated __slots__ subclass of WebObjectProxy, one class per observed
+    key set. Attribute access, httpPut()/httpPatch() and locking behave the same, but large replies
+    take less memory and build faster. See ixia.benchmark.compareWebObjectRepresentations().
+    """
+    kProxy = "proxy"
+    kSlots = "slots"
+    # once this many key sets were seen, new key sets fall back to plain proxies to bound the class cache
+    kMaxSlotClasses = 1024
+
+    _current = kProxy
+    _slotClasses = {}
+    _slotClassesLock = threading.Lock()
+
+    @classmethod
+    def set(cls, representation):
+        """Selects the representation used for json objects created from now on."""
+        if representation not in [cls.kProxy, cls.kSlots]:
+            raise ValueError("The specified web object representation '%s' is not supported." % representation)
+        cls._current = representation
+
+    @classmethod
+    def get(cls):
+        return cls._current
+
+    @classmethod
+    def _slotClass(cls, keys):
+        # Returns the generated class for a key set, or None if the cache is full
+        keySet = frozenset(keys)
+        result = cls._slotClasses.get(keySet)
+        if result is None:
+            cls._slotClassesLock.acquire()
+            try:
+                result = cls._slotClasses.get(keySet)
+                if result is None and len(cls._slotClasses) < cls.kMaxSlotClasses:
+                    slotFields = tuple(sorted(key for key in (cls._slotName(key) for key in keySet) if key))
+                    result = type("WebObjectProxy_%d" % len(cls._slotClasses), (_SlotWebObjectProxy,),
+                                  {"__slots__": slotFields, "_slotFields_": frozenset(slotFields)})
+                    cls._slotClasses[keySet] = result
+            finally:
+                cls._slotClassesLock.release()
+        return result
+
+    @staticmethod
+    def _slotName(key):
+        # Returns key as a str if it can be a slot, or None if it has to live in the instance __dict__
+        try:
+            key = str(key)
+        except UnicodeError:
+            return None
+        if not key or key[0].isdigit() or not key.replace("_", "a").isalnum() or hasattr(_SlotWebObjectProxy, key):
+            return None
+        return key
+
+
+def _SlotWebObject(value):
+    """Helper factory method for json objects in the kSlots representation"""
+    cls = WebObjectRepresentation._slotClass(value)
+    if cls is None:
+        return None
+    result = cls.__new__(cls)
+    setField = object.__setattr__
+    setField(result, "_source_", None)
+    setField(result, "_extras_", len(value) != len(cls._slotFields_))
+    for key, item in value.iteritems():
+        setField(result, key, _WebObject(item))
+    setField(result, "_locked_", True)
+    return result
+
+
 def _WebObject(value):
     """Helper factory method for nested objects"""
     if isinstance(value, WebObjectBase):
         result = value
+    elif isinstance(value, dict) and WebObjectRepresentation._current == WebObjectRepresentation.kSlots:
+        result = _SlotWebObject(value)
+        if result is None:
+            result = WebObjectProxy(**_renameJsonProperties(value))
+            result._lock_()
     elif isinstance(value, dict):
-        for name, rename in kJsonPropertyRenameMap.iteritems():
-            if name in value:
-                value[rename] = value[name]
-                del value[name]
-        result = WebObjectProxy(**value)
+        result = WebObjectProxy(**_renameJsonProperties(value))
         result._lock_()
     elif isinstance(value, list):
         result = WebListProxy(value)
@@ -410,6 +767,15 @@ def _WebObject(value):
     return result
 
 
+def _renameJsonProperties(value):
+    """Renames the properties of a json dictionary that can't be passed as keyword arguments (see kJsonPropertyRenameMap)."""
+    for name, rename in kJsonPropertyRenameMap.iteritems():
+        if name in value:
+            value[rename] = value[name]
+            del value[name]
+    return value
+
+
 def WebObject(*args, **kwArgs):
     """Factory method that converts dictionaries and lists into json object proxies.
         This is useful to call on a response that is a known json object, in which case it returns a locked proxy object that
@@ -442,6 +808,106 @@ def WebObjectWithSource(value, source, **kwArgs):
     return result
 
 
+kDefaultPrefetchConcurrency = 8
+
+def prefetchLinks(webObject, paths=None, depth=1, embedded=False, maxConcurrency=None):
+    """Expands linked properties of a web object (or list of web objects) in a few concurrent passes.
+
+    Accessing a linked property normally costs one round trip per object (see WebObjectBase.__getattr__).
+    This fetches the requested relations for all objects of a level at once, running independent
+    fetches concurrently, and stores the results just like an access would, so later accesses are free.
+    Relations that are already present are not refetched.
+
+    @param webObject: a web object or list of web objects with a source (e.g. from httpGet)
+    @param paths: (optional) a list of dotted relation paths to expand, e.g. ["config", "config.ports"]
+    @param depth: if paths is not specified, every relation is expanded to this depth
+    @param embedded: if True, each object is first regot with embedded=true, so servers that support it
+                     return the linked properties inline. Relations not returned inline are fetched individually.
+    @param maxConcurrency: the max number of fetches in flight. Defaults to kDefaultPrefetchConcurrency.
+    @return webObject
+    """
+    maxConcurrency = maxConcurrency or kDefaultPrefetchConcurrency
+    Validators.checkInt(maxConcurrency, "maxConcurrency")
+    if paths is not None:
+        Validators.checkList(paths, "paths")
+        for path in paths:
+            Validators.checkNonEmptyString(path, "path")
+            level = [webObject]
+            for rel in path.split("."):
+                level = _expandLinks(level, [rel], embedded, maxConcurrency)
+    else:
+        Validators.checkInt(depth, "depth")
+        level = [webObject]
+        for depthIndex in range(depth):
+            level = _expandLinks(level, None, embedded, maxConcurrency)
+    return webObject
+
+def _expandLinks(level, rels, embedded, maxConcurrency):
+    # Fetches the rels (all if None) of the objects in level and returns the fetched values (the next level)
+    objects = [obj for obj in _flattenWebObjects(level) if obj._source_ and obj._hasField_(WebObjectBase.kLinksProperty)]
+    def wanted(obj):
+        return [link for link in obj.links
+                if link.rel != WebObjectBase.kSelfLink and (rels is None or link.rel in rels) and not obj._hasField_(link.rel)]
+    if embedded:
+        missing = [obj for obj in objects if wanted(obj)]
+        for obj, full in zip(missing, _concurrentMap(lambda obj: obj._source_.httpGetEmbedded(), missing, maxConcurrency)):
+            if not isinstance(full, WebObjectBase):
+                continue
+            for link in wanted(obj):
+                if full._hasField_(link.rel):
+                    obj._setNewField(link.rel, getattr(full, link.rel))
+    pending = [(obj, link) for obj in objects for link in wanted(obj)]
+    results = _concurrentMap(lambda (obj, link): obj._source_.httpGetProperty(link.href), pending, maxConcurrency)
+    for (obj, link), result in zip(pending, results):
+        obj._setNewField(link.rel, result)
+    return [getattr(obj, link.rel) for obj in objects for link in obj.links
+            if link.rel != WebObjectBase.kSelfLink and (rels is None or link.rel in rels) and obj._hasField_(link.rel)]
+
+def _flattenWebObjects(values):
+    # Returns the web objects in values, with lists replaced by their elements
+    result = []
+    for value in values:
+        if isinstance(value, list):
+            result.extend(_flattenWebObjects(value))
+        elif isinstance(value, WebObjectBase):
+            result.append(value)
+    return result
+
+def _concurrentMap(function, items, maxConcurrency):
+    """Calls function on every item using up to maxConcurrency threads and returns the results in order.
+
+    If any call raises, the remaining items are skipped and the first exception is re-raised.
+    """
+    items = list(items)
+    if maxConcurrency <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+    results = [None] * len(items)
+    errors = []
+    indexes = iter(range(len(items)))
+    lock = threading.Lock()
+    def work():
+        while not errors:
+            lock.acquire()
+            try:
+                index = next(indexes, None)
+            finally:
+                lock.release()
+            if index is None:
+                return
+            try:
+                results[index] = function(items[index])
+            except Exception:
+                errors.append(sys.exc_info())
+    threads = [threading.Thread(target=work) for index in range(min(maxConcurrency, len(items)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+    return results
+
+
 class WebException(Exception):
     """Exception for nonstandard exceptions thrown by webapi module"""
     def __init__(self, description="", result=None, extra=""):
@@ -461,12 +927,772 @@ class StatsTimeoutException(WebException):
     """ Specialized exception for timeouts when getting stats values """
     pass
 
+
+class Future(object):
+    """The eventual result of an asynchronous operation.
+
+    Futures are thread safe. Callers may block on result() from any thread other than the
+    event loop's own, or chain work with addDoneCallback() or by yielding the future from a coroutine.
+    """
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._done = False
+        self._result = None
+        self._excInfo = None
+        self._callbacks = []
+
+    def done(self):
+        """Returns True if the operation completed (successfully or not)."""
+        return self._done
+
+    def result(self, timeout=None):
+        """Blocks until the operation completes and returns its result, or raises its exception.
+
+        @param timeout: max number of seconds to wait
+        @raises WebApiTimeout if the operation did not complete in time
+        """
+        self._condition.acquire()
+        try:
+            if not self._done:
+                self._condition.wait(timeout)
+            if not self._done:
+                raise WebApiTimeout("Future.result(): timed out after %s seconds" % timeout)
+        finally:
+            self._condition.release()
+        if self._excInfo:
+            raise self._excInfo[0], self._excInfo[1], self._excInfo[2]
+        return self._result
+
+    def exception(self):
+        """Returns the exception raised by the operation, or None."""
+        return self._excInfo and self._excInfo[1] or None
+
+    def addDoneCallback(self, callback):
+        """Calls callback(future) when the operation completes (immediately if it already has)."""
+        self._condition.acquire()
+        try:
+            if not self._done:
+                self._callbacks.append(callback)
+                return
+        finally:
+            self._condition.release()
+        callback(self)
+
+    def setResult(self, value):
+        self._complete(value, None)
+
+    def setException(self, exception):
+        self._complete(None, (type(exception), exception, None))
+
+    def _setExcInfo(self, excInfo):
+        self._complete(None, excInfo)
+
+    def _complete(self, value, excInfo):
+        self._condition.acquire()
+        try:
+            if self._done:
+                return
+            self._result = value
+            self._excInfo = excInfo
+            self._done = True
+            callbacks, self._callbacks = self._callbacks, []
+            self._condition.notifyAll()
+        finally:
+            self._condition.release()
+        for callback in callbacks:
+            callback(self)
+
+
+class _AsyncOperation(object):
+    # an asynchronous operation tracked by an AsyncOperationPoller
+    def __init__(self, poller, convention, future, deadline):
+        self.poller = poller
+        self.convention = convention
+        self.future = future
+        self.deadline = deadline
+        self.statusUrl = None
+        self.lastMethod = HttpConvention.kMethodPost
+        self.progress = None
+        self.progressTime = None
+        self.interval = None
+        self.nextPoll = None
+
+    def update(self, reply, now):
+        # handles a status reply. Returns True once the future is resolved, or schedules the next poll.
+        try:
+            if not reply.text:
+                raise WebException("Status not returned from query to %s" % reply.url, extra=self.convention._getFormattedErrorNotifications())
+            status = WebObject(reply.json())
+            if not self.statusUrl:
+                self.statusUrl = status.url
+            if status.progress >= 100:
+                if status.state.lower() != "success":
+                    raise WebException("%s to '%s' returned error. State: '%s' Message: '%s'" \
+                        % (self.lastMethod, reply.url, status.state, status.message), extra=self.convention._getFormattedErrorNotifications())
+                self.future.setResult(status)
+                return True
+            if self.deadline is not None and now >= self.deadline:
+                raise WebApiTimeout("The operation %s did not complete in time (progress %s%%)" % (self.statusUrl, status.progress))
+            self.schedule(status.progress, now)
+            return False
+        except Exception:
+            self.future._setExcInfo(sys.exc_info())
+            return True
+
+    def fail(self, excInfo):
+        self.future._setExcInfo(excInfo)
+        return True
+
+    def schedule(self, progress, now):
+        poller = self.poller
+        if self.interval is None:
+            interval = poller.minInterval
+        else:
+            interval = min(self.interval * poller.factor, poller.maxInterval)
+        if self.progress is not None and progress > self.progress and now > self.progressTime:
+            # poll around the time the operation is expected to complete, so the last polls come sooner near 100%
+            rate = (progress - self.progress) / (now - self.progressTime)
+            interval = max(min(interval, (100 - progress) / rate), poller.minInterval)
+        if progress != self.progress:
+            self.progress = progress
+            self.progressTime = now
+        if self.deadline is not None:
+            interval = max(min(interval, self.deadline - now), 0)
+        self.interval = interval
+        self.nextPoll = now + interval
+
+
+class AsyncOperationPoller(object):
+    """Polls the status of the asynchronous operations (202 replies) of a connection from one shared thread.
+
+    The operations are polled with a backoff that starts at minInterval and grows by factor up to maxInterval,
+    but is shortened to the expected completion time as soon as the progress of an operation moves, so the
+    final polls come sooner as the operation nears 100%. The operations that are due within the same tick
+    are polled together, with up to maxConcurrentPolls requests at once, and operations sharing a status url
+    cost a single request. The thread exits when there is nothing left to poll, and is stopped by close()
+    (called by Connection.close(), and for all the pollers when the interpreter exits).
+
+    @param minInterval: the number of seconds before the first poll of an operation
+    @param maxInterval: the upper bound of the interval between two polls of an operation
+    @param factor: the multiplier applied to the interval after each poll that shows no completion
+    @param maxConcurrentPolls: the max number of status requests sent at the same time
+    """
+    kDefaultMinInterval = 0.1
+    kDefaultMaxInterval = 2.0
+    kDefaultFactor = 1.5
+    kDefaultMaxConcurrentPolls = 4
+    kTickSeconds = 0.05
+    kIdleSeconds = 5
+
+    def __init__(self, minInterval=kDefaultMinInterval, maxInterval=kDefaultMaxInterval, factor=kDefaultFactor,
+                 maxConcurrentPolls=kDefaultMaxConcurrentPolls):
+        if minInterval <= 0 or maxInterval < minInterval:
+            raise ValueError("AsyncOperationPoller requires 0 < minInterval <= maxInterval. Got %s and %s." % (minInterval, maxInterval))
+        if factor < 1:
+            raise ValueError("The 'factor' parameter must be at least 1. Was %s." % factor)
+        Validators.checkInt(maxConcurrentPolls, "maxConcurrentPolls")
+        self.minInterval = minInterval
+        self.maxInterval = maxInterval
+        self.factor = factor
+        self.maxConcurrentPolls = maxConcurrentPolls
+        self.pollCount = 0
+        self._operations = []
+        self._condition = threading.Condition()
+        self._thread = None
+        self._closed = False
+        _asyncOperationPollers.add(self)
+
+    def submit(self, convention, reply, timeout=None):
+        """Tracks the asynchronous operation started by reply and returns a Future resolved with its final status.
+
+        @param convention: the HttpConvention that sent the request
+        @param reply: the 202 reply of the request
+        @param timeout: (optional) the max number of seconds to wait for the operation to complete. The future
+                        fails with a WebApiTimeout after that.
+        """
+        future = Future()
+        now = time.time()
+        operation = _AsyncOperation(self, convention, future, timeout and now + timeout)
+        if not operation.update(reply, now):
+            self._condition.acquire()
+            try:
+                if self._closed:
+                    raise WebException("The AsyncOperationPoller is closed.")
+                self._operations.append(operation)
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="AsyncOperationPoller")
+                    self._thread.daemon = True
+                    self._thread.start()
+                self._condition.notify()
+            finally:
+                self._condition.release()
+        return future
+
+    @property
+    def pendingCount(self):
+        """The number of operations waiting for completion."""
+        return len(self._operations)
+
+    def close(self):
+        """Fails the operations still pending and stops the polling thread."""
+        self._condition.acquire()
+        try:
+            self._closed = True
+            operations, self._operations = self._operations, []
+            thread = self._thread
+            self._condition.notifyAll()
+        finally:
+            self._condition.release()
+        self._cancel(operations)
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    @staticmethod
+    def _cancel(operations):
+        for operation in operations:
+            operation.future.setException(WebException("The operation %s was cancelled: the poller was closed." % operation.statusUrl))
+
+    def _run(self):
+        while True:
+            due = self._nextDue()
+            if due is None:
+                return
+            # operations sharing a status url are polled once
+            byUrl = collections.OrderedDict()
+            for operation in due:
+                byUrl.setdefault(operation.statusUrl, []).append(operation)
+            pending = _concurrentMap(self._poll, byUrl.values(), self.maxConcurrentPolls)
+            self._condition.acquire()
+            try:
+                closed = self._closed
+                if not closed:
+                    for operations in pending:
+                        self._operations.extend(operations)
+            finally:
+                self._condition.release()
+            if closed:
+                for operations in pending:
+                    self._cancel(operations)
+
+    def _nextDue(self):
+        # waits for the operations due in the next tick and removes them from the list, or returns None when idle
+        self._condition.acquire()
+        try:
+            while True:
+                if self._closed:
+                    self._thread = None
+                    return None
+                if not self._operations:
+                    self._condition.wait(self.kIdleSeconds)
+                    if not self._operations:
+                        self._thread = None
+                        return None
+                    continue
+                now = time.time()
+                nextPoll = min(operation.nextPoll for operation in self._operations)
+                if nextPoll <= now:
+                    break
+                self._condition.wait(nextPoll - now)
+            due = [operation for operation in self._operations if operation.nextPoll <= now + self.kTickSeconds]
+            self._operations = [operation for operation in self._operations if operation.nextPoll > now + self.kTickSeconds]
+            return due
+        finally:
+            self._condition.release()
+
+    def _poll(self, operations):
+        # polls the status url of operations and returns those that are still pending
+        try:
+            reply = operations[0].convention.httpGetRaw(operations[0].statusUrl, allow_redirects=False)
+            excInfo = None
+        except Exception:
+            reply = None
+            excInfo = sys.exc_info()
+        # several statuses are polled at once by the threads of _concurrentMap
+        self._condition.acquire()
+        try:
+            self.pollCount += 1
+        finally:
+            self._condition.release()
+        now = time.time()
+        pending = []
+        for operation in operations:
+            operation.lastMethod = HttpConvention.kMethodGet
+            if not (operation.fail(excInfo) if reply is None else operation.update(reply, now)):
+                pending.append(operation)
+        return pending
+
+
+# the pollers are stopped before the interpreter exits: a polling thread waking up while the modules are torn
+# down fails with errors such as "'NoneType' object is not callable"
+_asyncOperationPollers = weakref.WeakSet()
+
+@atexit.register
+def _closeAsyncOperationPollers():
+    for poller in list(_asyncOperationPollers):
+        poller.close()
+
+
+# The connection timings of the request being sent by the current thread (see RequestInfo).
+# None when no request observer is listening, so unobserved requests pay nothing.
+_requestTimings = threading.local()
+
+
+def _addRequestTiming(name, seconds):
+    timings = getattr(_requestTimings, "timings", None)
+    if timings is not None:
+        timings[name] = timings.get(name, 0) + seconds
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    # times the DNS lookup and the TCP connect of new pooled connections
+    def _new_conn(self):
+        if getattr(_requestTimings, "timings", None) is None:
+            return super(_TimedHTTPConnection, self)._new_conn()
+        host = self._dns_host
+        startTime = time.time()
+        try:
+            addresses = socket.getaddrinfo(host, self.port, 0, socket.SOCK_STREAM)
+        except socket.error:
+            addresses = None
+        connectTime = time.time()
+        _addRequestTiming(RequestInfo.kDns, connectTime - startTime)
+        try:
+            if addresses:
+                # connect to the address just resolved (falling back to urllib3's own lookup if it fails)
+                self._dns_host = addresses[0][4][0]
+                try:
+                    return super(_TimedHTTPConnection, self)._new_conn()
+                except Exception:
+                    self._dns_host = host
+            return super(_TimedHTTPConnection, self)._new_conn()
+        finally:
+            self._dns_host = host
+            _addRequestTiming(RequestInfo.kConnect, time.time() - connectTime)
+
+
+class _TimedHTTPSConnection(HTTPSConnection, _TimedHTTPConnection):
+    # also times the TLS handshake, which is whatever connect() spends outside of _new_conn()
+    def connect(self):
+        timings = getattr(_requestTimings, "timings", None)
+        if timings is None:
+            return super(_TimedHTTPSConnection, self).connect()
+        before = timings.get(RequestInfo.kDns, 0) + timings.get(RequestInfo.kConnect, 0)
+        startTime = time.time()
+        super(_TimedHTTPSConnection, self).connect()
+        socketTime = timings.get(RequestInfo.kDns, 0) + timings.get(RequestInfo.kConnect, 0) - before
+        _addRequestTiming(RequestInfo.kTls, max(time.time() - startTime - socketTime, 0))
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _TimedHTTPAdapter(HTTPAdapter):
+    # an HTTPAdapter whose connections report their DNS, connect and TLS times to the request observers
+    def init_poolmanager(self, *args, **kwArgs):
+        super(_TimedHTTPAdapter, self).init_poolmanager(*args, **kwArgs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _TimedHTTPConnectionPool, "https": _TimedHTTPSConnectionPool}
+
+
+class RequestInfo(object):
+    """What an HttpConvention request did, as passed to the request observers (see HttpConvention.addRequestObserver).
+
+    Times are in seconds. dns, connect and tls are 0 when the request reused a pooled connection, and are
+    only measured by HttpTransport connections. server is the time from sending the request to receiving the
+    reply headers (minus the connection setup), transfer the time to read the body; streamed bodies are read
+    after the request returns, so their transfer time is not included.
+
+    @ivar method: the HTTP method
+    @ivar url: the absolute url
+    @ivar template: the url path with the ids replaced by {id}, e.g. sessions/{id}/ixchariot/testruns/{id}/operations/start
+    @ivar status: the HTTP status code, or None if no reply was received
+    @ivar bytesOut: the size of the request body and headers
+    @ivar bytesIn: the size of the reply body (the Content-Length of streamed replies), or None if unknown
+    @ivar seconds: the total time of the request
+    @ivar retries: the number of times the request was retried by the transport
+    @ivar error: the exception raised while sending the request, or None
+    """
+    kDns = "dns"
+    kConnect = "connect"
+    kTls = "tls"
+    kServer = "server"
+    kTransfer = "transfer"
+    kPhases = [kDns, kConnect, kTls, kServer, kTransfer]
+
+    def __init__(self, method, url, template):
+        self.method = method
+        self.url = url
+        self.template = template
+        self.status = None
+        self.bytesOut = 0
+        self.bytesIn = None
+        self.seconds = 0
+        self.dns = 0
+        self.connect = 0
+        self.tls = 0
+        self.server = 0
+        self.transfer = 0
+        self.retries = 0
+        self.error = None
+
+    def __repr__(self):
+        return "RequestInfo(%s %s, status=%s, seconds=%.6f)" % (self.method, self.template, self.status, self.seconds)
+
+    @staticmethod
+    def templateOf(path, basePath=""):
+        """Returns path without basePath and with its numeric and uuid segments replaced by {id}."""
+        if basePath and path.startswith(basePath):
+            path = path[len(basePath):]
+        return "/".join(RequestInfo._kIdTemplate if RequestInfo._isId(segment) else segment
+                        for segment in path.strip("/").split("/"))
+
+    _kIdTemplate = "{id}"
+    _kHexDigits = frozenset("0123456789abcdefABCDEF-")
+
+    @staticmethod
+    def _isId(segment):
+        if segment.isdigit():
+            return True
+        return len(segment) >= 16 and not segment.strip("-").isalpha() and set(segment) <= RequestInfo._kHexDigits
+
+
+class HttpTransport(object):
+    """A connection-pooled, keep-alive HTTP transport.
+
+    One transport is normally created per Connection and shared by all of its child conventions
+    (Session, UserAdmin, WebObjectLocation), so TCP connections and TLS sessions are reused
+    across requests instead of being re-established for every call.
+
+    @param poolConnections: the number of per-host connection pools to cache
+    @param poolMaxSize: the maximum number of connections kept alive in each pool
+    @param poolBlock: if True, requests wait for a free connection instead of opening extra ones when the pool is exhausted
+    @param retries: the number of times a request is retried on connection errors (and on read errors for idempotent methods)
+    @param backoffFactor: the backoff factor (in seconds) applied between retries
+    @param retryStatusCodes: (optional) a collection of HTTP status codes that should also be retried
+    @param keepAlive: if False, the server is asked to close the connection after each request
+    """
+    kDefaultPoolConnections = 4
+    kDefaultPoolMaxSize = 16
+    kDefaultRetries = 3
+    kDefaultBackoffFactor = 0.2
+    kHeaderConnection = "Connection"
+    kConnectionClose = "close"
+    kSchemes = ["http://", "https://"]
+
+    def __init__(self,
+                 poolConnections=kDefaultPoolConnections,
+                 poolMaxSize=kDefaultPoolMaxSize,
+                 poolBlock=False,
+                 retries=kDefaultRetries,
+                 backoffFactor=kDefaultBackoffFactor,
+                 retryStatusCodes=(),
+                 keepAlive=True):
+        Validators.checkInt(poolConnections, "poolConnections")
+        Validators.checkInt(poolMaxSize, "poolMaxSize")
+        Validators.checkInt(retries, "retries")
+        self.poolConnections = poolConnections
+        self.poolMaxSize = poolMaxSize
+        self.retries = retries
+        self.keepAlive = keepAlive
+        retryArgs = {"total": retries, "connect": retries, "read": retries, "backoff_factor": backoffFactor}
+        if retryStatusCodes:
+            retryArgs.update(status_forcelist=retryStatusCodes, raise_on_status=False)
+        adapter = _TimedHTTPAdapter(pool_connections=poolConnections,
+                                    pool_maxsize=poolMaxSize,
+                                    pool_block=poolBlock,
+                                    max_retries=Retry(**retryArgs))
+        self.httpSession = requests.Session()
+        for scheme in self.kSchemes:
+            self.httpSession.mount(scheme, adapter)
+        if not keepAlive:
+            self.httpSession.headers[self.kHeaderConnection] = self.kConnectionClose
+
+    def request(self, method, url, **kwArgs):
+        """Sends an HTTP request over a pooled connection and returns a Requests library result object."""
+        return self.httpSession.request(method, url, **kwArgs)
+
+    def close(self):
+        """Closes all pooled connections."""
+        self.httpSession.close()
+
+
+class StreamingDownload(object):
+    """Downloads a binary resource (a result zip, a diagnostics archive, an exported configuration) into a file.
+
+    The reply is read with readinto() into one reused buffer, in chunks that grow from kMinChunkSize up to
+    kMaxChunkSize while the data arrives faster than the chunks are filled, and real files are written with
+    os.write() on their descriptor. If the connection drops, the download resumes where it stopped with an
+    HTTP Range request (when the server supports it), up to resumeAttempts times.
+
+    @param convention: the HttpConvention used to send the requests
+    @param url: the url of the resource
+    @param progress: (optional) a function(bytesDone, totalBytes, bytesPerSecond) called after each chunk.
+                     totalBytes is None if the server did not send a Content-Length.
+    @param resumeAttempts: the max number of times a dropped download is resumed
+    """
+    kMinChunkSize = 64 * 1024
+    kMaxChunkSize = 4 * 1024 * 1024
+    kTargetReadSeconds = 0.1
+    kDefaultResumeAttempts = 3
+    kHeaderRange = "Range"
+    kHeaderIfRange = "If-Range"
+    kHeaderETag = "ETag"
+    kHeaderContentLength = "Content-Length"
+    kHeaderContentEncoding = "Content-Encoding"
+    kDroppedConnectionErrors = (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError,
+                                ProtocolError, ReadTimeoutError, httplib.IncompleteRead, socket.error)
+
+    def __init__(self, convention, url, progress=None, resumeAttempts=kDefaultResumeAttempts):
+        Validators.checkNotNone(convention, "convention")
+        Validators.checkString(url, "url")
+        Validators.checkInt(resumeAttempts, "resumeAttempts")
+        self.convention = convention
+        self.url = url
+        self.progress = progress
+        self.resumeAttempts = resumeAttempts
+        self.bytesDone = 0
+        self.totalBytes = None
+        self.resumeCount = 0
+        self._local = threading.local()
+        self._startTime = None
+
+    def toFile(self, target):
+        """Downloads the resource into the file-like object target and returns the number of bytes written."""
+        Validators.checkFile(target, "target")
+        target.flush()
+        # real files are written through their descriptor, without copying each chunk into a string
+        fd = target.fileno() if isinstance(target, file) else None
+        startPosition = self._tell(target, fd)
+        self._startTime = time.time()
+        etag = None
+        while True:
+            headers = {}
+            if self.bytesDone:
+                headers[self.kHeaderRange] = "bytes=%d-" % self.bytesDone
+                if etag:
+                    headers[self.kHeaderIfRange] = etag
+            reply = self.convention.httpGetRaw(self.url, headers=headers, stream=True)
+            try:
+                if self.bytesDone and reply.status_code != httplib.PARTIAL_CONTENT:
+                    # the server sent the whole resource again: start over if the target allows it
+                    if startPosition is None:
+                        raise WebException("The download of %s was interrupted and the server cannot resume it" % self.url)
+                    target.seek(startPosition)
+                    target.truncate()
+                    self.bytesDone = 0
+                if not self.bytesDone:
+                    contentLength = reply.headers.get(self.kHeaderContentLength)
+                    self.totalBytes = int(contentLength) if contentLength else None
+                    etag = reply.headers.get(self.kHeaderETag)
+                dropped = False
+                try:
+                    self._copy(reply, target, fd)
+                except self.kDroppedConnectionErrors:
+                    dropped = True
+            finally:
+                reply.close()
+            if not dropped and (self.totalBytes is None or self.bytesDone >= self.totalBytes):
+                break
+            if self.resumeCount >= self.resumeAttempts:
+                raise WebException("The download of %s was interrupted after %s of %s bytes" % (self.url, self.bytesDone, self.totalBytes))
+            self.resumeCount += 1
+        if fd is not None and startPosition is not None:
+            # keep the position of the file object in sync with the writes made on its descriptor
+            target.seek(os.lseek(fd, 0, os.SEEK_CUR))
+        target.flush()
+        return self.bytesDone
+
+    def _copy(self, reply, target, fd):
+        # copies the reply to fd (or to target when fd is None) and returns the number of bytes copied
+        raw = reply.raw
+        copied = 0
+        if reply.headers.get(self.kHeaderContentEncoding) or not hasattr(raw, "readinto"):
+            # compressed replies are decoded by the requests library
+            for chunk in reply.iter_content(chunk_size=self.kMinChunkSize):
+                self._write(target, fd, chunk, len(chunk))
+                copied += len(chunk)
+            return copied
+        chunkSize = self.kMinChunkSize
+        while True:
+            # each thread reuses its own buffer
+            buffer = getattr(self._local, "buffer", None)
+            if buffer is None or len(buffer) < chunkSize:
+                buffer = self._local.buffer = bytearray(chunkSize)
+            view = memoryview(buffer)[:chunkSize]
+            readStart = time.time()
+            count = raw.readinto(view)
+            if not count:
+                return copied
+            elapsed = time.time() - readStart
+            self._write(target, fd, view, count)
+            copied += count
+            # grow the chunks while they are filled quickly, shrink them when the data trickles in
+            if count == chunkSize and elapsed < self.kTargetReadSeconds / 4:
+                chunkSize = min(chunkSize * 2, self.kMaxChunkSize)
+            elif elapsed > self.kTargetReadSeconds:
+                chunkSize = max(chunkSize // 2, self.kMinChunkSize)
+
+    def _write(self, target, fd, data, count):
+        if fd is not None:
+            written = 0
+            while written < count:
+                written += os.write(fd, data[written:count])
+        elif isinstance(data, memoryview):
+            target.write(data[:count].tobytes())
+        else:
+            target.write(data)
+        self._advance(count)
+
+    def _advance(self, count):
+        self.bytesDone += count
+        if self.progress is not None:
+            elapsed = time.time() - self._startTime
+            self.progress(self.bytesDone, self.totalBytes, self.bytesDone / elapsed if elapsed > 0 else None)
+
+    @staticmethod
+    def _tell(target, fd):
+        try:
+            return os.lseek(fd, 0, os.SEEK_CUR) if fd is not None else target.tell()
+        except (AttributeError, IOError, OSError):
+            return None
+
+
+class SegmentedDownload(StreamingDownload):
+    """Downloads a large resource over several connections at once.
+
+    The resource is split into segments of segmentSize bytes that are fetched concurrently with HTTP Range
+    requests and written in place into the target file, which is first extended to its final size. Each
+    segment resumes on its own if its connection drops. When the server does not support ranges, or the
+    target is not a file on disk, the resource is downloaded as a single stream (see StreamingDownload).
+
+    @param convention: the HttpConvention used to send the requests
+    @param url: the url of the resource
+    @param progress: (optional) a function(bytesDone, totalBytes, bytesPerSecond) called after each chunk
+    @param maxConnections: the number of segments downloaded at the same time
+    @param segmentSize: the size of the segments, in bytes
+    @param resumeAttempts: the max number of times each segment is resumed
+    """
+    kDefaultMaxConnections = 4
+    kDefaultSegmentSize = 16 * 1024 * 1024
+    kHeaderContentRange = "Content-Range"
+
+    def __init__(self, convention, url, progress=None, maxConnections=kDefaultMaxConnections,
+                 segmentSize=kDefaultSegmentSize, resumeAttempts=StreamingDownload.kDefaultResumeAttempts):
+        super(SegmentedDownload, self).__init__(convention, url, progress, resumeAttempts)
+        Validators.checkInt(maxConnections, "maxConnections")
+        Validators.checkInt(segmentSize, "segmentSize")
+        if segmentSize < self.kMinChunkSize:
+            raise ValueError("segmentSize must be at least %s bytes." % self.kMinChunkSize)
+        self.maxConnections = maxConnections
+        self.segmentSize = segmentSize
+        self.segmented = False
+        self._lock = threading.Lock()
+        self._etag = None
+
+    def toFile(self, target):
+        """Downloads the resource into the file target and returns the number of bytes written.
+
+        Files opened for appending are written to by a single stream, since the segments are written at their offsets.
+        """
+        Validators.checkFile(target, "target")
+        path = getattr(target, "name", None)
+        if (self.maxConnections <= 1 or not isinstance(target, file) or not isinstance(path, basestring)
+                or not os.path.isfile(path) or "a" in target.mode):
+            return super(SegmentedDownload, self).toFile(target)
+        # the first segment also tells whether the server supports ranges and the size of the resource
+        reply = self.convention.httpGetRaw(self.url, headers={self.kHeaderRange: self._range(0, self.segmentSize)}, stream=True)
+        totalBytes = self._totalBytes(reply)
+        if totalBytes is None:
+            reply.close()
+            return super(SegmentedDownload, self).toFile(target)
+        self.segmented = True
+        self.totalBytes = totalBytes
+        self._etag = reply.headers.get(self.kHeaderETag)
+        self._startTime = time.time()
+        target.flush()
+        startPosition = target.tell()
+        originalSize = os.fstat(target.fileno()).st_size
+        target.truncate(startPosition + totalBytes)
+        segments = [(offset, min(offset + self.segmentSize, totalBytes))
+                    for offset in range(0, totalBytes, self.segmentSize)]
+        replies = {0: reply}
+        try:
+            _concurrentMap(lambda segment: self._downloadSegment(path, startPosition, segment, replies.pop(segment[0], None)),
+                           segments, self.maxConnections)
+        except:
+            # does not leave a partly written (or sparse) file behind
+            target.truncate(originalSize)
+            target.seek(startPosition)
+            raise
+        finally:
+            if replies:
+                reply.close()
+        target.seek(startPosition + totalBytes)
+        return self.bytesDone
+
+    def _downloadSegment(self, path, startPosition, segment, reply):
+        start, end = segment
+        done = 0
+        attempts = 0
+        fd = os.open(path, os.O_WRONLY)
+        try:
+            while True:
+                if reply is None:
+                    headers = {self.kHeaderRange: self._range(start + done, end)}
+                    if self._etag:
+                        headers[self.kHeaderIfRange] = self._etag
+                    reply = self.convention.httpGetRaw(self.url, headers=headers, stream=True)
+                try:
+                    if reply.status_code != httplib.PARTIAL_CONTENT:
+                        raise WebException("The server stopped returning ranges of %s (the resource may have changed)" % self.url)
+                    os.lseek(fd, startPosition + start + done, os.SEEK_SET)
+                    try:
+                        done += self._copy(reply, None, fd)
+                    except self.kDroppedConnectionErrors:
+                        pass
+                finally:
+                    reply.close()
+                    reply = None
+                if start + done >= end:
+                    return
+                if attempts >= self.resumeAttempts:
+                    raise WebException("The download of bytes %s-%s of %s was interrupted after %s bytes" % (start, end - 1, self.url, done))
+                attempts += 1
+                with self._lock:
+                    self.resumeCount += 1
+        finally:
+            os.close(fd)
+
+    def _advance(self, count):
+        with self._lock:
+            super(SegmentedDownload, self)._advance(count)
+
+    def _totalBytes(self, reply):
+        # returns the size of the resource from a 206 reply, or None if the reply cannot be used for a segmented download
+        contentRange = reply.headers.get(self.kHeaderContentRange, "")
+        if reply.status_code != httplib.PARTIAL_CONTENT or reply.headers.get(self.kHeaderContentEncoding) or "/" not in contentRange:
+            return None
+        try:
+            return int(contentRange.rsplit("/", 1)[1])
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _range(start, end):
+        return "bytes=%d-%d" % (start, end - 1)
+
+
 class HttpConvention(object):
     """Class for remembering a set of common headers, urlParameters, and cookies used by an HTTP conversation.
         @param url:     the base url. The url passed into the specific methods will be appended to this one 
         @param parentConvention: (optional) an HttpConvention that is extended by this one
         @param params:  (optional) a dictionary of name value pairs to send as URL urlParameters
         @param headers: (optional) a dictionary of name value pairs to send as HTTP headers
+        @param transport: (optional) an HttpTransport used to send requests. Defaults to the parent convention's transport.
     """
     kMethodDelete = "DELETE"
     kMethodGet = "GET"
@@ -479,13 +1705,17 @@ class HttpConvention(object):
 
     kStandardStreamingChunkSize = 10240
 
-    def __init__(self, url, parentConvention=None, params={}, headers={}, **kwArgs):
+    def __init__(self, url, parentConvention=None, params={}, headers={}, transport=None, **kwArgs):
         self.url = url
         self.parentConvention = parentConvention
+        self.transport = transport
         self.params = params.copy()
         self.headers = headers.copy()
         self.cookies = cookielib.CookieJar();
         self.extras = kwArgs
+        # the AsyncOperationPoller shared by this convention and its children. Only the root convention has one.
+        self.asyncOperationPoller = None if parentConvention else AsyncOperationPoller()
+        self.requestObservers = []
 
     def updateHeaders(self, headerDict):
         """Add or change HTTP headers used for all operations by this object."""
@@ -552,10 +1782,84 @@ class HttpConvention(object):
         # set verify to False to turn off SSL certificate validation 
         extras = {"verify":False}
         extras.update(self.resolveExtras(kwArgs))
-        result = requests.request(method, absUrl, data=str(data), params=params, headers=headers, cookies=self.cookies, **extras)
+        observers = self.resolveRequestObservers()
+        if observers:
+            result = self._observedRequest(observers, method, absUrl, data=str(data), params=params, headers=headers, cookies=self.cookies, **extras)
+        else:
+            result = self.resolveTransport().request(method, absUrl, data=str(data), params=params, headers=headers, cookies=self.cookies, **extras)
         self.check(result, method, absUrl, checkNotifications)
         return result
 
+    def addRequestObserver(self, observer):
+        """Calls observer(requestInfo) with a RequestInfo after every request sent by this convention or its children.
+
+        Observers are called on the thread that sent the request and must be quick and thread safe
+        (see requestmetrics.RequestMetrics). An exception raised by an observer is printed and does not
+        affect the request.
+        """
+        Validators.checkNotNone(observer, "observer")
+        self.requestObservers = self.requestObservers + [observer]
+
+    def removeRequestObserver(self, observer):
+        """Stops calling an observer added with addRequestObserver()."""
+        self.requestObservers = [item for item in self.requestObservers if item != observer]
+
+    def resolveRequestObservers(self):
+        # Internal method to collect the request observers of this convention and its parents
+        if self.parentConvention is None:
+            return self.requestObservers
+        parentObservers = self.parentConvention.resolveRequestObservers()
+        return self.requestObservers + parentObservers if self.requestObservers else parentObservers
+
+    def _basePath(self):
+        # the path of the root convention's url, which is left out of the RequestInfo templates
+        convention = self
+        while convention.parentConvention is not None:
+            convention = convention.parentConvention
+        return urlsplit(convention.url).path
+
+    def _observedRequest(self, observers, method, absUrl, **kwArgs):
+        info = RequestInfo(method, absUrl, RequestInfo.templateOf(urlsplit(absUrl).path, self._basePath()))
+        _requestTimings.timings = timings = {}
+        startTime = time.time()
+        try:
+            result = self.resolveTransport().request(method, absUrl, **kwArgs)
+        except Exception as e:
+            info.error = e
+            raise
+        else:
+            info.status = result.status_code
+            request = result.request
+            info.bytesOut = len(request.body or "") + sum(len(name) + len(value) + 4 for name, value in request.headers.iteritems())
+            if kwArgs.get("stream"):
+                contentLength = result.headers.get(StreamingDownload.kHeaderContentLength)
+                info.bytesIn = int(contentLength) if contentLength else None
+            else:
+                info.bytesIn = len(result.content)
+            retries = getattr(result.raw, "retries", None)
+            info.retries = len(retries.history) if retries is not None else 0
+            headerSeconds = result.elapsed.total_seconds()
+            info.server = max(headerSeconds - sum(timings.values()), 0)
+            info.transfer = max(time.time() - startTime - headerSeconds, 0)
+            return result
+        finally:
+            info.seconds = time.time() - startTime
+            _requestTimings.timings = None
+            info.dns = timings.get(RequestInfo.kDns, 0)
+            info.connect = timings.get(RequestInfo.kConnect, 0)
+            info.tls = timings.get(RequestInfo.kTls, 0)
+            for observer in observers:
+                try:
+                    observer(info)
+                except Exception:
+                    traceback.print_exc()
+
+    def resolveTransport(self):
+        # Internal method to find the transport shared by this convention and its parents.
+        # Falls back to the (unpooled) Requests library module if no transport was ever set.
+        result = self.transport or (self.parentConvention and self.parentConvention.resolveTransport())
+        return result or requests
+
     def resolveParams(self, params={}):
         # Internal method to merage all the conventions' params together prior to making the final HTTP request
         result = self.parentConvention and self.parentConvention.resolveParams() or {}
@@ -627,24 +1931,22 @@ class HttpConvention(object):
         kwArgs.setdefault('allow_redirects', True)
         return self.httpRequest(HttpConvention.kMethodOptions, url, data, params, headers, checkNotifications, **kwArgs)
 
-    def _httpPollAsyncOperation(self, reply):
-        statusUrl = None
-        lastMethod = self.kMethodPost
-        while True:
-            if not reply.text:
-                raise WebException("Status not returned from query to %s" % reply.url, extra=self._getFormattedErrorNotifications())
-            time.sleep(0.1) # avoid DOS attack
-            status = WebObject(reply.json())
-            if not statusUrl:
-                statusUrl = status.url
-            if status.progress < 100:
-                reply = self.httpGetRaw(statusUrl, allow_redirects=False)
-                lastMethod = self.kMethodGet
-            else:
-                if status.state.lower() != "success":
-                    raise WebException("%s to '%s' returned error. State: '%s' Message: '%s'" \
-                        % (lastMethod, reply.url, status.state, status.message), extra=self._getFormattedErrorNotifications())
-                return status
+    def _httpPollAsyncOperation(self, reply, timeout=None):
+        return self.pollAsyncOperation(reply, timeout).result()
+
+    def _getAsyncOperationPoller(self):
+        convention = self
+        while convention.asyncOperationPoller is None and convention.parentConvention is not None:
+            convention = convention.parentConvention
+        return convention.asyncOperationPoller
+
+    def pollAsyncOperation(self, reply, timeout=None):
+        """Returns a Future resolved with the final status of the asynchronous operation started by reply (a 202 reply).
+
+        The operation is polled by the AsyncOperationPoller shared by the whole connection.
+        @param timeout: (optional) the max number of seconds to wait. The future fails with a WebApiTimeout after that.
+        """
+        return self._getAsyncOperationPoller().submit(self, reply, timeout)
 
     def _httpGetTextResult(self, originalUrl, resultUrl):
         """ Helper method to get either a web object or text from a result URL."""
@@ -657,12 +1959,20 @@ class HttpConvention(object):
                 result = reply.text
         return result
 
-    def _httpStreamBinaryResultToFile(self, resultUrl, filehandle):
-        """ Helper method to stream binary data from the server to a file."""
+    def _httpStreamBinaryResultToFile(self, resultUrl, filehandle, progress=None, parallelConnections=None):
+        """ Helper method to stream binary data from the server to a file (see StreamingDownload and SegmentedDownload)."""
+        if parallelConnections is not None:
+            return SegmentedDownload(self, resultUrl, progress, parallelConnections).toFile(filehandle)
+        return StreamingDownload(self, resultUrl, progress).toFile(filehandle)
+
+    def _httpStreamBinaryResult(self, resultUrl, chunkSize=None):
+        """ Helper method that yields binary data from the server in chunks, without buffering the whole reply."""
         reply = self.httpGetRaw(resultUrl, stream=True)
-        for chunk in reply.iter_content(chunk_size=self.kStandardStreamingChunkSize):
-            filehandle.write(chunk)
-        filehandle.flush()
+        try:
+            for chunk in reply.iter_content(chunk_size=chunkSize or self.kStandardStreamingChunkSize):
+                yield chunk
+        finally:
+            reply.close()
 
     def httpPostRaw(self, url="", data="", params={}, headers={}, checkNotifications=True, **kwArgs):
         """Performs an HTTP OPTIONS command and returns a Requests library result object.
@@ -687,16 +1997,38 @@ class HttpConvention(object):
             # if the service produces a result, return it (Otherwise just return None)
             if hasattr(status, "resultUrl"):
                 result = self._httpGetTextResult(url, status.resultUrl)
-        elif reply.text:
+        else:
+            result = self._getPostResult(reply)
+        return result
+
+    def httpPostAsync(self, url="", data="", params={}, headers={}, checkNotifications=True, timeout=None, **kwArgs):
+        """Performs an HTTP POST and returns a Future, without waiting for an asynchronous operation to complete.
+
+        The future is resolved with the same result as httpPost(), except for asynchronous operations (202
+        replies): the connection's AsyncOperationPoller resolves it with their final status, and their result,
+        if any, is at status.resultUrl. It is not fetched by the poller, so that a slow result never delays the
+        polls of the other operations.
+
+        Parameters are the same as for HttpConvention.request().
+        @param timeout: (optional) the max number of seconds to wait for an asynchronous operation.
+                        The future fails with a WebApiTimeout after that.
+        """
+        reply = self.httpPostRaw(url, data, params, headers, checkNotifications, **kwArgs)
+        if reply.status_code == httplib.ACCEPTED:
+            return self.pollAsyncOperation(reply, timeout)
+        future = Future()
+        future.setResult(self._getPostResult(reply))
+        return future
+
+    def _getPostResult(self, reply):
+        if reply.text:
             # Use the json from the reply, but get the new object's real location from the header
             # If there is no location header, then we don't know where the object was created, 
             # so source we be set as None (so the object won't support httpPut, httpPatch or httpRefresh)
-            result = self.getWebObjectFromReply(reply, reply.headers.get("location"))
-        else:
-            # Get the object using the location header
-            location = reply.headers.get("location")
-            result = location and self.httpGet(location) or None
-        return result
+            return self.getWebObjectFromReply(reply, reply.headers.get("location"))
+        # Get the object using the location header
+        location = reply.headers.get("location")
+        return location and self.httpGet(location) or None
 
     def httpPut(self, url="", data="", params={}, headers={}, checkNotifications=True, **kwArgs):
         """Performs an HTTP PUT command and returns a Requests library result object.
@@ -817,7 +2149,10 @@ class Session(HttpConvention):
             self._session = self.httpPost(data=SessionsData(sessionType), checkNotifications=False)
             sessionId = self.sessionId
         self.url = HttpConvention.urljoin(self.url, sessionId)
+        self._location = WebObjectLocation(self, "")
         self.currentTestRun = None
+        # the WaitStrategy used by this session's waits when none is passed in. None means kDefaultWaitStrategy.
+        self.waitStrategy = None
 
     @classmethod
     def join(cls, connection, sessionId, **kwArgs):
@@ -880,23 +2215,62 @@ class Session(HttpConvention):
     def testConfigName(self):
         return self._session.testConfigName
 
-    def httpRefresh(self):
-        self._session = self.httpGet()
+    def httpRefresh(self, conditional=False):
+        session = self._location.httpGet(conditional)
+        if session is not None:
+            self._session = session
 
-    def runTest(self, trace=False):
+    def runTest(self, trace=False, waitStrategy=None):
         """Runs a test using the current configuration.
 
         Blocks until the test is done. On success returns an object with
         a testId property set to the id of the test. That id can be passed
         to the httpGetStatsCsvToFile API.
 
+        @param waitStrategy: (optional) the WaitStrategy used to poll for the end of the test
         @return test result
         @exception WebException
         """
         result = self.startTest(trace=trace)
-        self.waitTestStopped(trace=trace)
+        self.waitTestStopped(trace=trace, waitStrategy=waitStrategy)
         return result
 
+    def runTestLoop(self, count=1, configNames=None, exportDirectory=None, exporter=None, maxPendingExports=2,
+                    stopOnError=False, waitStrategy=None):
+        """Runs tests back to back in this session while the results of the previous tests are exported in the background.
+
+        As soon as a test stops, its export (the server-side zip job and the download) is started on another
+        thread and the next test is started, so the session does not sit idle during exports (see
+        ixia.orchestrator.runSessionJobs()). Blocks until all the tests have run and all the exports are done.
+
+        @param count: the number of tests to run with the current configuration. Ignored if configNames is set.
+        @param configNames: (optional) a list of configurations to load and run one after the other
+        @param exportDirectory: (optional) the directory to save the CSV stats zip of each test to, as
+                                <config name>-<testId>.zip, or <testId>.zip without configNames. Created if needed.
+        @param exporter: (optional) a function(session, testId) exporting the results of a test. Its return value
+                         is kept in the download property of the result. Overrides exportDirectory.
+        @param maxPendingExports: the max number of exports in progress. When reached, the next test waits for one
+                                  to finish. With 0 each export is done before the next test starts.
+        @param stopOnError: stop the loop when a test fails. The results of the tests not run then have an error.
+                            By default the next test is run.
+        @param waitStrategy: (optional) the WaitStrategy used to wait for each test to stop
+        @return a list of orchestrator.TestJobResult objects, one per test, in order
+        """
+        # imported here because the orchestrator module is built on this one
+        from ixia.orchestrator import TestJob, runSessionJobs
+        if configNames is None:
+            Validators.checkInt(count, "count")
+            configNames = [None] * count
+        else:
+            Validators.checkList(configNames, "configNames")
+        downloader = None
+        if exporter is not None:
+            downloader = lambda connection, job, testId: exporter(self, testId)
+        elif exportDirectory is not None:
+            Validators.checkNonEmptyString(exportDirectory, "exportDirectory")
+        return runSessionJobs(self, [TestJob(configName) for configName in configNames], exportDirectory, downloader,
+                              maxPendingExports, stopOnError, waitStrategy)
+
     def startTest(self, trace=False):
         """Start the currently configured test, and returns immediately.
 
@@ -935,19 +2309,21 @@ class Session(HttpConvention):
         """
         return self.httpGet(self.kOperationTestRunFormat % testId)
 
-    def waitTestStopped(self, testId=None, timeout=None, trace=False):
+    def waitTestStopped(self, testId=None, timeout=None, trace=False, waitStrategy=None):
         """Waits until the currently running test stops.
 
         @param testId: the id of the test to wait for (e.g. from startTest().testId)
         @param timeout: max number of seconds to wait.
-        @param trace: true to print polled value"""
+        @param trace: true to print polled value
+        @param waitStrategy: (optional) a WaitStrategy overriding the session's waitStrategy for this call"""
         if testId is not None:
             testRun = self.getTestRun(testId)
         else:
             testRun = self.getCurrentTestRun()
             if not testRun:
                 raise ValueError("Either testId must be specified, or a current test must have been created using startTest().")
-        waitForProperty(testRun, "testState", [TestState.kStopped], timeout=timeout, trace=trace)
+        waitForProperty(testRun, "testState", [TestState.kStopped], timeout=timeout, trace=trace,
+                        waitStrategy=waitStrategy or self.waitStrategy)
         self.checkNotifications()
         self.currentTestRun = None
 
@@ -989,7 +2365,10 @@ class Session(HttpConvention):
         @param configName: the configuration name
         """
         Validators.checkConfigName(configName)
-        self.httpPost(self.kOperationSaveConfigFormat % self.sessionType, WebObject(name=configName, description=description, overwrite=overwrite))
+        try:
+            self.httpPost(self.kOperationSaveConfigFormat % self.sessionType, WebObject(name=configName, description=description, overwrite=overwrite))
+        finally:
+            self.parentConvention.getConfigurationCatalog().invalidate(self.sessionType)
 
     def loadConfiguration(self, configName, description=""):
         """Replace the current configuration with the configuration from the specified configuration name.
@@ -1009,14 +2388,15 @@ class Session(HttpConvention):
         Validators.checkConfigName(configName)
         return self.parentConvention.findConfigurationByName(self.sessionType, configName, raiseException)
 
-    def exportConfigurationToFile(self, configName, exportFile):
+    def exportConfigurationToFile(self, configName, exportFile, progress=None):
         """Export a configuration, identified by its name, to a file.
 
         @param configName: the name of the config to export
         @param exportFile: a file-like object to write the configuration to. Must be opened in binary mode.
+        @param progress: (optional) a function(bytesDone, totalBytes, bytesPerSecond) called as the file is downloaded
         """
         config = self.findConfigurationByName(configName)
-        self.parentConvention.exportConfigurationToFileById(self.sessionType, config.id, exportFile)
+        self.parentConvention.exportConfigurationToFileById(self.sessionType, config.id, exportFile, progress)
 
     def importConfigurationFromFile(self, importFile):
         """ imports a configuration from the specified file.
@@ -1042,41 +2422,77 @@ class Session(HttpConvention):
         config = self.findConfigurationByName(configName)
         self.parentConvention.deleteConfigurationById(self.sessionType, config.id)
 
-    def _waitForProperty(self, propertyName, targetValues, validValues=[], invalidValues=[], timeout=None, trace=False):
+    def _waitForProperty(self, propertyName, targetValues, validValues=[], invalidValues=[], timeout=None, trace=False, waitStrategy=None):
         """Wait for the session to enter any of the specified targetStates. 
 
-        Caller can also specified a set of valid or invalid states 
+        Caller can also specified a set of valid or invalid states, and a WaitStrategy overriding the session's waitStrategy
         """
-        waitForProperty(self, propertyName, targetValues, validValues, invalidValues, timeout, trace)
+        waitForProperty(self, propertyName, targetValues, validValues, invalidValues, timeout, trace, waitStrategy or self.waitStrategy)
 
-    def collectDiagnosticsToFile(self, diagFile, clientOnly=False):
+    def collectDiagnosticsToFile(self, diagFile, clientOnly=False, progress=None, parallelConnections=None):
         """Collects debug diagnostics for the session and downloads them to a file
 
         @param exportFile: a file-like object to send the configuration to. Must be opened in binary mode
+        @param progress: (optional) a function(bytesDone, totalBytes, bytesPerSecond) called as the file is downloaded
+        @param parallelConnections: (optional) download large archives over this many connections at once (see SegmentedDownload)
         """
         Validators.checkFile(diagFile, "diagFile")
         reply = self.parentConvention.collectSessionDiagnostics(self.sessionId, clientOnly)
         if reply.status_code == httplib.ACCEPTED:
             status = self._httpPollAsyncOperation(reply)
-            self._httpStreamBinaryResultToFile(status.resultUrl, diagFile)
+            self._httpStreamBinaryResultToFile(status.resultUrl, diagFile, progress, parallelConnections)
         else:
             raise WebException("Unexpected status code from request to collect diagnostics: %s" % reply.status_code)
     
     
-    def registerStatsRequest(self,  statsRequest):
+    def registerStatsRequest(self,  statsRequest, capacity=None, overflowPolicy=None):
         """Registers a stats request object on the server for the current test. The user can register multiple requests for the same test.
 		
         @param statsRequest: the StatsRequest object to register on the server.
+        @param capacity: (optional) the max number of snapshots the reader holds (see SnapshotQueue)
+        @param overflowPolicy: (optional) what the reader does when its queue is full (see OverflowPolicy). Defaults to kBlock.
 
         @returns An object that can be used to query for data from the server
 		@raises WebException
         """
 
-        if not isinstance(statsRequest, StatsRequest):
-            raise ValueError("The '%s' parameter is not a StatsRequest object. Was %s." % ("statsRequest", statsRequest))           
+        self._checkStatsRequests([statsRequest])
+        self._registerStatsRequests([statsRequest])
+        return StatsReader(self, statsRequest, capacity, overflowPolicy)
+
+    def registerStatsQuery(self, statsQuery, validate=True, capacity=None, overflowPolicy=None):
+        """Compiles a StatsQuery and registers its StatsRequests (one per stat group) with one call.
+
+        Returns a list with a StatsReader for each request. The readers are polled together (see StatsMultiplexer).
+        @param statsQuery: the StatsQuery to register
+        @param validate: (optional) if True, check the stats of the query against the schema of the current test run
+        @param capacity, overflowPolicy: (optional) the size and overflow policy of the SnapshotQueue of each reader
+        """
+        if not isinstance(statsQuery, StatsQuery):
+            raise ValueError("The '%s' parameter is not a StatsQuery object. Was %s." % ("statsQuery", statsQuery))
+        schema = None
+        if validate:
+            if self.currentTestRun is None:
+                raise WebException("Session.registerStatsQuery(): no test was started to validate the query against.")
+            schema = self.parentConvention.getStatsSchema(self.currentTestRun.testId)
+        return self.createStatsMultiplexer().register(statsQuery.compile(schema), capacity, overflowPolicy)
+
+    def createStatsMultiplexer(self, pollInterval=None):
+        """Returns a StatsMultiplexer that registers and polls many stats requests of this session together.
+
+        @param pollInterval: (optional) the min number of seconds between polls of the server
+        """
+        return StatsMultiplexer(self, pollInterval)
+
+    @staticmethod
+    def _checkStatsRequests(statsRequests):
+        for statsRequest in statsRequests:
+            if not isinstance(statsRequest, StatsRequest):
+                raise ValueError("The '%s' parameter is not a StatsRequest object. Was %s." % ("statsRequest", statsRequest))
 
-        reply = self.httpPostRaw("stats/registration?append=true", WebListProxy([statsRequest]))
-        return StatsReader(self, statsRequest)
+    def _registerStatsRequests(self, statsRequests):
+        """Registers a list of stats requests on the server with a single call."""
+        self.httpPostRaw("stats/registration?append=true", WebListProxy(statsRequests))
 
     def _unregisterStatsRequest(self, statsRequest):
         """Unregisters a stat request on the server.
@@ -1085,11 +2501,12 @@ class Session(HttpConvention):
 
         """
         
-        if not isinstance(statsRequest, StatsRequest):
-            raise ValueError("The '%s' parameter is not a StatsRequest object. Was %s." % ("statsRequest", statsRequest))
+        self._unregisterStatsRequests([statsRequest])
 
-        self.httpPostRaw("stats/deregistration", WebListProxy([statsRequest]))
-        
+    def _unregisterStatsRequests(self, statsRequests):
+        """Unregisters a list of stats requests on the server with a single call."""
+        self._checkStatsRequests(statsRequests)
+        self.httpPostRaw("stats/deregistration", WebListProxy(statsRequests))
 
     def _getRealtimeData(self, statsRequest, startTimestamp = 0):
         """ Gets the snapshots with recent time stamp than the one specified for the specified stats request object.
@@ -1099,24 +2516,33 @@ class Session(HttpConvention):
         
         """
         
-        if not isinstance(statsRequest, StatsRequest):
-            raise ValueError("The '%s' parameter is not a StatsRequest object. Was %s." % ("statsRequest", statsRequest))
+        result = self._getRealtimeDataMap([statsRequest], startTimestamp)
+        if result is None:
+            return None
+        return result.get(statsRequest.id)
+
+    def _getRealtimeDataMap(self, statsRequests, startTimestamp = 0):
+        """ Gets the snapshots more recent than startTimestamp for a list of stats requests with a single call.
 
+        @param statsRequests:  the stats request objects to request data for
+        @param startTimestamp: reference time stamp
+        @return a dictionary mapping the ids of the requests to lists of raw snapshot data, or None if the server returned nothing
+        """
+        self._checkStatsRequests(statsRequests)
         Validators.checkLong(startTimestamp, "startTimestamp")
                 
         try:
-            reply = self.httpPost("stats/data/cache" , WebListProxy([statsRequest]), {'startTimestamp' : startTimestamp} )
+            # the reply is parsed straight from json: it's only used as raw snapshot data, so no WebObject tree is built
+            reply = self.httpPostRaw("stats/data/cache" , WebListProxy(statsRequests), {'startTimestamp' : startTimestamp} )
+            if reply.status_code == httplib.ACCEPTED:
+                status = self._httpPollAsyncOperation(reply)
+                reply = self.httpGetRaw(status.resultUrl)
         except WebException as e:
             raise StandardError("The server has thrown an exception, please check the input parameters \n %s" %e)
         
-        if reply is None:
+        if not reply.text:
             return None
-        else:
-            result = json.loads(reply)["map"]
-            if statsRequest.id in result:
-                return result[statsRequest.id]
-            else:
-                return None
+        return JsonBackend.loads(reply.text)["map"]
 
 
 #-------------------------------------------------------------------------------------------
@@ -1145,12 +2571,113 @@ class UserPermission(object):
         return "apps:%s" % appName
 
 
+class UserDirectory(object):
+    """A cache of the user accounts on the server, indexed by username and by id.
+
+    The user list is fetched on the first lookup and reused for ttl seconds; the UserAdmin methods keep it
+    up to date as they create, edit and delete users. The record of the current user is cached separately,
+    also for ttl seconds, as non-admins cannot list users. Get the directory of a UserAdmin with
+    UserAdmin.getUserDirectory().
+
+    @param userAdmin: the UserAdmin used to fetch the users
+    @param ttl: the number of seconds the fetched list and current user are used without fetching them again
+    """
+    kDefaultTtl = 60
+
+    def __init__(self, userAdmin, ttl=kDefaultTtl):
+        Validators.checkNotNone(userAdmin, "userAdmin")
+        self.userAdmin = userAdmin
+        self.ttl = ttl
+        self.lock = threading.RLock()
+        self._currentUser = None
+        self._currentUserTime = None
+        self._fetchTime = None
+        self._byName = {}
+        self._byId = {}
+
+    def getCurrentUser(self):
+        """Returns the record of the user the connection is logged in as."""
+        self.lock.acquire()
+        try:
+            if self._currentUser is None or time.time() - self._currentUserTime >= self.ttl:
+                self._currentUser = self.userAdmin._fetchCurrentUser()
+                self._currentUserTime = time.time()
+            return self._currentUser
+        finally:
+            self.lock.release()
+
+    def findByName(self, username):
+        """Returns the record of the user with the specified login name, or None."""
+        self.lock.acquire()
+        try:
+            currentUser = self.getCurrentUser()
+            if currentUser.username == username:
+                return currentUser
+            self._load()
+            return self._byName.get(username)
+        finally:
+            self.lock.release()
+
+    def findById(self, userId):
+        """Returns the record of the user with the specified id, or None."""
+        self.lock.acquire()
+        try:
+            self._load()
+            return self._byId.get(userId)
+        finally:
+            self.lock.release()
+
+    def update(self, users):
+        """Adds or replaces user records, e.g. after they were changed on the server."""
+        self.lock.acquire()
+        try:
+            for user in users:
+                previous = self._byId.get(user.id)
+                if previous is not None and previous.username != user.username:
+                    self._byName.pop(previous.username, None)
+                self._byName[user.username] = user
+                self._byId[user.id] = user
+                if self._currentUser is not None and self._currentUser.id == user.id:
+                    self._currentUser = user
+        finally:
+            self.lock.release()
+
+    def remove(self, user):
+        """Removes a user record, e.g. after the user was deleted on the server."""
+        self.lock.acquire()
+        try:
+            self._byName.pop(user.username, None)
+            self._byId.pop(user.id, None)
+        finally:
+            self.lock.release()
+
+    def invalidate(self):
+        """Makes the next lookup fetch the user list again."""
+        self.lock.acquire()
+        try:
+            self._currentUser = None
+            self._fetchTime = None
+        finally:
+            self.lock.release()
+
+    def _load(self):
+        if self._fetchTime is not None and time.time() - self._fetchTime < self.ttl:
+            return
+        users = self.userAdmin.httpGet(self.userAdmin.kRelUsersUrl) or WebListProxy()
+        self._byName = {}
+        self._byId = {}
+        self.update(reversed(users))
+        self._fetchTime = time.time()
+
+
 class UserAdmin(HttpConvention):
     """A class with User Administration methods. Get an instance using getUserAdmin on a Connection."""
 
     kUserAdminBase = "auth"
     kRelUsersUrl = "users"
     kRelUserFormat = "users/%s"
+    kDefaultBulkConcurrency = 8
+    kUserEditProperties = ["password", "oldpassword", "email", "fullname", "roles", "permissions"]
 
     def __init__(self, connection, **kwArgs):
         """
@@ -1164,34 +2691,43 @@ class UserAdmin(HttpConvention):
         """
         Validators.checkNotNone(connection, "connection")
         super(UserAdmin, self).__init__(self.kUserAdminBase, connection, **kwArgs)
+        self._directory = UserDirectory(self)
+
+    def getUserDirectory(self):
+        """Returns the UserDirectory caching the users for this UserAdmin."""
+        return self._directory
 
     def getUsers(self):
         """Returns a list of users registered with the connected-to server."""
-        return self.httpGet(self.kRelUsersUrl)
+        users = self.httpGet(self.kRelUsersUrl)
+        self._directory.update(reversed(users or []))
+        return users
 
     def findUser(self, username=None):
         """Returns an object describing the specified user, or throws an exception if not found.
 
+        Lookups are served by the UserDirectory of this UserAdmin.
         @param username: the login name of the user to find. Defaults to the current user
         """
         if username:
             Validators.checkString(username, "username")
         # avoid permission error on server for non-Admins working on their own account
         # (getUsers fails for non-Admins)
-        currentUser = self.getCurrentUser()
-        if not username or username == currentUser:
-            return currentUser
-        else:
-            for user in self.getUsers():
-                if user.username == username:
-                    return user
-        raise WebException("No such user: %s" % username)
+        if not username:
+            return self._directory.getCurrentUser()
+        user = self._directory.findByName(username)
+        if user is None:
+            raise WebException("No such user: %s" % username)
+        return user
 
     def getCurrentUser(self):
         """Returns an object describing the current user.
 
         The object will be the same as the individual list elements returned by findUser.
         """
+        return self._directory.getCurrentUser()
+
+    def _fetchCurrentUser(self):
         # get the current user info from the auth session (api/auth/session is different than api/sessions)
         userInfo = self.httpGet("session")
         # web service doensn't provide id directly, but it is last element of userAccountUrl
@@ -1219,12 +2755,21 @@ class UserAdmin(HttpConvention):
         Validators.checkNonEmptyString(password, "password")
         Validators.checkString(email, "email")
         Validators.checkString(fullname, "fullname")
-        return self.httpPost(self.kRelUsersUrl, WebObject(username=username, 
-                                                          password=password, 
-                                                          email=email, 
-                                                          fullname=fullname, 
-                                                          roles=roles, 
-                                                          permissions=permissions))
+        try:
+            user = self.httpPost(self.kRelUsersUrl, WebObject(username=username, 
+                                                              password=password, 
+                                                              email=email, 
+                                                              fullname=fullname, 
+                                                              roles=roles, 
+                                                              permissions=permissions))
+        except WebException:
+            self._directory.invalidate()
+            raise
+        if isinstance(user, WebObjectBase) and user._hasField_("id") and user._hasField_("username"):
+            self._directory.update([user])
+        else:
+            self._directory.invalidate()
+        return user
 
     def deleteUser(self, username):
         """Deletes the specified user.
@@ -1233,6 +2778,7 @@ class UserAdmin(HttpConvention):
         """
         user = self.findUser(username)
         self.httpDelete(self.kRelUserFormat % user.id)
+        self._directory.remove(user)
 
     def changePassword(self, username, password, oldpassword=None):
         """Changes the password for a given user.
@@ -1244,13 +2790,7 @@ class UserAdmin(HttpConvention):
         if oldpassword:
             Validators.checkString(oldpassword, "oldpassword")
         Validators.checkNonEmptyString(password, "password")
-        user = self.findUser(username)
-        user._unlock_() # allow setting of undefined properties
-        user.password = password
-        if oldpassword:
-            # don't even send it unless its provided
-            user.oldpassword = oldpassword
-        self.httpPut(self.kRelUserFormat % user.id, user)
+        self._editUser(username, password=password, oldpassword=oldpassword)
 
     def setEmail(self, username, email):
         """Sets a new email address for a given user.
@@ -1259,9 +2799,7 @@ class UserAdmin(HttpConvention):
         @param email: the new email for the username
         """
         Validators.checkString(email, "email")
-        user = self.findUser(username)
-        user.email = email
-        self.httpPut(self.kRelUserFormat % user.id, user)
+        self._editUser(username, email=email)
     
     def setFullname(self, username, fullname):
         """Change a the fullName property of a user.
@@ -1271,9 +2809,7 @@ class UserAdmin(HttpConvention):
         @param fullname: the new full user name
         """
         Validators.checkString(fullname, "fullname")
-        user = self.findUser(username)
-        user.fullname = fullname
-        self.httpPut(self.kRelUserFormat % user.id, user)
+        self._editUser(username, fullname=fullname)
 
     def getAvailableRoles(self):
         """Returns a list of known Roles."""
@@ -1286,9 +2822,7 @@ class UserAdmin(HttpConvention):
         @param roles: the list set of roles for the user
         """
         Validators.checkList(roles, "roles")
-        user = self.findUser(username)
-        user.roles = roles
-        self.httpPut(self.kRelUserFormat % user.id, user)
+        self._editUser(username, roles=roles)
 
     def getAvailablePermissions(self):
         """Returns a list of known permissions."""
@@ -1301,9 +2835,62 @@ class UserAdmin(HttpConvention):
         @param roles: the new list of roles for the user
         """
         Validators.checkList(permissions, "permissions")
-        user = self.findUser(username)
-        user.permissions = permissions
+        self._editUser(username, permissions=permissions)
+
+    def applyUserEdits(self, edits, createMissing=False, maxConcurrency=None):
+        """Applies many user edits concurrently over the connection's pooled transport.
+
+        All the changes to one user are sent with a single PUT: the edits of the same username are merged
+        first, in order, so a later edit overrides the properties also set by an earlier one. Errors do not stop
+        the edits of the other users.
+
+        @param edits: a list of dictionaries, each with a username and any of the properties to change:
+                      password, oldpassword, email, fullname, roles, permissions
+        @param createMissing: create the users that do not exist (a password is then required)
+        @param maxConcurrency: the max number of requests in flight. Defaults to kDefaultBulkConcurrency.
+        @return a list with, for each edit, the updated (or created) user or the exception that made the edit fail.
+                The edits merged for one user share the same result.
+        """
+        Validators.checkList(edits, "edits")
+        for edit in edits:
+            Validators.checkNonEmptyString(edit.get("username"), "username")
+            unknown = [name for name in edit if name != "username" and name not in self.kUserEditProperties]
+            if unknown:
+                raise ValueError("Unknown user properties %s for user %s" % (unknown, edit["username"]))
+        # concurrent PUTs for one user would each be based on the same cached copy, so all but one would be lost
+        changesByName = collections.OrderedDict()
+        for edit in edits:
+            changes = changesByName.setdefault(edit["username"], {})
+            changes.update((name, value) for name, value in edit.iteritems() if name != "username")
+        def apply(item):
+            username, changes = item
+            try:
+                if createMissing and self._directory.findByName(username) is None:
+                    changes = dict(changes)
+                    changes.pop("oldpassword", None)
+                    return self.createUser(username, **changes)
+                return self._editUser(username, **changes)
+            except Exception as e:
+                return e
+        results = dict(zip(changesByName, _concurrentMap(apply, changesByName.items(), maxConcurrency or self.kDefaultBulkConcurrency)))
+        return [results[edit["username"]] for edit in edits]
+
+    def _editUser(self, username, password=None, oldpassword=None, **changes):
+        # puts a changed copy of the cached user, and caches the copy once the server accepted it
+        user = WebObject(self.findUser(username)._json_)
+        for name, value in changes.iteritems():
+            setattr(user, name, value)
+        # passwords are not kept in the cache
+        cachedUser = WebObject(user._json_)
+        if password is not None:
+            user._unlock_() # allow setting of undefined properties
+            user.password = password
+            if oldpassword:
+                # don't even send it unless its provided
+                user.oldpassword = oldpassword
         self.httpPut(self.kRelUserFormat % user.id, user)
+        self._directory.update([cachedUser])
+        return cachedUser
 
 
 #-------------------------------------------------------------------------------------------
@@ -1312,6 +2899,186 @@ class UserAdmin(HttpConvention):
 #
 #-------------------------------------------------------------------------------------------
 
+class ConfigurationCatalog(object):
+    """A cache of the configurations on the server, indexed by (sessionType, name) and by (sessionType, id).
+
+    The list of configurations of a session type is fetched on the first lookup and then reused for ttl seconds.
+    After that, or after invalidate(), it is revalidated with a conditional GET, so an unchanged list costs a 304
+    reply instead of a full transfer. The Connection and Session methods that create or delete configurations
+    invalidate it. Get the catalog of a connection with Connection.getConfigurationCatalog().
+
+    @param connection: the Connection to the server
+    @param ttl: the number of seconds a fetched list is used without checking the server
+    """
+    kDefaultTtl = 60
+
+    def __init__(self, connection, ttl=kDefaultTtl):
+        Validators.checkNotNone(connection, "connection")
+        self.connection = connection
+        self.ttl = ttl
+        self.lock = threading.RLock()
+        # sessionType -> [location, fetch time, configurations, by name, by id]
+        self._entries = {}
+
+    def getConfigurations(self, sessionType):
+        """Returns the list of configurations of a session type."""
+        return self._entry(sessionType)[2]
+
+    def findByName(self, sessionType, configName):
+        """Returns the configuration with the specified name, or None."""
+        Validators.checkConfigName(configName)
+        return self._entry(sessionType)[3].get(configName)
+
+    def findById(self, sessionType, configId):
+        """Returns the configuration with the specified id, or None."""
+        Validators.checkInt(configId, "configId")
+        return self._entry(sessionType)[4].get(int(configId))
+
+    def invalidate(self, sessionType=None):
+        """Makes the next lookup check the server for changes.
+
+        @param sessionType: (optional) the session type whose configurations changed. Default is all.
+        """
+        self.lock.acquire()
+        try:
+            for key, entry in self._entries.iteritems():
+                if sessionType is None or key == sessionType:
+                    entry[1] = None
+        finally:
+            self.lock.release()
+
+    def update(self, sessionType, configurations):
+        """Replaces the cached list of a session type with a list just fetched from the server."""
+        self.lock.acquire()
+        try:
+            entry = self._entries.get(sessionType)
+            if entry is None:
+                entry = self._entries[sessionType] = self._newEntry(sessionType)
+            self._index(entry, configurations)
+        finally:
+            self.lock.release()
+
+    def _newEntry(self, sessionType):
+        location = WebObjectLocation(self.connection, Connection.kOperationGetConfigurationsFormat % sessionType)
+        return [location, None, None, None, None]
+
+    def _entry(self, sessionType):
+        Validators.checkSessionType(sessionType)
+        self.lock.acquire()
+        try:
+            entry = self._entries.get(sessionType)
+            if entry is None:
+                entry = self._entries[sessionType] = self._newEntry(sessionType)
+            if entry[1] is None or time.time() - entry[1] >= self.ttl:
+                configurations = entry[0].httpGet(conditional=entry[2] is not None)
+                if configurations is None and entry[2] is not None:
+                    # not modified
+                    entry[1] = time.time()
+                else:
+                    self._index(entry, configurations)
+            return entry
+        finally:
+            self.lock.release()
+
+    @staticmethod
+    def _index(entry, configurations):
+        configurations = configurations or WebListProxy()
+        byName = {}
+        for config in reversed(configurations):
+            # the first configuration with a name wins, as in a linear search
+            byName[config.name] = config
+        entry[1:] = [time.time(), configurations, byName, dict((config.id, config) for config in configurations)]
+
+
+class CapabilityCache(object):
+    """An on-disk cache of what a Connection learns from a server when it connects.
+
+    Entries are keyed by server URL and user, and hold the API versions and script API versions of the server
+    and the API key of the user. Within ttl seconds of the last full handshake, a Connection using the cache only
+    checks that the key still works (one auth/ping) instead of fetching all of them again; if that fails, the
+    entry is dropped and the full handshake is done. Passwords are never stored: an entry found by username is
+    only used with the password it was created with (compared through a salted hash).
+    The file holds API keys, so it is only readable by its owner.
+
+    @param path: (optional) the cache file. Defaults to kDefaultPath.
+    @param ttl: the number of seconds an entry is used before the server is asked again
+    """
+    kDefaultPath = os.path.join(os.path.expanduser("~"), ".ixia", "webapi-capabilities.json")
+    kDefaultTtl = 3600
+
+    def __init__(self, path=None, ttl=kDefaultTtl):
+        self.path = path or self.kDefaultPath
+        self.ttl = ttl
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _key(siteUrl, username, userkey):
+        # an entry found with a user key is keyed by a hash of it, so that the key itself is not the name of the entry
+        if username:
+            return "%s user:%s" % (siteUrl, username)
+        return "%s key:%s" % (siteUrl, hashlib.sha256(userkey or "").hexdigest())
+
+    @staticmethod
+    def _passwordHash(salt, password):
+        return hashlib.sha256(salt + (password or "")).hexdigest()
+
+    def get(self, siteUrl, username=None, password=None, userkey=None):
+        """Returns the fresh entry (a dictionary with apiVersions, scriptApiVersions and apiKey) for a server and user, or None."""
+        entry = self._read().get(self._key(siteUrl, username, userkey))
+        if entry is None or time.time() - entry["time"] >= self.ttl:
+            return None
+        if username and entry.get("passwordHash") != self._passwordHash(entry["salt"], password):
+            return None
+        return entry
+
+    def put(self, siteUrl, apiVersions, scriptApiVersions, apiKey, username=None, password=None, userkey=None):
+        """Stores what was learned from a full handshake."""
+        entry = {"time": time.time(), "apiVersions": apiVersions, "scriptApiVersions": scriptApiVersions}
+        if username:
+            entry["salt"] = uuid.uuid4().hex
+            entry["passwordHash"] = self._passwordHash(entry["salt"], password)
+            entry["apiKey"] = apiKey
+        self._update(self._key(siteUrl, username, userkey), entry)
+
+    def invalidate(self, siteUrl, username=None, userkey=None):
+        """Drops the entry of a server and user."""
+        self._update(self._key(siteUrl, username, userkey), None)
+
+    def _read(self):
+        try:
+            with open(self.path, "rb") as cacheFile:
+                return json.load(cacheFile)
+        except (IOError, ValueError):
+            return {}
+
+    def _update(self, key, entry):
+        self.lock.acquire()
+        try:
+            entries = self._read()
+            if entry is None:
+                if entries.pop(key, None) is None:
+                    return
+            else:
+                entries[key] = entry
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory, 0700)
+            # written to a private temporary file and renamed, so that concurrent scripts never read a partial file
+            handle, temporaryPath = tempfile.mkstemp(dir=directory or None)
+            try:
+                with os.fdopen(handle, "wb") as cacheFile:
+                    json.dump(entries, cacheFile)
+                os.rename(temporaryPath, self.path)
+            except:
+                os.remove(temporaryPath)
+                raise
+        except (IOError, OSError):
+            # the cache is only an optimization
+            pass
+        finally:
+            self.lock.release()
+
+
 class Connection(HttpConvention):
 
     kOperationGetConfigurationsFormat = "configurations/%s"
@@ -1326,7 +3093,11 @@ class Connection(HttpConvention):
     kImportFormElement = "fileId"
 
     """ A class that represents a connection to an Ixia web app server and managing sessions there-on """
-    def __init__(self, siteUrl, apiVersion, userkey="", username="", password="", params={}, headers={}, clsSession=Session, **kwArgs):
+    # the number of StatsSchemas kept by getStatsSchema() (the least recently used ones are dropped)
+    kMaxStatsSchemas = 16
+
+    def __init__(self, siteUrl, apiVersion, userkey="", username="", password="", params={}, headers={}, clsSession=Session, transport=None,
+                 capabilityCache=None, **kwArgs):
         """
             Construct a Connection instance to use for accessing an Ixia web app server
 
@@ -1346,6 +3117,13 @@ class Connection(HttpConvention):
             @kwarg params: URL parameters to always use for this connection
             @type  headers: dictionary 
             @kwarg headers: HTTP headers to always use for this connection
+            @type  transport: HttpTransport
+            @kwarg transport: the pooled transport shared by this connection and its sessions. 
+                              Defaults to an HttpTransport with default pool, keep-alive and retry settings.
+            @type  capabilityCache: CapabilityCache
+            @kwarg capabilityCache: (optional) a cache of the server versions and user key that lets a connection to a
+                                    recently used server skip most of the handshake. The time the connection took is
+                                    in bootstrapSeconds, and bootstrapCached tells whether the cache was used.
             @type  kwArgs: dictionary
             @kwarg kwArgs: additional keyword args (future expansion)
             @except Throws a WebException if the connection was not successful
@@ -1358,17 +3136,73 @@ class Connection(HttpConvention):
         self._userkey = userkey
         # default content type is json
         headers.setdefault(self.kHeaderContentType, self.kContentJson)
-        super(Connection, self).__init__(HttpConvention.urljoin(siteUrl, "api"), params=params, headers=headers, **kwArgs)
+        if transport is None:
+            transport = HttpTransport()
+        self._configurationCatalog = None
+        # testOrResultId -> StatsSchema, see getStatsSchema()
+        self._statsSchemas = collections.OrderedDict()
+        self._statsSchemasLock = threading.Lock()
+        startTime = time.time()
+        super(Connection, self).__init__(HttpConvention.urljoin(siteUrl, "api"), params=params, headers=headers, transport=transport, **kwArgs)
         # we had to initialize our connection first in case we have to fetch user key from server here
-        self.checkApiVersion(apiVersion)
-        self.url = HttpConvention.urljoin(self.url, apiVersion)
-        self.updateHeaders({self.kHeaderApiKey: self._getOrFetchuserkey(username, password)})
-        self.checkScriptApiVersion()
-        # try one URL that requires authentication to be sure we're connected
-        self.httpGet("auth/ping")
+        self.bootstrapCached = capabilityCache is not None and self._bootstrapFromCache(capabilityCache, siteUrl, apiVersion, username, password)
+        if not self.bootstrapCached:
+            self._bootstrap(siteUrl, apiVersion, username, password, capabilityCache)
+        self.bootstrapSeconds = time.time() - startTime
         # initialize the session class which will be used to create sessions
         self._clsSession = clsSession
 
+    def _bootstrap(self, siteUrl, apiVersion, username, password, capabilityCache):
+        # the full handshake. Independent round trips are run at the same time.
+        baseUrl = self.url
+        self.url = HttpConvention.urljoin(baseUrl, apiVersion)
+        results = _concurrentMap(self._captureErrors, [lambda: self.httpGet(HttpConvention.urljoin(baseUrl, "versions")),
+                                                       lambda: self._getOrFetchuserkey(username, password)], 2)
+        # report an unsupported version rather than the failure it causes when fetching the key
+        if results[0][1] is None:
+            apiVersions = [info.version for info in results[0][0]]
+            self._checkApiVersion(apiVersion, apiVersions)
+        for result, excInfo in results:
+            if excInfo is not None:
+                raise excInfo[0], excInfo[1], excInfo[2]
+        self.updateHeaders({self.kHeaderApiKey: results[1][0]})
+        # try one URL that requires authentication to be sure we're connected
+        results = _concurrentMap(lambda function: function(), [lambda: self.httpGet("scriptapi/versions"),
+                                                               lambda: self.httpGet("auth/ping")], 2)
+        scriptApiVersions = [versionInfo.version for versionInfo in results[0]]
+        self._checkScriptApiVersion(scriptApiVersions)
+        if capabilityCache is not None:
+            capabilityCache.put(siteUrl, apiVersions, scriptApiVersions, self._userkey, username, password, self._userkey)
+
+    def _bootstrapFromCache(self, capabilityCache, siteUrl, apiVersion, username, password):
+        # one round trip to check that the cached key still works. Returns False if the full handshake is needed.
+        entry = capabilityCache.get(siteUrl, username, password, self._userkey)
+        if entry is None or apiVersion not in entry["apiVersions"]:
+            return False
+        try:
+            self._checkScriptApiVersion(entry["scriptApiVersions"])
+        except WebException:
+            return False
+        baseUrl = self.url
+        userkey = self._userkey or entry.get("apiKey")
+        self.url = HttpConvention.urljoin(baseUrl, apiVersion)
+        self.updateHeaders({self.kHeaderApiKey: userkey})
+        try:
+            self.httpGet("auth/ping")
+        except WebException:
+            capabilityCache.invalidate(siteUrl, username, self._userkey)
+            self.url = baseUrl
+            return False
+        self._userkey = userkey
+        return True
+
+    @staticmethod
+    def _captureErrors(function):
+        try:
+            return function(), None
+        except Exception:
+            return None, sys.exc_info()
+
     def _getOrFetchuserkey(self, username=None, password=None):
         # internal method to get the user key. If user key not alreay set, then username and password must be supplied.
         if not self._userkey:
@@ -1396,19 +3230,31 @@ class Connection(HttpConvention):
                 self.check(reply, self.kMethodPost, sessionKeyUrl, checkNotifications=False)
         return self._userkey
 
+    def close(self):
+        """Stops polling the asynchronous operations of this connection and releases the pooled connections held by its transport."""
+        if self.asyncOperationPoller is not None:
+            self.asyncOperationPoller.close()
+        self.transport.close()
+
     def getUserKey(self):
         """Return the user key, either supplied or determined from the username+password."""
         return self._userkey
 
     def checkApiVersion(self, apiVersion):
         Validators.checkNotNone(apiVersion, "apiVersion")
-        availableVersions = [info.version for info in self.httpGet("versions")]
+        self._checkApiVersion(apiVersion, [info.version for info in self.httpGet("versions")])
+
+    @staticmethod
+    def _checkApiVersion(apiVersion, availableVersions):
         if apiVersion not in availableVersions:
             raise WebException("API version %s not in available versions: %s" % (apiVersion, availableVersions))
 
     def checkScriptApiVersion(self):
         versionInfoList = self.httpGet("scriptapi/versions")
-        versions = [versionInfo.version for versionInfo in versionInfoList]
+        self._checkScriptApiVersion([versionInfo.version for versionInfo in versionInfoList])
+
+    @staticmethod
+    def _checkScriptApiVersion(versions):
         for version in kSupportedScriptApiVersions:
             if version in versions:
                 break;
@@ -1469,33 +3315,49 @@ class Connection(HttpConvention):
         Configurations may only be loaded into or saved from an active session
         """
         Validators.checkSessionType(sessionType)
-        return self.httpGet(self.kOperationGetConfigurationsFormat % sessionType)
+        configurations = self.httpGet(self.kOperationGetConfigurationsFormat % sessionType)
+        self.getConfigurationCatalog().update(sessionType, configurations)
+        return configurations
+
+    def getConfigurationCatalog(self):
+        """Returns the ConfigurationCatalog caching the configurations of this connection."""
+        if self._configurationCatalog is None:
+            self._configurationCatalog = ConfigurationCatalog(self)
+        return self._configurationCatalog
 
     def findConfigurationByName(self, sessionType, configName, raiseException=True):
         """Finds a specific configuration by sessionType and name
+
+        The lookup is served by the connection's ConfigurationCatalog.
         """
         Validators.checkSessionType(sessionType)
         Validators.checkConfigName(configName)
-        result = None
-        matches = filter(lambda x: x.name == configName, self.getConfigurations(sessionType))
-        if matches:
-            result = matches[0]
-        elif raiseException:
+        result = self.getConfigurationCatalog().findByName(sessionType, configName)
+        if result is None and raiseException:
             raise WebException("No such %s configuration: '%s'." % (sessionType, configName))
         return result
 
-    def exportConfigurationToFileById(self, sessionType, configId, exportFile):
+    def findConfigurationById(self, sessionType, configId, raiseException=True):
+        """Finds a specific configuration by sessionType and id, using the connection's ConfigurationCatalog.
+        """
+        Validators.checkSessionType(sessionType)
+        result = self.getConfigurationCatalog().findById(sessionType, configId)
+        if result is None and raiseException:
+            raise WebException("No such %s configuration: %s." % (sessionType, configId))
+        return result
+
+    def exportConfigurationToFileById(self, sessionType, configId, exportFile, progress=None):
         """Export a configuration of a specific sessionType and identified by its id to a file.
 
         @param sessionType: a string with the type of session.
         @param configId: the (numeric) id of the config to export.
         @param exportFile: a file-like object to write the configuration to. Must be opened in binary mode.
+        @param progress: (optional) a function(bytesDone, totalBytes, bytesPerSecond) called as the file is downloaded
         """
         Validators.checkSessionType(sessionType)
         Validators.checkInt(configId, "configId")
         Validators.checkFile(exportFile, "exportFile")
-        reply = self.httpGetRaw(self.kOperationExportConfigFormat % (sessionType, configId))
-        exportFile.write(reply.content)
+        self._httpStreamBinaryResultToFile(self.kOperationExportConfigFormat % (sessionType, configId), exportFile, progress)
 
     def collectSessionDiagnostics(self, sessionId, clientOnly=False):
         Validators.checkInt(sessionId, "sessionId")
@@ -1520,7 +3382,8 @@ class Connection(HttpConvention):
         method = self.kMethodPost
         # we also omit the params and extras (that httpRequest would send) as these are not likely to ever be used here
         # but set verify to False to turn off SSL certificate validation
-        reply = requests.request(method, absUrl, files=files, headers=headers, cookies=self.cookies, verify=False)
+        reply = self.resolveTransport().request(method, absUrl, files=files, headers=headers, cookies=self.cookies, verify=False)
+        self.getConfigurationCatalog().invalidate(sessionType)
         self.check(reply, method, absUrl, checkNotifications=True)
         return self.getWebObjectFromReply(reply, absUrl)
 
@@ -1532,37 +3395,85 @@ class Connection(HttpConvention):
         """
         Validators.checkSessionType(sessionType)
         Validators.checkInt(configId, "configId")
-        self.httpDelete(self.kOperationDeleteConfigFormat % (sessionType, configId), WebObject(applicationType=sessionType))
+        try:
+            self.httpDelete(self.kOperationDeleteConfigFormat % (sessionType, configId), WebObject(applicationType=sessionType))
+        finally:
+            self.getConfigurationCatalog().invalidate(sessionType)
 
-    def getAvailableStats(self, testOrResultId):
+    def getAvailableStats(self, testOrResultId, refresh=False):
         """Retrieves a WebObject describing the set of available stat groups, stats and filters.
 
+        The schema is fetched once per connection and then reused (see getStatsSchema()). The returned object is
+        a copy, so changing it does not affect the cached schema.
         @param testOrResultId: the test Id. Typically obtained by using the id member of the WebObject returned by runTest.
+        @param refresh: (optional) if True, fetch the schema again
         """
-        Validators.checkInt(testOrResultId, "testOrResultId")
-        return self.httpGet("results/%s/schema" % testOrResultId)
+        availableStats = self.getStatsSchema(testOrResultId, refresh).availableStats
+        # rebuilt from the json: the source of the proxies (this connection) cannot be deep copied
+        return WebObjectWithSource(availableStats._json_, availableStats._source_)
+
+    def getStatsSchema(self, testOrResultId, refresh=False):
+        """Returns the StatsSchema of a test, used to check the stats of queries (see StatsQuery.compile()).
 
-    def getStatsCsvZipToFile(self, testOrResultId, statFile):
+        The schema of a test does not change, so it is fetched once per connection and then reused. Only the
+        schemas of the last kMaxStatsSchemas tests are kept.
+        @param testOrResultId: the test Id. Typically obtained by using the id member of the WebObject returned by runTest.
+        @param refresh: (optional) if True, fetch the schema again
+        """
+        Validators.checkInt(testOrResultId, "testOrResultId")
+        with self._statsSchemasLock:
+            schema = self._statsSchemas.pop(testOrResultId, None)
+            if schema is not None:
+                self._statsSchemas[testOrResultId] = schema
+        if schema is None or refresh:
+            schema = StatsSchema(self.httpGet("results/%s/schema" % testOrResultId))
+            with self._statsSchemasLock:
+                self._statsSchemas.pop(testOrResultId, None)
+                self._statsSchemas[testOrResultId] = schema
+                while len(self._statsSchemas) > self.kMaxStatsSchemas:
+                    self._statsSchemas.popitem(last=False)
+        return schema
+
+    def getStatsCsvZipToFile(self, testOrResultId, statFile, progress=None, parallelConnections=None):
         """Retrieves the entire set of stats from the web server and writes them into the file-like object statFile.
 
         @param testOrResultId: the test Id. Typically obtained by using the id member of the WebObject returned by runTest.
         @param statFile: a file handle or file-like object to be written to with the CSV-formatted statistics data
+        @param progress: (optional) a function(bytesDone, totalBytes, bytesPerSecond) called as the zip is downloaded
+        @param parallelConnections: (optional) download large zips over this many connections at once (see SegmentedDownload).
+                                    statFile must then be a file opened in binary mode.
         """
         Validators.checkInt(testOrResultId, "testOrResultId")
         Validators.checkFile(statFile, "statFile")
+        self._httpStreamBinaryResultToFile(self._getStatsCsvZipUrl(testOrResultId), statFile, progress, parallelConnections)
+
+    def _getStatsCsvZipUrl(self, testOrResultId):
+        # has the server build the zip and returns the url to download it from
         reply = self.httpPostRaw("results/%s/zip" % testOrResultId, stream=True)
         if reply.status_code == httplib.ACCEPTED:
             status = self._httpPollAsyncOperation(reply)
-            self._httpStreamBinaryResultToFile(status.resultUrl, statFile)
+            return status.resultUrl
         else:
             raise WebException("Unable to retrieve csv for test/result %s" % testOrResultId)
-        
-    def getStatsCsvToFile(self, testOrResultId, statsCsvRequest, statFile):
+
+    def getStatsCsvZipStream(self, testOrResultId, chunkSize=None):
+        """Retrieves the entire set of stats from the web server and returns an iterator over the chunks of the zip file.
+
+        Nothing is buffered or written to disk; see ixia.csvresults.iterStatsCsvZip() to parse the CSV files as they arrive.
+
+        @param testOrResultId: the test Id. Typically obtained by using the id member of the WebObject returned by runTest.
+        @param chunkSize: (optional) the max number of bytes per chunk
+        """
+        Validators.checkInt(testOrResultId, "testOrResultId")
+        return self._httpStreamBinaryResult(self._getStatsCsvZipUrl(testOrResultId), chunkSize)
+
+    def getStatsCsvToFile(self, testOrResultId, statsCsvRequest, statFile, progress=None):
         """Retrieves a specified set of stats from the web server and writes them into the file-like object statFile.
 
         @param testOrResultId: the test Id. Typically obtained by using the id member of the WebObject returned by runTest.
         @param statsCsvRequest: a StatsCsvRequest object specifying the set of stats to return in the CSV file.
         @param statFile: a file handle or file-like object to be written to with the CSV-formatted statistics data
+        @param progress: (optional) a function(bytesDone, totalBytes, bytesPerSecond) called as the file is downloaded
         """
         Validators.checkInt(testOrResultId, "testOrResultId")
         Validators.checkNotNone(statsCsvRequest, "statsCsvRequest")
@@ -1570,10 +3481,9 @@ class Connection(HttpConvention):
         reply = self.httpPostRaw("results/%s/csv" % testOrResultId, statsCsvRequest, stream=True)
         if reply.status_code == httplib.ACCEPTED:
             status = self._httpPollAsyncOperation(reply)
-            self._httpStreamBinaryResultToFile(status.resultUrl, statFile)
+            self._httpStreamBinaryResultToFile(status.resultUrl, statFile, progress)
         else:
             raise WebException("Unable to retrieve csv for test/result %s using request %s" % (testOrResultId, statsCsvRequest))
-        statFile.flush()
 
     def getUserAdmin(self):
         """ Returns a UserAdmin object that can be used to create/edit/delete users.
@@ -1593,8 +3503,8 @@ class webApi(object):
     @param username: The login name of the user under which this script will run
     """
     @classmethod
-    def connect(cls, siteUrl, siteVersion, userkey=None, username=None, password=None):
-        return Connection(siteUrl, siteVersion, userkey, username, password)
+    def connect(cls, siteUrl, siteVersion, userkey=None, username=None, password=None, **kwArgs):
+        return Connection(siteUrl, siteVersion, userkey, username, password, **kwArgs)
 
 class StatAggregation(object):
     kNone = "none"
@@ -1613,6 +3523,86 @@ class StatAggregation(object):
     def allSupportedAggregations(cls):
         return [cls.kNone, cls.kSum, cls.kMin, cls.kMax, cls.kAverage, cls.kRate, cls.kMaxRate, cls.kMinRate, cls.kPositiveRate, cls.kPositiveMaxRate, cls.kPositiveMinRate]
 
+class StatColumns(object):
+    """The columns of a table of stats: the stat definitions in order, the index of each and, when the schema
+    is known, their types.
+
+    Instances never change once built and are shared: StatColumns.of() returns the same object for the same
+    columns, so the StatsRequests, Snapshots and CSV files of a test use one set of maps instead of building
+    their own. Get them from StatsRequest.columns, StatsSchema.columnsOf() or CsvResultMember.statColumns.
+
+    @param definitions: the stat definitions (names), in column order
+    @param types: (optional) the schema type of each column (e.g. "long", "double", "string"), or None where unknown
+    """
+    # schema types -> the array type code of their columns (kTextTypeCode: not numeric)
+    kTextTypeCode = ""
+    kTypeCodes = dict([(statType, "l") for statType in ["int", "integer", "long", "short", "byte"]] +
+                      [(statType, "d") for statType in ["double", "float", "decimal", "number"]] +
+                      [(statType, "") for statType in ["string", "text", "ip", "ipaddress"]])
+    kMaxShared = 4096
+
+    _shared = {}
+    _sharedLock = threading.Lock()
+
+    def __init__(self, definitions, types=None):
+        self.definitions = tuple(definitions)
+        self.types = tuple(types) if types is not None else (None,) * len(self.definitions)
+        if len(self.types) != len(self.definitions):
+            raise ValueError("StatColumns(): %s types for %s columns." % (len(self.types), len(self.definitions)))
+        # a name repeated in several columns maps to the last one
+        self.indexes = dict((definition, index) for index, definition in enumerate(self.definitions))
+        # the array type code of each column: "l", "d", kTextTypeCode, or None when unknown
+        self.typeCodes = tuple(self.kTypeCodes.get(statType.lower()) if statType else None for statType in self.types)
+
+    @classmethod
+    def of(cls, definitions, types=None):
+        """Returns the shared StatColumns for these definitions and types."""
+        key = (tuple(definitions), tuple(types) if types is not None else None)
+        columns = cls._shared.get(key)
+        if columns is None:
+            columns = cls(*key)
+            with cls._sharedLock:
+                if len(cls._shared) >= cls.kMaxShared:
+                    cls._shared.clear()
+                columns = cls._shared.setdefault(key, columns)
+        return columns
+
+    def __len__(self):
+        return len(self.definitions)
+
+    # immutable: copies (e.g. by StatsRequest.copy()) share the maps
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __contains__(self, definition):
+        return definition in self.indexes
+
+    def indexOf(self, definition):
+        """Returns the index of a column. Raises a KeyError if there is no such column."""
+        return self.indexes[definition]
+
+    def typeCodeOf(self, definition):
+        """Returns the array type code of a column ("l" or "d"), kTextTypeCode for text columns, or None if unknown."""
+        return self.typeCodes[self.indexes[definition]]
+
+
+# "group:name" -> (group, name), so that the same definitions are only split once
+_statDefinitions = {}
+
+
+def _splitStatDefinition(definition):
+    parts = _statDefinitions.get(definition)
+    if parts is None:
+        if len(_statDefinitions) >= StatColumns.kMaxShared:
+            _statDefinitions.clear()
+        fields = definition.split(":")
+        parts = _statDefinitions[definition] = (fields[0], fields[-1])
+    return parts
+
+
 class Stat(WebObjectProxy):
     """Describes a stat object
 
@@ -1628,12 +3618,12 @@ class Stat(WebObjectProxy):
         if not aggregationType in StatAggregation.allSupportedAggregations():
             raise ValueError("The specified aggregation type '%s' is not supported." % aggregationType)
 
-        super(Stat, self).__init__(**{ "group": string.split(definition, ':')[0], \
-                                       "name": string.split(definition, ':')[-1], "aggregationType": aggregationType})
+        group, name = _splitStatDefinition(definition)
+        super(Stat, self).__init__(**{ "group": group, "name": name, "aggregationType": aggregationType})
 
-    def __getattr__(self, attribute):
-        if "definition" == attribute:
-            return self.name
+    @property
+    def definition(self):
+        return self.name
 
     #Filtering region
     
@@ -1690,16 +3680,20 @@ class OrderByStat(WebObjectProxy):
     @param direction:      Specifies how the results will be ordered: ascending or descending
 
     """    
+    # the group of the stat, when known, which the request does not send (see StatsQuery.compile())
+    __slots__ = ("_group_",)
 
     def __init__(self, statDefinition, direction):        
         if isinstance(statDefinition, basestring):
             Validators.checkNonEmptyString(statDefinition, statDefinition)
-            
-            super(OrderByStat, self).__init__(**{ "definition": string.split(statDefinition, ':')[-1], \
+            group, name = _splitStatDefinition(statDefinition)
+            super(OrderByStat, self).__init__(**{ "definition": name, \
                 "ascending": direction, "aggregationType": StatAggregation.kNone })
+            self._group_ = group if ":" in statDefinition else None
         elif isinstance(statDefinition, Stat):
             super(OrderByStat, self).__init__(**{ "definition": statDefinition.definition, \
                 "ascending": direction, "aggregationType": statDefinition.aggregationType })
+            self._group_ = statDefinition.group
         else:
             raise ValueError(Validators.kFormatRequiresType % ("statDefinition", \
                 'a Stat object or stat definition', type(statDefinition), statDefinition))
@@ -1731,6 +3725,8 @@ class StatsRequest(WebObjectProxy):
     @param cacheSize: (optional) represents the number of snapshots that are kept on the server-side cache for this query. 
                         Default is 1 meaning that the server will store only the most recent snapshot.
     """
+    # the StatColumns of the stats, built on first use (see columns)
+    __slots__ = ("_columns_",)
 
     def __init__(self, stats, orderBy=[], syncGroup="all", limit=0, cacheSize=1, filter = None):
         Validators.checkString(syncGroup, "syncGroup")
@@ -1755,6 +3751,16 @@ class StatsRequest(WebObjectProxy):
 
         if "syncGroup" == attribute:
             return self.groups[0].name
+        return super(StatsRequest, self).__getattr__(attribute)
+
+    @property
+    def columns(self):
+        """The shared StatColumns of the stats of the request, which the Snapshots returned for it use."""
+        try:
+            return self._columns_
+        except AttributeError:
+            self._columns_ = StatColumns.of([stat.definition for stat in self.stats])
+            return self._columns_
 
     @staticmethod
     def generateQueryId():
@@ -1769,58 +3775,478 @@ class StatsRequest(WebObjectProxy):
 
         return theCopy
 
+class StatsSchema(object):
+    """The stat groups and stats available for a test or result, as described by Connection.getAvailableStats().
+
+    Get the cached schema of a test with Connection.getStatsSchema(). The StatColumns of each group (the index and
+    type of each stat) are built once, and StatsQuery.compile() checks its stats against them and passes the stat
+    types on to the Snapshots.
+
+    @param availableStats: the WebObject returned by getAvailableStats(): a list of groups (or an object with
+                           a groups list), each with a name and a list of stats (names, or objects with a name and a type)
+    """
+
+    def __init__(self, availableStats):
+        self.availableStats = availableStats
+        # group name -> StatColumns of all its stats, in schema order
+        self.groups = collections.OrderedDict()
+        groups = availableStats.groups if isinstance(availableStats, WebObjectProxy) else availableStats
+        for group in groups or []:
+            stats = [(stat, None) if isinstance(stat, basestring) else (stat.name, getattr(stat, "type", None)) for stat in group.stats or []]
+            self.groups[group.name] = StatColumns.of([name for name, _ in stats], [statType for _, statType in stats])
+
+    def hasStat(self, group, name):
+        return group in self.groups and name in self.groups[group]
+
+    def groupsOf(self, name):
+        """Returns the names of the groups that have a stat with this name."""
+        return [group for group, columns in self.groups.iteritems() if name in columns]
+
+    def typeOf(self, group, name):
+        """Returns the schema type of a stat, or None if the schema does not say."""
+        self.checkStat(group, name)
+        columns = self.groups[group]
+        return columns.types[columns.indexOf(name)]
+
+    def columnsOf(self, group, names):
+        """Returns the shared StatColumns for these stats of a group, with their schema types."""
+        return StatColumns.of(names, [self.typeOf(group, name) for name in names])
+
+    def checkStat(self, group, name):
+        """Raises a ValueError if the group has no stat with this name."""
+        if group not in self.groups:
+            raise ValueError("Unknown stat group '%s'. The available groups are: %s." % (group, ", ".join(self.groups)))
+        if name not in self.groups[group]:
+            raise ValueError("Unknown stat '%s:%s'. The stats of group '%s' are: %s." % (group, name, group, ", ".join(self.groups[group].definitions)))
+
+
+class StatsQuery(object):
+    """Builds the StatsRequests of a query from a declarative description, so the filtering, ordering and top-N
+    selection of the rows are done by the server.
+
+        query = StatsQuery(StatKey("mix:Flow"), "mix:Throughput", "mix:Bytes Sent")
+        query.where("Throughput > 1000 and (Flow = 'flow 1' or Flow = 'flow 2')").orderBy("-Throughput").limit(10)
+        readers = session.registerStatsQuery(query)
+
+    Stats are Stat objects or "group:name" definitions. Where expressions compare a stat with a number or a quoted
+    string using =, !=, <, <=, > and >=, combined with and, or and parentheses. Stat names with spaces or operators
+    in them are written in double quotes ("Bytes Sent" > 0). Names are looked up in the selected stats, so the group
+    is only needed to tell apart stats with the same name in different groups ("mix:Throughput").
+
+    The server returns the rows of one group per request, so a query selecting the stats of several groups compiles
+    into one StatsRequest per group, in the same syncGroup. Each condition of a where expression is applied to the
+    request of its stat's group: and-ed conditions may span groups, but or-ed conditions must be of the same group.
+    The ordering and the limit apply to the rows of each group.
+
+    @param stats: the Stat objects or stat definitions to select
+    @param syncGroup, cacheSize: (optional) passed on to the StatsRequests (see StatsRequest)
+    """
+    kOperators = ["=", "!=", "<", "<=", ">", ">="]
+    # "==" and "<>" are accepted as aliases
+    kOperatorAliases = {"==": "=", "<>": "!="}
+    kDescendingPrefix = "-"
+    _kTokenExpression = re.compile(r"""\s*(?:(?P<number>-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)|'(?P<string>(?:[^']|'')*)'|"(?P<quoted>[^"]+)"|"""
+                                   r"""(?P<operator><=|>=|==|!=|<>|[=<>()])|(?P<name>[^\s=<>!()'"]+))""")
+
+    def __init__(self, *stats, **kwArgs):
+        self.syncGroup = kwArgs.pop("syncGroup", "all")
+        self.cacheSize = kwArgs.pop("cacheSize", 1)
+        if kwArgs:
+            raise TypeError("StatsQuery() got unexpected keyword arguments: %s" % ", ".join(kwArgs))
+        self.stats = []
+        self.conditions = []
+        self.orderByColumns = []
+        self.rowLimit = 0
+        self.select(*stats)
+
+    def select(self, *stats):
+        """Adds stats to the query. Returns the query."""
+        for stat in stats:
+            if isinstance(stat, basestring):
+                stat = Stat(stat)
+            elif not isinstance(stat, Stat):
+                raise ValueError(Validators.kFormatRequiresType % ("stats", "a Stat object or stat definition", type(stat), stat))
+            self.stats.append(stat)
+        return self
+
+    def where(self, expression):
+        """Adds a condition the rows must meet: a where expression or a StatFilter. Conditions are and-ed. Returns the query."""
+        if isinstance(expression, basestring):
+            Validators.checkNonEmptyString(expression, "expression")
+        elif not isinstance(expression, StatFilter):
+            raise ValueError(Validators.kFormatRequiresType % ("expression", "a where expression or StatFilter", type(expression), expression))
+        self.conditions.append(expression)
+        return self
+
+    def orderBy(self, *columns):
+        """Orders the rows by these stats: names ("-name" for descending order) or OrderByStat objects. Returns the query."""
+        for column in columns:
+            if not isinstance(column, (basestring, OrderByStat)):
+                raise ValueError(Validators.kFormatRequiresType % ("columns", "a stat name or OrderByStat object", type(column), column))
+            self.orderByColumns.append(column)
+        return self
+
+    def limit(self, count):
+        """Returns at most count rows per snapshot (0: all the rows). Returns the query."""
+        Validators.checkInt(count, "count")
+        self.rowLimit = count
+        return self
+
+    def top(self, count, statName):
+        """Returns the count rows with the highest values of a stat. Returns the query."""
+        return self.orderBy(self.kDescendingPrefix + statName).limit(count)
+
+    def compile(self, schema=None):
+        """Returns the list of StatsRequests of the query, one per stat group.
+
+        @param schema: (optional) a StatsSchema to check the stats against (see Connection.getStatsSchema())
+        @raises ValueError if a stat is unknown or ambiguous or an expression is not valid
+        """
+        if not self.stats:
+            raise ValueError("StatsQuery.compile(): the query has no stats.")
+        groups = collections.OrderedDict()
+        for stat in self.stats:
+            if schema is not None:
+                schema.checkStat(stat.group, stat.name)
+            groups.setdefault(stat.group, []).append(stat)
+        filters = dict((group, None) for group in groups)
+        for condition in self.conditions:
+            if isinstance(condition, StatFilter):
+                self._addFilter(filters, self._groupOfFilter(condition), condition)
+            else:
+                for group, statFilter in self._parse(condition):
+                    self._addFilter(filters, group, statFilter)
+        orderBy = dict((group, []) for group in groups)
+        for column in self.orderByColumns:
+            if isinstance(column, OrderByStat):
+                # the group of the source stat disambiguates names selected in several groups
+                name = column.definition if column._group_ not in groups else "%s:%s" % (column._group_, column.definition)
+                orderBy[self._groupOf(name)].append(column)
+                continue
+            direction = OrderDirection.kAsc
+            if column.startswith(self.kDescendingPrefix):
+                column, direction = column[len(self.kDescendingPrefix):], OrderDirection.kDesc
+            stat = self._resolve(column)
+            orderBy[stat.group].append(OrderByStat(stat, direction))
+        statsRequests = []
+        for group, stats in groups.iteritems():
+            statsRequest = StatsRequest(stats, orderBy[group], self.syncGroup, self.rowLimit, self.cacheSize, filters[group])
+            if schema is not None:
+                statsRequest._columns_ = schema.columnsOf(group, [groupStat.definition for groupStat in stats])
+            statsRequests.append(statsRequest)
+        return statsRequests
+
+    @staticmethod
+    def _addFilter(filters, group, statFilter):
+        filters[group] = statFilter if filters[group] is None else filters[group].And(statFilter)
+
+    def _resolve(self, name):
+        # finds the selected stat with this name ("name" or "group:name")
+        group, _, statName = name.rpartition(":")
+        matches = [stat for stat in self.stats if stat.name == statName and (not group or stat.group == group)]
+        if not matches:
+            raise ValueError("The stat '%s' is not selected by the query." % name)
+        if len({stat.group for stat in matches}) > 1:
+            raise ValueError("The stat name '%s' is ambiguous: use one of %s." % (name, ", ".join("%s:%s" % (stat.group, statName) for stat in matches)))
+        return matches[0]
+
+    def _groupOf(self, name):
+        return self._resolve(name).group
+
+    def _groupOfFilter(self, statFilter):
+        # the group of the stats compared by a StatFilter tree
+        groups = set()
+        pending = [statFilter]
+        while pending:
+            item = pending.pop()
+            if item.type == "boolean":
+                pending.extend([item.leftItem, item.rightItem])
+            else:
+                groups.add(self._groupOf(item.leftItem))
+        if len(groups) > 1:
+            raise ValueError("The filter %s compares stats of several groups (%s)." % (statFilter, ", ".join(sorted(groups))))
+        return groups.pop()
+
+    def _tokenize(self, expression):
+        tokens = []
+        position = 0
+        expression = expression.rstrip()
+        while position < len(expression):
+            match = self._kTokenExpression.match(expression, position)
+            if match is None:
+                raise ValueError("Invalid where expression '%s' at position %s." % (expression, position))
+            kind = match.lastgroup
+            value = match.group(kind)
+            if kind == "number":
+                value = float(value) if any(c in value for c in ".eE") else int(value)
+            elif kind == "string":
+                value = value.replace("''", "'")
+            elif kind == "name" and value.lower() in ("and", "or"):
+                kind, value = value.lower(), value.lower()
+            elif kind == "quoted":
+                kind = "name"
+            tokens.append((kind, value))
+            position = match.end()
+        return tokens
+
+    def _parse(self, expression):
+        # Returns the (group, StatFilter) pairs of the and-ed terms of the expression
+        tokens = self._tokenize(expression)
+        position = [0]
+
+        def peek():
+            return tokens[position[0]] if position[0] < len(tokens) else (None, None)
+
+        def take(expected=None):
+            token = peek()
+            if token[0] is None or (expected is not None and token[1] != expected):
+                raise ValueError("Invalid where expression '%s': expected %s, found %s." % (expression, expected or "more", token[1] or "the end"))
+            position[0] += 1
+            return token
+
+        # each parse function returns a list of and-ed (group, StatFilter) terms
+        def parseOr():
+            terms = parseAnd()
+            while peek()[0] == "or":
+                take()
+                right = parseAnd()
+                groups = {group for group, _ in terms + right}
+                if len(groups) > 1:
+                    raise ValueError("Invalid where expression '%s': 'or' conditions must be on stats of the same group." % expression)
+                terms = [(groups.pop(), self._andAll(terms).Or(self._andAll(right)))]
+            return terms
+
+        def parseAnd():
+            terms = parseTerm()
+            while peek()[0] == "and":
+                take()
+                terms = terms + parseTerm()
+            return terms
+
+        def parseTerm():
+            if peek() == ("operator", "("):
+                take()
+                terms = parseOr()
+                take(")")
+                return terms
+            kind, name = take()
+            if kind != "name":
+                raise ValueError("Invalid where expression '%s': expected a stat name, found %s." % (expression, name))
+            kind, operator = take()
+            operator = self.kOperatorAliases.get(operator, operator)
+            if kind != "operator" or operator not in self.kOperators:
+                raise ValueError("Invalid where expression '%s': expected a comparison after %s, found %s." % (expression, name, operator))
+            kind, value = take()
+            if kind not in ("number", "string"):
+                raise ValueError("Invalid where expression '%s': expected a number or a quoted string after %s %s." % (expression, name, operator))
+            stat = self._resolve(name)
+            return [(stat.group, StatFilter(stat.definition, operator, value))]
+
+        terms = parseOr()
+        if position[0] != len(tokens):
+            raise ValueError("Invalid where expression '%s': unexpected %s." % (expression, peek()[1]))
+        return terms
+
+    @staticmethod
+    def _andAll(terms):
+        result = terms[0][1]
+        for _, statFilter in terms[1:]:
+            result = result.And(statFilter)
+        return result
+
+
+class OverflowPolicy(object):
+    """What a SnapshotQueue does with a new snapshot when it is full."""
+    # the producer waits for room. Readers that poll on the consumer's thread leave the extra snapshots on the
+    # server instead (they are fetched again by the next poll, if the request's cacheSize still holds them).
+    kBlock = "block"
+    # the oldest queued snapshot is discarded
+    kDropOldest = "dropOldest"
+    # the new snapshot replaces the newest queued one, so the consumer still gets the latest values
+    kCoalesce = "coalesce"
+
+    @staticmethod
+    def allSupportedPolicies():
+        return [OverflowPolicy.kBlock, OverflowPolicy.kDropOldest, OverflowPolicy.kCoalesce]
+
+
+class SnapshotQueue(object):
+    """A bounded ring buffer of Snapshots between the poller of a StatsReader and its consumer.
+
+    The counters tell how the consumer keeps up: snapshots received and delivered, dropped or coalesced
+    on overflow, late (delivered more than lateThreshold seconds after being received), and the highest
+    number of snapshots queued at once.
+
+    @param capacity: the max number of snapshots held
+    @param overflowPolicy: one of the OverflowPolicy constants
+    @param lateThreshold: the number of seconds after which a queued snapshot counts as late
+    """
+    kDefaultCapacity = 64
+    kDefaultLateThreshold = 2.0
+
+    def __init__(self, capacity=kDefaultCapacity, overflowPolicy=OverflowPolicy.kBlock, lateThreshold=kDefaultLateThreshold):
+        Validators.checkInt(capacity, "capacity")
+        if capacity < 1:
+            raise ValueError("The 'capacity' parameter must be at least 1. Was %s." % capacity)
+        if overflowPolicy not in OverflowPolicy.allSupportedPolicies():
+            raise ValueError("The specified overflow policy '%s' is not supported." % overflowPolicy)
+        self.capacity = capacity
+        self.overflowPolicy = overflowPolicy
+        self.lateThreshold = lateThreshold
+        self.received = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.late = 0
+        self.highWater = 0
+        self.isClosed = False
+        # each slot holds a (snapshot, receivedTime) pair
+        self._slots = [None] * capacity
+        self._head = 0
+        self._count = 0
+        self._condition = threading.Condition()
+
+    def __len__(self):
+        return self._count
+
+    def put(self, snapshot, block=True, timeout=None):
+        """Queues a snapshot, applying the overflow policy if the queue is full.
+
+        @param block: for the kBlock policy, wait for room (up to timeout seconds) instead of giving up at once
+        @return True if the snapshot was queued (or coalesced), False if the queue is full (kBlock) or closed
+        """
+        self._condition.acquire()
+        try:
+            if self._count == self.capacity and self.overflowPolicy == OverflowPolicy.kBlock and block:
+                deadline = timeout is not None and time.time() + timeout
+                while self._count == self.capacity and not self.isClosed:
+                    remaining = deadline - time.time() if deadline else None
+                    if remaining is not None and remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+            if self.isClosed:
+                return False
+            entry = (snapshot, time.time())
+            if self._count == self.capacity:
+                if self.overflowPolicy == OverflowPolicy.kBlock:
+                    return False
+                if self.overflowPolicy == OverflowPolicy.kCoalesce:
+                    self._slots[(self._head + self._count - 1) % self.capacity] = entry
+                    self.coalesced += 1
+                    self.received += 1
+                    return True
+                self._slots[self._head] = None
+                self._head = (self._head + 1) % self.capacity
+                self._count -= 1
+                self.dropped += 1
+            self._slots[(self._head + self._count) % self.capacity] = entry
+            self._count += 1
+            self.received += 1
+            self.highWater = max(self.highWater, self._count)
+            self._condition.notifyAll()
+            return True
+        finally:
+            self._condition.release()
+
+    def get(self, timeout=0):
+        """Returns the oldest snapshot, waiting up to timeout seconds (None: forever) for one. Returns None if there is none."""
+        self._condition.acquire()
+        try:
+            if not self._count and timeout != 0:
+                deadline = timeout is not None and time.time() + timeout
+                while not self._count and not self.isClosed:
+                    remaining = deadline - time.time() if deadline else None
+                    if remaining is not None and remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+            if not self._count:
+                return None
+            snapshot, receivedTime = self._slots[self._head]
+            self._slots[self._head] = None
+            self._head = (self._head + 1) % self.capacity
+            self._count -= 1
+            self.delivered += 1
+            if time.time() - receivedTime > self.lateThreshold:
+                self.late += 1
+            self._condition.notifyAll()
+            return snapshot
+        finally:
+            self._condition.release()
+
+    def close(self):
+        """Wakes up the waiting producers and consumers. Queued snapshots can still be read."""
+        self._condition.acquire()
+        try:
+            self.isClosed = True
+            self._condition.notifyAll()
+        finally:
+            self._condition.release()
+
+    def counters(self):
+        """Returns a dictionary with the counters of the queue."""
+        return {"received": self.received, "delivered": self.delivered, "dropped": self.dropped, "coalesced": self.coalesced,
+                "late": self.late, "queued": self._count, "highWater": self.highWater}
+
+
 class StatsReader(object):
+    """Reads the snapshots of a registered StatsRequest. Get one with Session.registerStatsRequest().
+
+    Fetched snapshots wait in a bounded SnapshotQueue (the snapshots attribute), whose counters report
+    the snapshots dropped, coalesced or delivered late.
+    """
     kDefaultTimeout = 300
 
-    def __init__(self, session, statsRequest):
+    def __init__(self, session, statsRequest, capacity=None, overflowPolicy=None):
         self.session = session
         self.statsRequest = statsRequest
         self._lastTimestamp = 0        
         self._sleepTime = 0.5 #sec
-        self._snapshots = []
-        self._currentSnapshotIndex = -1
+        self.snapshots = SnapshotQueue(capacity or SnapshotQueue.kDefaultCapacity, overflowPolicy or OverflowPolicy.kBlock)
+        # set while a StatsAsyncReader polls on its own thread: getNextSnapshot() then only waits for the queue
+        self._background = False
         self.isClosed = False
         self.lock = threading.Lock()
         
     def getNextSnapshot(self, timeout=kDefaultTimeout):
+        startTime = time.time()
+        while not self.isClosed:
+            snapshot = self.snapshots.get(max(startTime + timeout - time.time(), 0) if self._background else 0)
+            if snapshot is not None:
+                return snapshot
+            if self.snapshots.isClosed:
+                break
+            if not self._background and self._fill(block=False):
+                continue
+            if time.time() - startTime >= timeout:
+                raise StatsTimeoutException("StatsReader.getNextData(): Timeout while trying to get values for queryId:" + self.statsRequest.id)
+            if not self._background:
+                time.sleep(self._sleepTime)
+        return None
 
-        if self._snapshots and (self._currentSnapshotIndex + 1) < len(self._snapshots):
-            self._currentSnapshotIndex += 1
-        else:
-            self._currentSnapshotIndex = 0
-
-            # get all the avaialable snapshots from the server, we will return them one by one
-            tries = 0
-            
-            while (tries * self._sleepTime < timeout and not self.isClosed):
-                
-                self.lock.acquire()
-                try:
-                    rawData = self.session._getRealtimeData(self.statsRequest, self._lastTimestamp)
-                finally:
-                    self.lock.release()
-                
-                if not rawData is None:
-                    self._snapshots = [Snapshot(snapshotData, self.statsRequest) for snapshotData in rawData]
-
-                if len(self._snapshots) > 0:
+    def _fill(self, block):
+        # polls the server and queues the new snapshots. Returns the number queued.
+        # Snapshots that find no room are left on the server: the timestamp only moves past queued snapshots.
+        self.lock.acquire()
+        try:
+            if self.isClosed:
+                return 0
+            rawData = self.session._getRealtimeData(self.statsRequest, self._lastTimestamp)
+            count = 0
+            for snapshotData in rawData or []:
+                if snapshotData["timestamp"] <= self._lastTimestamp:
+                    continue
+                if not self.snapshots.put(Snapshot(snapshotData, self.statsRequest), block, self._sleepTime):
                     break
-                
-                time.sleep(self._sleepTime)
-                tries+=1
-            
-            if (rawData is None or len(self._snapshots) == 0) and not self.isClosed:
-                raise StatsTimeoutException("StatsReader.getNextData(): Timeout while trying to get values for queryId:" + self.statsRequest.id)
-            if len(self._snapshots)>0 and not self.isClosed:
-                self._lastTimestamp = self._snapshots[-1].timestamp;
-        
-        if not self.isClosed:
-            return self._snapshots[self._currentSnapshotIndex]
-        else:
-            return None
-        
+                self._lastTimestamp = snapshotData["timestamp"]
+                count += 1
+            return count
+        finally:
+            self.lock.release()
+
     def close(self):
         self.isClosed = True
+        # wake up a poller blocked on a full queue before taking the lock it holds
+        self.snapshots.close()
         
         self.lock.acquire()
         try:
@@ -1834,6 +4260,125 @@ class StatsReader(object):
     def __exit__(self, type, value, traceback):
         self.close()
 
+class StatsMultiplexer(object):
+    """Registers and polls many StatsRequests of one session together.
+
+    All the requests are registered with one stats/registration call, and every poll fetches the data of
+    all the open readers with one stats/data/cache call, fanning the snapshots out to the readers.
+    The readers returned by register() are StatsReaders, so they work with StatsAsyncReader, but however
+    many of them poll at once, the server is polled at most once per pollInterval.
+    Get one with Session.createStatsMultiplexer().
+
+    @param session: the Session the requests belong to
+    @param pollInterval: (optional) the min number of seconds between polls of the server
+    """
+    kDefaultPollInterval = 0.5
+
+    def __init__(self, session, pollInterval=None):
+        Validators.checkNotNone(session, "session")
+        self.session = session
+        self.pollInterval = pollInterval or self.kDefaultPollInterval
+        self._readers = []
+        self._lastPollTime = 0
+        self.lock = threading.Lock()
+
+    def register(self, statsRequests, capacity=None, overflowPolicy=None):
+        """Registers a list of StatsRequests with one call and returns a list with a StatsReader for each.
+
+        @param capacity, overflowPolicy: (optional) the size and overflow policy of the SnapshotQueue of each reader
+        """
+        Validators.checkList(statsRequests, "statsRequests")
+        self.session._checkStatsRequests(statsRequests)
+        self.session._registerStatsRequests(statsRequests)
+        readers = [_MultiplexedStatsReader(self, statsRequest, capacity, overflowPolicy) for statsRequest in statsRequests]
+        self.lock.acquire()
+        try:
+            self._readers.extend(readers)
+        finally:
+            self.lock.release()
+        return readers
+
+    def poll(self):
+        """Polls the server for all the open readers and queues the new snapshots on each. Returns the number of new snapshots."""
+        self.lock.acquire()
+        try:
+            return self._poll()
+        finally:
+            self.lock.release()
+
+    def pollIfDue(self):
+        """Polls the server unless it was polled less than pollInterval seconds ago."""
+        self.lock.acquire()
+        try:
+            if time.time() - self._lastPollTime < self.pollInterval:
+                return 0
+            return self._poll()
+        finally:
+            self.lock.release()
+
+    def _poll(self):
+        readers = [reader for reader in self._readers if not reader.isClosed]
+        self._lastPollTime = time.time()
+        if not readers:
+            return 0
+        # one call for all: ask for everything newer than the oldest reader's timestamp, then drop what each reader already has
+        startTimestamp = min(reader._lastTimestamp for reader in readers)
+        dataMap = self.session._getRealtimeDataMap([reader.statsRequest for reader in readers], startTimestamp)
+        count = 0
+        for reader in readers:
+            for snapshotData in (dataMap or {}).get(reader.statsRequest.id) or []:
+                if snapshotData["timestamp"] > reader._lastTimestamp:
+                    # never blocks: one slow reader must not hold up the others
+                    if not reader.snapshots.put(Snapshot(snapshotData, reader.statsRequest), block=False):
+                        break
+                    reader._lastTimestamp = snapshotData["timestamp"]
+                    count += 1
+        return count
+
+    def _unregister(self, readers):
+        self.lock.acquire()
+        try:
+            for reader in readers:
+                if reader in self._readers:
+                    self._readers.remove(reader)
+        finally:
+            self.lock.release()
+        if readers:
+            self.session._unregisterStatsRequests([reader.statsRequest for reader in readers])
+
+    def close(self):
+        """Closes all the readers and unregisters their requests with one call."""
+        readers = [reader for reader in self._readers if not reader.isClosed]
+        for reader in readers:
+            reader.isClosed = True
+            # wakes up the consumers waiting for a snapshot (e.g. a StatsAsyncReader)
+            reader.snapshots.close()
+        self._unregister(readers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+class _MultiplexedStatsReader(StatsReader):
+    """A StatsReader whose snapshots are fetched by a StatsMultiplexer."""
+
+    def __init__(self, multiplexer, statsRequest, capacity, overflowPolicy):
+        super(_MultiplexedStatsReader, self).__init__(multiplexer.session, statsRequest, capacity, overflowPolicy)
+        self.multiplexer = multiplexer
+        self._sleepTime = min(self._sleepTime, multiplexer.pollInterval)
+
+    def _fill(self, block):
+        return self.multiplexer.pollIfDue()
+
+    def close(self):
+        if not self.isClosed:
+            self.isClosed = True
+            self.snapshots.close()
+            self.multiplexer._unregister([self])
+
 class StatsAsyncReader(object):
 
     """
@@ -1842,6 +4387,9 @@ class StatsAsyncReader(object):
     to be consumed in parallel to prevent losing timestamps.
     By default data is consumed until the reader is closed, optionally a number of poll count limit 
     can be specified to limit the number of read snapshots until the reader is closed automatically
+    The server is polled on a thread of its own, so a slow callback does not delay the polls: the snapshots
+    wait in the reader's SnapshotQueue, whose overflow policy and counters (statsReader.snapshots) decide
+    and report what happens when the callback falls behind.
     """
 
     def __init__(self, statsReader, callback, pollCountLimit=0, timeout=StatsReader.kDefaultTimeout):
@@ -1851,7 +4399,12 @@ class StatsAsyncReader(object):
         self.exception = None
         self.pollCountLimit = pollCountLimit
         self.currentPollCount = 0
+        self._stopped = False
 
+        statsReader._background = True
+        self.pollThread = threading.Thread(target = self._poll)
+        self.pollThread.daemon = True
+        self.pollThread.start()
         self.thread = threading.Thread(target = self._run)
         self.thread.start()        
 
@@ -1861,30 +4414,47 @@ class StatsAsyncReader(object):
         """
         self.exception = exception
 
+    def _poll(self):
+        statsReader = self.statsReader
+        while not statsReader.isClosed and not self._stopped:
+            try:
+                count = statsReader._fill(block=True)
+            except Exception, ex:
+                self._onExceptionCallback(ex)
+                # wakes up the callback thread
+                statsReader.snapshots.close()
+                break
+            if not count:
+                time.sleep(statsReader._sleepTime)
+
     def _run(self):
         lastSnapshot = None
         
-        while True:
-            try:
-                currentSnapshot = self.statsReader.getNextSnapshot(timeout = self.timeout)
-                if self.statsReader.isClosed:
-                    break
-                
-                self.callback(self, currentSnapshot, lastSnapshot)
-                lastSnapshot = currentSnapshot
-                
-                if (self.pollCountLimit > 0):
-                    # Limit the number of read polls
-                    self.currentPollCount += 1
-                    if (self.currentPollCount == self.pollCountLimit) :
+        try:
+            while True:
+                try:
+                    currentSnapshot = self.statsReader.getNextSnapshot(timeout = self.timeout)
+                    if self.statsReader.isClosed or currentSnapshot is None:
                         break
-            except Exception, ex:
-                self._onExceptionCallback(ex)
-                raise
+                    
+                    self.callback(self, currentSnapshot, lastSnapshot)
+                    lastSnapshot = currentSnapshot
+                    
+                    if (self.pollCountLimit > 0):
+                        # Limit the number of read polls
+                        self.currentPollCount += 1
+                        if (self.currentPollCount == self.pollCountLimit) :
+                            break
+                except Exception, ex:
+                    self._onExceptionCallback(ex)
+                    raise
+        finally:
+            self._stopped = True
 
     def close(self):
         self.statsReader.close()
         self.thread.join()
+        self.pollThread.join()
 
     def __getattr__(self, attribute):
         if "isClosed" == attribute:
@@ -1900,25 +4470,116 @@ class StatsAsyncReader(object):
         self.close()
    
 class Snapshot(object):
+    """A timestamped set of rows returned for a StatsRequest.
+
+    Cells can be read row by row (rows and _Row.value()) or a column at a time with column(), which
+    returns a typed array for numeric stats. Columns and row views are only built when first used.
+    """
+    kNotAvailable = "N/A"
+    kIntegerTypeCode = "l"
+    kFloatTypeCode = "d"
+
     def __init__(self, rawData, statsRequest):
         self.rawData = rawData
         self.statsRequest = statsRequest
-        self._columns = {}
-        
-        statIndex = 0;
-
-        for col in statsRequest.stats:
-            self._columns[col.definition] = statIndex
-            statIndex += 1
-
-        self.rows = [_Row(rowIndex, self.rawData["values"], self._columns) for rowIndex in range(0, len(self.rawData["values"]))]
+        # shared by all the snapshots of the request
+        self.columns = statsRequest.columns
+        self._columns = self.columns.indexes
+        self.rowCount = len(self.rawData["values"])
+        self._rows = None
+        self._cells = None
+        self._typedColumns = {}
         
     def __getattr__(self, attribute):
         if "timestamp" == attribute:
             return self.rawData["timestamp"]
 
+    @property
+    def rows(self):
+        """The list of rows of this snapshot. See _Row."""
+        if self._rows is None:
+            self._rows = [_Row(rowIndex, self.rawData["values"], self._columns, self) for rowIndex in range(self.rowCount)]
+        return self._rows
+
+    def column(self, statName, asNumpy=False):
+        """Returns all the values of a stat, in row order.
+
+        Numeric stats are returned as an array.array (integers or floats). Other stats are returned as a list.
+        Missing values ("N/A" or null) are 0, NaN or None respectively; use columnMask() to tell them apart.
+        @param statName: the definition of the stat, as used by _Row.value()
+        @param asNumpy: if True, return a numpy.ma.MaskedArray with the missing values masked (requires numpy)
+        """
+        data, mask = self._typedColumn(statName)
+        if not asNumpy:
+            return data
+        if numpy is None:
+            raise WebException("Snapshot.column(): numpy is required for asNumpy=True")
+        if isinstance(data, array.array):
+            values = numpy.frombuffer(data, dtype=numpy.int_ if data.typecode == self.kIntegerTypeCode else numpy.float64)
+        else:
+            values = numpy.array(data, dtype=object)
+        return numpy.ma.masked_array(values, mask=numpy.frombuffer(mask, dtype=numpy.uint8).astype(bool))
+
+    def columnMask(self, statName):
+        """Returns a bytearray with 1 for each row where the stat is not available, and 0 otherwise."""
+        return self._typedColumn(statName)[1]
+
+    def _typedColumn(self, statName):
+        # Builds (once) the (values, mask) pair of a column
+        result = self._typedColumns.get(statName)
+        if result is None:
+            if self._cells is None:
+                # transpose once: one tuple of cells per column
+                self._cells = zip(*self.rawData["values"]) or [()] * len(self.columns)
+            index = self._columns[statName]
+            result = self._typedColumns[statName] = self._buildColumn(self._cells[index], self.columns.typeCodes[index])
+        return result
+
+    @classmethod
+    def _buildColumn(cls, cells, typeCode=None):
+        # typeCode is the type code the schema gives for the column, if known
+        # fast path: columns of plain numbers convert entirely in C. The schema's type code is tried first.
+        typeCodes = [] if typeCode == StatColumns.kTextTypeCode else [cls.kIntegerTypeCode, cls.kFloatTypeCode]
+        if typeCode == cls.kFloatTypeCode:
+            typeCodes.reverse()
+        for candidate in typeCodes:
+            try:
+                return array.array(candidate, cells), bytearray(len(cells))
+            except (TypeError, OverflowError):
+                pass
+        mask = bytearray(1 if cell is None or cell == cls.kNotAvailable else 0 for cell in cells)
+        if typeCode == StatColumns.kTextTypeCode:
+            return [None if missing else cell for cell, missing in zip(cells, mask)], mask
+        numbers = cls._toNumbers(cell for cell, missing in zip(cells, mask) if not missing)
+        if numbers is None:
+            return [None if missing else cell for cell, missing in zip(cells, mask)], mask
+        if all(isinstance(number, (int, long)) and -sys.maxint - 1 <= number <= sys.maxint for number in numbers):
+            typeCode, filler = cls.kIntegerTypeCode, 0
+        else:
+            typeCode, filler = cls.kFloatTypeCode, float("nan")
+        numbers = iter(numbers)
+        return array.array(typeCode, (filler if missing else next(numbers) for missing in mask)), mask
+
+    @staticmethod
+    def _toNumbers(cells):
+        # Returns the cells as a list of numbers, or None if any of them is not numeric
+        result = []
+        for cell in cells:
+            if isinstance(cell, basestring):
+                try:
+                    cell = int(cell)
+                except ValueError:
+                    try:
+                        cell = float(cell)
+                    except ValueError:
+                        return None
+            elif isinstance(cell, bool) or not isinstance(cell, (int, long, float)):
+                return None
+            result.append(cell)
+        return result
+
     def getSummary(self):
-        result = "Query Id:%s, Group: %s, TS:%s, %s rows" %(self.statsRequest.id, self.statsRequest.syncGroup, self.timestamp, len(self.rows))
+        result = "Query Id:%s, Group: %s, TS:%s, %s rows" %(self.statsRequest.id, self.statsRequest.syncGroup, self.timestamp, self.rowCount)
         return result
 
     def printAsTable(self):
@@ -1962,14 +4623,15 @@ class Snapshot(object):
         return stat.definition
 
 class _Row(object):
-    def __init__(self, rowIndex, rawData, columns):
+    def __init__(self, rowIndex, rawData, columns, snapshot=None):
         self._rawData = rawData
         self._rowIndex = rowIndex
         self._columns = columns        
+        self._snapshot = snapshot
 
     def __getattr__(self, attribute):
         if "timestamp" == attribute:
-            return self._rawData["timestamp"]
+            return self._snapshot.timestamp
 
     def value(self, statName):
         return self._rawData[self._rowIndex][self._columns[statName]]
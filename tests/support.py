@@ -0,0 +1,55 @@
+#
+#   support.py
+#
+#   The base class of the tests run against an in-process MockServer (see ixia.mockserver).
+#
+#   Run the tests from the root of the repository with:
+#
+#       python -m unittest discover -s tests -t .
+#
+
+import shutil
+import tempfile
+import unittest
+
+from ixia.webapi import *
+from ixia.mockserver import MockServer
+
+
+class MockServerTestCase(unittest.TestCase):
+    """Starts a MockServer and connects to it before each test, and stops both after it.
+
+    @cvar kServerOptions: the MockServer parameters of the tests of the class
+    """
+    kServerOptions = {"testDuration": 0.05, "asyncDuration": 0.02}
+    kWaitStrategy = FixedIntervalWait(0.02)
+
+    def setUp(self):
+        self.server = self.startServer()
+        self.connection = self.connect(self.server)
+
+    def startServer(self, **options):
+        """Starts another MockServer, stopped after the test."""
+        server = MockServer(**dict(self.kServerOptions, **options)).start()
+        self.addCleanup(server.stop)
+        return server
+
+    def connect(self, server):
+        """Returns a Connection to server, closed after the test."""
+        connection = webApi.connect(server.url, MockServer.kApiVersion, None, MockServer.kUsername, MockServer.kPassword)
+        self.addCleanup(connection.close)
+        return connection
+
+    def startSession(self, connection=None):
+        """Creates and starts a session, stopped after the test."""
+        session = (connection or self.connection).createSession(MockServer.kSessionType)
+        session.waitStrategy = self.kWaitStrategy
+        session.startSession()
+        self.addCleanup(session.stopSession)
+        return session
+
+    def makeDirectory(self):
+        """Returns the path of a new temporary directory, deleted after the test."""
+        directory = tempfile.mkdtemp(prefix="ixia-test-")
+        self.addCleanup(shutil.rmtree, directory, True)
+        return directory
@@ -0,0 +1,145 @@
+#
+#   test_orchestrator.py
+#
+#   Session.runTestLoop() and the Orchestrator, against MockServers.
+#
+
+import os
+import threading
+import time
+
+from ixia.webapi import *
+from ixia.orchestrator import Orchestrator, TestJob, runSessionJobs
+from tests.support import MockServerTestCase
+
+
+class _ExportProbe(object):
+    # an exporter that records how many exports run at the same time, and on which threads
+    def __init__(self, seconds=0.05, failures=0):
+        self.seconds = seconds
+        self.failures = failures
+        self.calls = 0
+        self.inFlight = 0
+        self.maxInFlight = 0
+        self.threads = set()
+        self.lock = threading.Lock()
+
+    def __call__(self, session, testId):
+        with self.lock:
+            self.calls += 1
+            fails = self.calls <= self.failures
+            self.inFlight += 1
+            self.maxInFlight = max(self.maxInFlight, self.inFlight)
+            self.threads.add(threading.current_thread())
+        try:
+            time.sleep(self.seconds)
+            if fails:
+                raise WebException("Export of test %s failed" % testId)
+            return testId
+        finally:
+            with self.lock:
+                self.inFlight -= 1
+
+
+class RunTestLoopTest(MockServerTestCase):
+
+    def setUp(self):
+        super(RunTestLoopTest, self).setUp()
+        self.session = self.startSession()
+
+    def testSavesTheZipOfEachTest(self):
+        directory = os.path.join(self.makeDirectory(), "results")
+        results = self.session.runTestLoop(configNames=["first", "second"], exportDirectory=directory)
+        self.assertEqual([result.job.configName for result in results], ["first", "second"])
+        for result in results:
+            self.assertTrue(result.succeeded, result.error)
+            self.assertEqual(result.sessionId, self.session.sessionId)
+            self.assertEqual(result.download, os.path.join(directory, "%s-%s.zip" % (result.job.configName, result.testId)))
+            with open(result.download, "rb") as zipFile:
+                self.assertEqual(zipFile.read(), self.server.zipData())
+        self.assertEqual(self.server.sessions[self.session.sessionId]["testConfigName"], "second")
+
+    def testBoundsThePendingExports(self):
+        for maxPendingExports in [1, 2]:
+            # exports slower than the tests, so that they pile up
+            exporter = _ExportProbe(seconds=0.3)
+            results = self.session.runTestLoop(4, exporter=exporter, maxPendingExports=maxPendingExports)
+            self.assertEqual([result.download for result in results], [result.testId for result in results])
+            self.assertEqual(exporter.maxInFlight, maxPendingExports)
+            self.assertNotIn(threading.current_thread(), exporter.threads)
+
+    def testExportsInlineWithoutPendingExports(self):
+        exporter = _ExportProbe()
+        results = self.session.runTestLoop(3, exporter=exporter, maxPendingExports=0)
+        self.assertTrue(all(result.succeeded for result in results))
+        self.assertEqual(exporter.threads, set([threading.current_thread()]))
+
+    def testFailedExportDoesNotStopTheLoop(self):
+        results = self.session.runTestLoop(3, exporter=_ExportProbe(failures=1), maxPendingExports=0)
+        self.assertIsInstance(results[0].error, WebException)
+        self.assertIsNotNone(results[0].testId)
+        self.assertTrue(all(result.succeeded for result in results[1:]))
+
+    def testStopOnError(self):
+        startTest = self.session.startTest
+        calls = []
+        def failingSecondTest(*args, **kwArgs):
+            calls.append(None)
+            if len(calls) == 2:
+                raise WebException("The test could not start")
+            return startTest(*args, **kwArgs)
+        self.session.startTest = failingSecondTest
+        results = self.session.runTestLoop(4, stopOnError=True)
+        self.assertEqual(len(calls), 2)
+        self.assertTrue(results[0].succeeded)
+        self.assertEqual(str(results[1].error), "The test could not start")
+        for result in results[2:]:
+            self.assertIsNone(result.testId)
+            self.assertIn("A previous test failed", str(result.error))
+
+    def testRunSessionJobsUsesTheCallersSession(self):
+        seen = []
+        results = runSessionJobs(self.session, [TestJob("a"), TestJob("b")], downloader=lambda connection, job, testId: seen.append(job.name),
+                                 waitStrategy=self.kWaitStrategy)
+        self.assertEqual([result.sessionId for result in results], [self.session.sessionId] * 2)
+        self.assertEqual(sorted(seen), ["a", "b"])
+
+
+class OrchestratorTest(MockServerTestCase):
+
+    def setUp(self):
+        super(OrchestratorTest, self).setUp()
+        self.otherServer = self.startServer()
+        self.otherConnection = self.connect(self.otherServer)
+
+    def testRunsTheJobsOnAllTheServers(self):
+        directory = self.makeDirectory()
+        jobs = [TestJob("config %s" % index) for index in range(6)]
+        with Orchestrator([self.connection, self.otherConnection], maxTestsPerServer=[2, 1], resultDirectory=directory,
+                          waitStrategy=self.kWaitStrategy) as orchestrator:
+            results = orchestrator.run(jobs)
+        self.assertEqual([result.job for result in results], jobs)
+        for result in results:
+            self.assertTrue(result.succeeded, result.error)
+            self.assertIn(result.server, [self.connection.url, self.otherConnection.url])
+            self.assertTrue(os.path.isfile(result.download))
+        self.assertEqual(len(set(result.download for result in results)), len(jobs))
+
+    def testPinsSessionJobsToTheirServer(self):
+        session = self.startSession(self.otherConnection)
+        with Orchestrator([self.connection, self.otherConnection], waitStrategy=self.kWaitStrategy) as orchestrator:
+            self.assertRaises(ValueError, orchestrator.submit, TestJob(sessionId=session.sessionId))
+            result = orchestrator.run([TestJob(sessionId=session.sessionId, server=1)])[0]
+        self.assertTrue(result.succeeded, result.error)
+        self.assertEqual(result.sessionId, session.sessionId)
+        self.assertEqual(result.server, self.otherConnection.url)
+
+    def testKeepsResultFilesInTheResultDirectory(self):
+        directory = self.makeDirectory()
+        with Orchestrator(self.connection, resultDirectory=directory, waitStrategy=self.kWaitStrategy) as orchestrator:
+            result = orchestrator.run([TestJob("config", name="../outside/..")])[0]
+        self.assertTrue(result.succeeded, result.error)
+        self.assertEqual(os.path.dirname(result.download), directory)
+
+    def testRequiresDownloadThreadsToDownload(self):
+        self.assertRaises(ValueError, Orchestrator, self.connection, maxDownloads=0, resultDirectory=self.makeDirectory())
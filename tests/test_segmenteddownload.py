@@ -0,0 +1,84 @@
+#
+#   test_segmenteddownload.py
+#
+#   SegmentedDownload and the result downloads built on it, against a MockServer.
+#
+
+import os
+
+from ixia.webapi import *
+from ixia.mockserver import MockServer
+from tests.support import MockServerTestCase
+
+
+class SegmentedDownloadTest(MockServerTestCase):
+    kSegmentSize = StreamingDownload.kMinChunkSize
+    # three full segments and a short one
+    kServerOptions = dict(MockServerTestCase.kServerOptions, exportSize=3 * kSegmentSize + 1000)
+
+    def setUp(self):
+        super(SegmentedDownloadTest, self).setUp()
+        self.url = "configurations/%s/1/export" % MockServer.kSessionType
+        self.path = os.path.join(self.makeDirectory(), "download.bin")
+
+    def download(self, mode="w+b", prefix="", **kwArgs):
+        with open(self.path, "wb") as target:
+            target.write(prefix)
+        progress = []
+        kwArgs.setdefault("maxConnections", 3)
+        download = SegmentedDownload(self.connection, self.url, lambda *args: progress.append(args),
+                                     segmentSize=self.kSegmentSize, **kwArgs)
+        with open(self.path, mode) as target:
+            target.seek(len(prefix))
+            byteCount = download.toFile(target)
+            position = target.tell()
+        with open(self.path, "rb") as target:
+            return download, byteCount, position, target.read(), progress
+
+    def testDownloadsTheSegmentsConcurrently(self):
+        download, byteCount, position, data, progress = self.download()
+        self.assertTrue(download.segmented)
+        self.assertEqual(data, self.server.exportData())
+        self.assertEqual(byteCount, len(data))
+        self.assertEqual(position, len(data))
+        self.assertEqual(self.server.requestCounts["GET configurations/%s/{id}/export" % MockServer.kSessionType], 4)
+        self.assertEqual(progress[-1][:2], (len(data), len(data)))
+
+    def testWritesAfterTheCurrentPosition(self):
+        download, byteCount, position, data, progress = self.download("r+b", "header")
+        self.assertTrue(download.segmented)
+        self.assertEqual(data, "header" + self.server.exportData())
+        self.assertEqual(position, len(data))
+
+    def testStreamsIntoAppendModeFiles(self):
+        download, byteCount, position, data, progress = self.download("a+b", "existing content")
+        self.assertFalse(download.segmented)
+        self.assertEqual(data, "existing content" + self.server.exportData())
+
+    def testStreamsWithASingleConnection(self):
+        download, byteCount, position, data, progress = self.download(maxConnections=1)
+        self.assertFalse(download.segmented)
+        self.assertEqual(data, self.server.exportData())
+
+    def testRestoresTheFileWhenASegmentFails(self):
+        exportData = self.server.exportData
+        calls = []
+        def changingExport():
+            # the resource changes after the first segment, so the other ranges are refused (If-Range)
+            calls.append(None)
+            return exportData() if len(calls) == 1 else "changed"
+        self.server.exportData = changingExport
+        self.server.latencies["configurations/*/export"] = 0.05
+        try:
+            self.download("r+b", "header", resumeAttempts=0)
+            self.fail("The download should have failed.")
+        except WebException:
+            pass
+        self.assertEqual(os.path.getsize(self.path), len("header"))
+
+    def testStatsZipToFile(self):
+        testId = self.startSession().startTest().testId
+        with open(self.path, "w+b") as statsFile:
+            self.connection.getStatsCsvZipToFile(testId, statsFile, parallelConnections=2)
+        with open(self.path, "rb") as statsFile:
+            self.assertEqual(statsFile.read(), self.server.zipData())
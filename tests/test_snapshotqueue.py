@@ -0,0 +1,125 @@
+#
+#   test_snapshotqueue.py
+#
+#   The overflow policies of SnapshotQueue, and of the StatsReaders and StatsMultiplexers fed by a MockServer.
+#
+
+import threading
+import time
+import unittest
+
+from ixia.webapi import *
+from tests.support import MockServerTestCase
+
+
+class SnapshotQueueTest(unittest.TestCase):
+
+    def fill(self, overflowPolicy, count=5, capacity=3):
+        queue = SnapshotQueue(capacity, overflowPolicy)
+        accepted = [queue.put(index, block=False) for index in range(count)]
+        return queue, accepted, [queue.get() for _ in range(len(queue))]
+
+    def testBlockRefusesSnapshotsWhenFull(self):
+        queue, accepted, delivered = self.fill(OverflowPolicy.kBlock)
+        self.assertEqual(accepted, [True, True, True, False, False])
+        self.assertEqual(delivered, [0, 1, 2])
+        self.assertEqual(queue.counters(), {"received": 3, "delivered": 3, "dropped": 0, "coalesced": 0, "late": 0,
+                                            "queued": 0, "highWater": 3})
+
+    def testDropOldestKeepsTheNewestSnapshots(self):
+        queue, accepted, delivered = self.fill(OverflowPolicy.kDropOldest)
+        self.assertTrue(all(accepted))
+        self.assertEqual(delivered, [2, 3, 4])
+        self.assertEqual(queue.dropped, 2)
+        self.assertEqual(queue.received, 5)
+
+    def testCoalesceReplacesTheNewestSnapshot(self):
+        queue, accepted, delivered = self.fill(OverflowPolicy.kCoalesce)
+        self.assertTrue(all(accepted))
+        self.assertEqual(delivered, [0, 1, 4])
+        self.assertEqual(queue.coalesced, 2)
+
+    def testBlockWaitsForRoom(self):
+        queue = SnapshotQueue(1, OverflowPolicy.kBlock)
+        queue.put("first")
+        consumer = threading.Timer(0.1, queue.get)
+        consumer.start()
+        self.assertTrue(queue.put("second", timeout=5))
+        consumer.join()
+        self.assertEqual(queue.get(), "second")
+        self.assertTrue(queue.put("third"))
+        self.assertFalse(queue.put("fourth", timeout=0.05))
+
+    def testCloseWakesUpTheWaitingThreads(self):
+        queue = SnapshotQueue(1, OverflowPolicy.kBlock)
+        threading.Timer(0.1, queue.close).start()
+        startTime = time.time()
+        self.assertIsNone(queue.get(timeout=5))
+        self.assertLess(time.time() - startTime, 2)
+        self.assertFalse(queue.put("late"))
+
+    def testCountsLateSnapshots(self):
+        queue = SnapshotQueue(2, lateThreshold=0.05)
+        queue.put("snapshot")
+        time.sleep(0.1)
+        queue.get()
+        self.assertEqual(queue.late, 1)
+
+    def testRejectsInvalidSettings(self):
+        self.assertRaises(ValueError, SnapshotQueue, 0)
+        self.assertRaises(ValueError, SnapshotQueue, 1, "dropNewest")
+
+
+class StatsReaderOverflowTest(MockServerTestCase):
+    kServerOptions = dict(MockServerTestCase.kServerOptions, statsRows=4, statsInterval=0.02)
+    kStats = [StatKey("mix:Flow"), Stat("mix:Throughput")]
+
+    def setUp(self):
+        super(StatsReaderOverflowTest, self).setUp()
+        self.session = self.startSession()
+        self.session.startTest()
+
+    def testMultiplexedReaderDropsWhatItsConsumerMisses(self):
+        multiplexer = self.session.createStatsMultiplexer(0.02)
+        read, unread = multiplexer.register([StatsRequest(self.kStats), StatsRequest(self.kStats)], capacity=2,
+                                            overflowPolicy=OverflowPolicy.kDropOldest)
+        try:
+            # the polls made for one reader also feed the other one
+            timestamps = []
+            while len(timestamps) < 5:
+                time.sleep(0.03)
+                timestamps.append(read.getNextSnapshot().timestamp)
+            self.assertEqual(len(unread.snapshots), 2)
+            self.assertGreaterEqual(unread.snapshots.dropped, 3)
+            self.assertEqual([unread.getNextSnapshot().timestamp for _ in range(2)], timestamps[-2:])
+        finally:
+            multiplexer.close()
+        self.assertTrue(read.snapshots.isClosed)
+        self.assertTrue(unread.snapshots.isClosed)
+
+    def testSlowCallbacksApplyTheOverflowPolicy(self):
+        for overflowPolicy, counter in [(OverflowPolicy.kDropOldest, "dropped"), (OverflowPolicy.kCoalesce, "coalesced")]:
+            multiplexer = self.session.createStatsMultiplexer(0.02)
+            reader = multiplexer.register([StatsRequest(self.kStats)], capacity=2, overflowPolicy=overflowPolicy)[0]
+            timestamps = []
+            def slowCallback(asyncReader, currentSnapshot, lastSnapshot):
+                timestamps.append(currentSnapshot.timestamp)
+                time.sleep(0.1)
+            asyncReader = StatsAsyncReader(reader, slowCallback, pollCountLimit=4)
+            asyncReader.thread.join(10)
+            asyncReader.close()
+            self.assertIsNone(asyncReader.exception)
+            self.assertEqual(len(timestamps), 4)
+            self.assertEqual(timestamps, sorted(set(timestamps)))
+            self.assertLessEqual(reader.snapshots.highWater, 2)
+            self.assertGreater(reader.snapshots.counters()[counter], 0, overflowPolicy)
+
+    def testSnapshotsHoldTheServerRows(self):
+        reader = self.session.registerStatsRequest(StatsRequest(self.kStats), capacity=1, overflowPolicy=OverflowPolicy.kDropOldest)
+        try:
+            snapshot = reader.getNextSnapshot()
+        finally:
+            reader.close()
+        self.assertEqual(snapshot.rowCount, 4)
+        self.assertEqual(list(snapshot.column("Flow")), ["flow 0", "flow 1", "flow 2", "flow 3"])
+        self.assertEqual(list(snapshot.column("Throughput")), [1, 11, 21, 31])
@@ -0,0 +1,80 @@
+#
+#   test_statsquery.py
+#
+#   StatsQuery.compile() against the stats schema of a MockServer, and the readers of registered queries.
+#
+
+from ixia.webapi import *
+from tests.support import MockServerTestCase
+
+
+class StatsQueryTest(MockServerTestCase):
+    kServerOptions = dict(MockServerTestCase.kServerOptions, statsRows=5, testDuration=10)
+
+    def setUp(self):
+        super(StatsQueryTest, self).setUp()
+        self.session = self.startSession()
+        self.testId = self.session.startTest().testId
+        self.schema = self.connection.getStatsSchema(self.testId)
+
+    @staticmethod
+    def byGroup(statsRequests):
+        return dict((statsRequest.groups[0].stats[0].group, statsRequest.groups[0]) for statsRequest in statsRequests)
+
+    def testCompilesOneRequestPerGroup(self):
+        query = StatsQuery(StatKey("mix:Flow"), "mix:Throughput", "application:Transactions", syncGroup="sync", cacheSize=3)
+        statsRequests = query.compile(self.schema)
+        self.assertEqual(len(statsRequests), 2)
+        self.assertEqual([statsRequest.syncGroup for statsRequest in statsRequests], ["sync", "sync"])
+        self.assertEqual([statsRequest.cacheSize for statsRequest in statsRequests], [3, 3])
+        groups = self.byGroup(statsRequests)
+        self.assertEqual([stat.name for stat in groups["mix"].stats], ["Flow", "Throughput"])
+        self.assertEqual([stat.name for stat in groups["application"].stats], ["Transactions"])
+        self.assertEqual(statsRequests[0].columns.types, ("string", "double"))
+
+    def testAppliesEachConditionToTheGroupOfItsStat(self):
+        query = StatsQuery("mix:Flow", "mix:Throughput", "application:Transactions")
+        query.where("Throughput > 10 and (Flow = 'flow 1' or Flow = 'flow 2')").where("Transactions >= 1e3")
+        groups = self.byGroup(query.compile(self.schema))
+        mixFilter = groups["mix"].filter
+        self.assertEqual((mixFilter.leftItem.leftItem, mixFilter.leftItem.operator, mixFilter.leftItem.rightItem), ("Throughput", ">", 10))
+        self.assertEqual(mixFilter.rightItem.operator, "or")
+        self.assertEqual(mixFilter.rightItem.leftItem.rightItem, "flow 1")
+        applicationFilter = groups["application"].filter
+        self.assertEqual((applicationFilter.leftItem, applicationFilter.operator, applicationFilter.rightItem), ("Transactions", ">=", 1000))
+
+    def testOrdersAndLimitsTheRows(self):
+        statsRequests = StatsQuery("mix:Flow", "mix:Throughput").top(3, "Throughput").compile(self.schema)
+        group = statsRequests[0].groups[0]
+        self.assertEqual([(column.definition, column.ascending) for column in group.orderBy], [("Throughput", OrderDirection.kDesc)])
+        self.assertEqual(statsRequests[0].limit, 3)
+
+    def testResolvesAmbiguousNamesWithTheirGroup(self):
+        self.assertRaises(ValueError, StatsQuery("mix:Throughput", "application:Throughput").orderBy("Throughput").compile)
+        self.assertRaises(ValueError, StatsQuery("mix:Throughput", "application:Throughput").where("Throughput > 1").compile)
+        query = StatsQuery("mix:Throughput", "application:Throughput")
+        query.orderBy("-application:Throughput", OrderByStat(Stat("mix:Throughput"), OrderDirection.kAsc))
+        groups = self.byGroup(query.compile(self.schema))
+        self.assertEqual([column.ascending for column in groups["mix"].orderBy], [OrderDirection.kAsc])
+        self.assertEqual([column.ascending for column in groups["application"].orderBy], [OrderDirection.kDesc])
+
+    def testRejectsStatsMissingFromTheSchema(self):
+        self.assertRaises(ValueError, StatsQuery("mix:Latency").compile, self.schema)
+        self.assertRaises(ValueError, StatsQuery("flows:Throughput").compile, self.schema)
+        self.assertRaises(ValueError, StatsQuery("mix:Throughput").where("Flow = 'flow 1'").compile, self.schema)
+        self.assertRaises(ValueError, StatsQuery("mix:Throughput").where("Throughput >").compile, self.schema)
+        # without a schema, only the references to stats that are not selected are checked
+        self.assertEqual(len(StatsQuery("mix:Latency").compile()), 1)
+
+    def testRegisteredQueriesReturnTheRowsOfEachGroup(self):
+        readers = self.session.registerStatsQuery(StatsQuery(StatKey("mix:Flow"), "mix:Throughput", "application:Transactions").limit(3))
+        try:
+            mixSnapshot, applicationSnapshot = [reader.getNextSnapshot() for reader in readers]
+        finally:
+            for reader in readers:
+                reader.close()
+        self.assertEqual(mixSnapshot.rowCount, 3)
+        self.assertEqual(list(mixSnapshot.column("Flow")), ["flow 0", "flow 1", "flow 2"])
+        self.assertEqual(list(mixSnapshot.column("Throughput")), [1.0, 11.0, 21.0])
+        self.assertEqual(applicationSnapshot.rowCount, 3)
+        self.assertEqual(self.server.requestCounts["GET results/{id}/schema"], 1)
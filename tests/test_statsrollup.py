@@ -0,0 +1,143 @@
+#
+#   test_statsrollup.py
+#
+#   The aggregates of StatsRollupEngine, fed with scripted snapshots and with the snapshots of a MockServer.
+#
+
+import unittest
+
+from ixia.webapi import *
+from ixia.statsrollup import StatsAggregate, StatsRollupEngine
+from tests.support import MockServerTestCase
+
+
+class StatsAggregateTest(unittest.TestCase):
+
+    def aggregateOf(self, samples):
+        aggregate = StatsAggregate()
+        previous = None
+        for timestamp, value in samples:
+            if previous is None:
+                aggregate.add(timestamp, value)
+            else:
+                aggregate.add(timestamp, value, value - previous[1], (timestamp - previous[0]) / 1000.0)
+            previous = timestamp, value
+        return aggregate
+
+    def testComputesEveryAggregation(self):
+        # a counter that is reset after its third sample
+        aggregate = self.aggregateOf([(0, 10), (1000, 30), (2000, 60), (3000, 0), (4000, 20)])
+        self.assertEqual((aggregate.count, aggregate.sum, aggregate.min, aggregate.max), (5, 120, 0, 60))
+        self.assertEqual((aggregate.first, aggregate.last, aggregate.start, aggregate.end), (10, 20, 0, 4000))
+        self.assertEqual(aggregate.value(StatAggregation.kNone), 20)
+        self.assertEqual(aggregate.value(StatAggregation.kSum), 120)
+        self.assertEqual(aggregate.value(StatAggregation.kAverage), 24.0)
+        self.assertEqual(aggregate.value(StatAggregation.kRate), 2.5)
+        self.assertEqual(aggregate.value(StatAggregation.kPositiveRate), 17.5)
+        self.assertEqual(aggregate.value(StatAggregation.kMinRate), -60)
+        self.assertEqual(aggregate.value(StatAggregation.kMaxRate), 30)
+        self.assertEqual(aggregate.value(StatAggregation.kPositiveMinRate), 0)
+        self.assertRaises(ValueError, aggregate.value, "median")
+
+    def testMergesConsecutiveSpans(self):
+        samples = [(timestamp * 1000, value) for timestamp, value in enumerate([5, 8, 2, 9, 9, 14])]
+        whole = self.aggregateOf(samples)
+        merged = self.aggregateOf(samples[:3])
+        # the change from the last sample of a span to the first of the next one belongs to the next span
+        later = StatsAggregate()
+        for (previousTimestamp, previousValue), (timestamp, value) in zip(samples[2:], samples[3:]):
+            later.add(timestamp, value, value - previousValue, (timestamp - previousTimestamp) / 1000.0)
+        merged.merge(later)
+        self.assertEqual(merged.asDict(), whole.asDict())
+        self.assertEqual(StatsAggregate().merge(whole).asDict(), whole.asDict())
+
+
+class StatsRollupEngineTest(unittest.TestCase):
+    kStatsRequest = StatsRequest([StatKey("mix:Flow"), Stat("mix:Bytes Sent", StatAggregation.kRate), Stat("mix:Throughput")])
+
+    def snapshot(self, seconds, rows):
+        return Snapshot({"timestamp": int(seconds * 1000), "values": [[flow, bytesSent, throughput] for flow, bytesSent, throughput in rows]},
+                        self.kStatsRequest)
+
+    def feed(self, engine, seconds):
+        # "flow a" sends 100 bytes per second at a throughput of 800; "flow b" appears after 10 seconds
+        for second in seconds:
+            rows = [["flow a", 100 * second, 800]]
+            if second >= 10:
+                rows.append(["flow b", 50 * (second - 10), 400])
+            engine.update(self.snapshot(second, rows))
+
+    def testAggregatesEachRow(self):
+        engine = StatsRollupEngine(self.kStatsRequest, rawSeconds=5, tiers=[(5, 4), (20, 10)])
+        self.feed(engine, range(30))
+        self.assertEqual(sorted(engine.keys()), [("flow a",), ("flow b",)])
+        total = engine.total(("flow a",), "Bytes Sent")
+        self.assertEqual((total.count, total.first, total.last), (30, 0, 2900))
+        self.assertEqual(total.rate, 100)
+        self.assertEqual(engine.total(("flow b",), "Throughput").count, 20)
+        self.assertEqual(engine.summary(), {("flow a",): {"Bytes Sent": 100, "Throughput": 800},
+                                            ("flow b",): {"Bytes Sent": 50, "Throughput": 400}})
+        self.assertEqual(engine.summary(StatAggregation.kMax)[("flow b",)]["Bytes Sent"], 950)
+
+    def testKeepsTheRecentRawSamplesAndBuckets(self):
+        engine = StatsRollupEngine(self.kStatsRequest, rawSeconds=5, tiers=[(5, 4), (20, 10)])
+        self.feed(engine, range(60))
+        raw = engine.raw(("flow a",), "Bytes Sent")
+        self.assertEqual([value for _, value in raw], [100 * second for second in range(54, 60)])
+        fineBuckets = engine.buckets(5, ("flow a",), "Bytes Sent")
+        self.assertEqual([start for start, _ in fineBuckets], [40000, 45000, 50000, 55000])
+        self.assertEqual([bucket.count for _, bucket in fineBuckets], [5, 5, 5, 5])
+        self.assertEqual([start for start, _ in engine.buckets(20, ("flow a",), "Bytes Sent")], [0, 20000, 40000])
+        self.assertRaises(ValueError, engine.buckets, 10, ("flow a",), "Bytes Sent")
+
+    def testAggregatesSpansAcrossTiers(self):
+        engine = StatsRollupEngine(self.kStatsRequest, rawSeconds=5, tiers=[(5, 4), (20, 10)])
+        self.feed(engine, range(60))
+        # the older part of the span comes from the coarse buckets, the recent part from the fine ones
+        aggregate = engine.aggregate(("flow a",), "Bytes Sent", 0, 59000)
+        self.assertEqual((aggregate.count, aggregate.first, aggregate.last), (60, 0, 5900))
+        self.assertEqual(aggregate.asDict(), engine.total(("flow a",), "Bytes Sent").asDict())
+        recent = engine.aggregate(("flow a",), "Bytes Sent", 50000, 59000)
+        self.assertEqual((recent.count, recent.first, recent.last), (10, 5000, 5900))
+        self.assertIsNone(engine.aggregate(("flow c",), "Bytes Sent", 0, 59000))
+
+    def testEvictsTheRowsNotSeenRecently(self):
+        engine = StatsRollupEngine(self.kStatsRequest, rawSeconds=5, tiers=[(5, 4)])
+        self.feed(engine, range(12))
+        for second in range(12, 40):
+            engine.update(self.snapshot(second, [["flow b", 50 * (second - 10), 400]]))
+        self.assertEqual(engine.keys(), [("flow b",)])
+        self.assertEqual(engine.evictedKeyCount, 1)
+        self.assertIsNone(engine.total(("flow a",), "Bytes Sent"))
+
+    def testCapsTheNumberOfRows(self):
+        engine = StatsRollupEngine(self.kStatsRequest, maxKeys=2)
+        for second in range(5):
+            engine.update(self.snapshot(second, [["flow %s" % second, second, second]]))
+        self.assertEqual(sorted(engine.keys()), [("flow 3",), ("flow 4",)])
+        self.assertEqual(engine.evictedKeyCount, 3)
+
+
+class ServerRollupTest(MockServerTestCase):
+    kServerOptions = dict(MockServerTestCase.kServerOptions, statsRows=3, testDuration=10)
+
+    def testRollsUpTheSnapshotsOfAReader(self):
+        session = self.startSession()
+        session.startTest()
+        statsRequest = StatsRequest([StatKey("mix:Flow"), Stat("mix:Throughput"), Stat("mix:Bytes Sent", StatAggregation.kSum)])
+        engine = StatsRollupEngine(statsRequest)
+        updates = []
+        def onUpdate(asyncReader, rollupEngine):
+            updates.append(rollupEngine.snapshotCount)
+        reader = session.registerStatsRequest(statsRequest)
+        asyncReader = StatsAsyncReader(reader, engine.asCallback(onUpdate), pollCountLimit=4)
+        asyncReader.thread.join(10)
+        asyncReader.close()
+        self.assertIsNone(asyncReader.exception)
+        self.assertEqual(engine.snapshotCount, 4)
+        self.assertEqual(updates, [1, 2, 3, 4])
+        self.assertEqual(sorted(engine.keys()), [("flow 0",), ("flow 1",), ("flow 2",)])
+        # the mock server returns the same values in every snapshot
+        self.assertEqual(engine.summary()[("flow 1",)], {"Throughput": 11.0, "Bytes Sent": 4 * 12})
+        total = engine.total(("flow 2",), "Throughput")
+        self.assertEqual((total.count, total.min, total.max, total.delta), (4, 21, 21, 0))